@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Memory benchmark for hydrated model instances: regular (__dict__ based) vs `Meta.compact = True` instances.
+
+Run from the package root (Python 3, uses tracemalloc):
+
+    PYTHONPATH=. python benchmarks/bench_memory.py [rows]
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+import gc
+import sys
+import time
+import tracemalloc
+
+import ezspanner
+from ezspanner.models import SpannerModelRegistry
+
+
+class BenchRow(ezspanner.SpannerModel):
+    class Meta:
+        table = 'bench_row'
+        pk = ['id']
+
+    id = ezspanner.IntField()
+    tenant_id = ezspanner.IntField()
+    name = ezspanner.StringField(length=100, null=True)
+    counter = ezspanner.IntField(null=True)
+    enabled = ezspanner.BoolField()
+
+
+class BenchRowCompact(BenchRow):
+    class Meta:
+        table = 'bench_row_compact'
+        pk = ['id']
+        compact = True
+
+
+FIELD_NAMES = tuple(f.name for f in BenchRow._meta.local_fields)
+
+
+def make_values(i):
+    return {'id': i, 'tenant_id': i % 100, 'name': 'row', 'counter': i, 'enabled': True}
+
+
+def hydrate(model, rows):
+    field_names = tuple(f.name for f in model._meta.local_fields)
+    return [model._from_row(None, field_names, [row[name] for name in field_names]) for row in rows]
+
+
+def bench(name, model, rows):
+    gc.collect()
+    tracemalloc.start()
+    start = time.time()
+    instances = hydrate(model, rows)
+    seconds = time.time() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print('%-10s %8.1f bytes/row %8.2f us/row' % (name, size / len(rows), seconds / len(rows) * 1e6))
+    del instances
+    return size
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    # share the row values, only the per-instance overhead is measured
+    rows = [make_values(i) for i in range(count)]
+
+    regular = bench('regular', BenchRow, rows)
+    compact = bench('compact', BenchRowCompact, rows)
+    print('memory saved: %.0f%%' % (100 - compact * 100.0 / regular))
+
+    for model in (BenchRow, BenchRowCompact):
+        SpannerModelRegistry.registered_models.pop(model._meta.table, None)
+
+
+if __name__ == '__main__':
+    main()
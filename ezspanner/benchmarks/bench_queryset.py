@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmarks for SpannerQuerySet construction.
+
+Run from the package root:
+
+    PYTHONPATH=. python benchmarks/bench_queryset.py
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+import copy
+import timeit
+
+from ezspanner.query import SpannerQuerySet
+from ezspanner.query_utils import Q, F
+from ezspanner.tests.v1.helper import TestModelA, TestModelB
+
+
+class DeepCopyQuerySet(SpannerQuerySet):
+    """ Queryset that clones like ezspanner <= 0.0.1 did: copy.deepcopy on every chained call. """
+
+    def _clone(self):
+        return copy.deepcopy(self)
+
+
+def chain_10(qs):
+    return qs \
+        .filter(id_b=1) \
+        .filter(Q(value_field_x=2) | Q(value_field_y=3)) \
+        .exclude(value_field_z='x') \
+        .join(TestModelA, on=dict(id_a=F(TestModelB, 'id_a'))) \
+        .values('id_b', 'value_field_x') \
+        .filter(id_a__gte=4) \
+        .index('over9000') \
+        .filter_or(value_field_y__lt=5) \
+        .values('value_field_y') \
+        .filter(value_field_x__lte=6)
+
+
+def bench(name, qs, number=2000):
+    seconds = min(timeit.repeat(lambda: chain_10(qs), number=number, repeat=3))
+    print('%-30s %8.2f us/chain' % (name, seconds / number * 1e6))
+    return seconds
+
+
+def main():
+    before = bench('deepcopy (before)', DeepCopyQuerySet(TestModelB))
+    after = bench('_clone (after)', SpannerQuerySet(TestModelB))
+    print('speedup: %.1fx' % (before / after))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the pure python hot paths: queryset construction, sql compilation, row hydration, key reads and
+mutation packing. All benchmarks run against the in-memory FakeDatabase of the test suite, no Cloud Spanner
+instance is needed.
+
+Run from the package root:
+
+    PYTHONPATH=. python benchmarks/bench_suite.py [--rows 100000] [--save baseline.json] [--compare baseline.json]
+
+`--compare` exits with status 1 if any benchmark got slower than `--threshold` (default 20%) compared to the saved
+baseline, results are only comparable on the same machine and python version.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+import argparse
+import json
+import sys
+import timeit
+from collections import OrderedDict
+
+from ezspanner.mutations import OP_INSERT, OP_UPDATE, build_mutations, split_mutations
+from ezspanner.query import SpannerQuerySet, statement_cache
+from ezspanner.query_utils import Q, F
+from ezspanner.tests.v1.helper import FakeDatabase, TestModelA, TestModelB
+
+from bench_queryset import chain_10
+
+BENCHMARKS = OrderedDict()
+
+
+def benchmark(name, repeat=5, number=1):
+    """
+    Register `func(rows)`, it is called once with the row count and returns the function that is timed.
+    """
+    def decorator(func):
+        BENCHMARKS[name] = (func, repeat, number)
+        return func
+    return decorator
+
+
+def make_rows(count):
+    # model_a rows: id_a, field_int_not_null, field_int_null, field_string_not_null, field_string_null
+    return [[i, i % 100, None if i % 3 else i, i, 'value %s' % i] for i in range(count)]
+
+
+def make_instances(count):
+    return [TestModelA(id_a=i, field_int_not_null=i % 100, field_int_null=None, field_string_not_null=i,
+                       field_string_null='value %s' % i) for i in range(count)]
+
+
+def queryset(database):
+    qs = SpannerQuerySet(TestModelA)
+    qs.conn = database
+    return qs
+
+
+@benchmark('queryset construction (10 chained calls)', number=1000)
+def bench_construction(rows):
+    qs = SpannerQuerySet(TestModelB)
+    return lambda: chain_10(qs)
+
+
+@benchmark('sql compilation (uncached)', number=1000)
+def bench_compile(rows):
+    qs = chain_10(SpannerQuerySet(TestModelB)).filter(Q(id_b__gt=1) & ~Q(value_field_x=F('value_field_y')))
+    return lambda: qs._build_query()
+
+
+@benchmark('sql compilation (statement cache)', number=1000)
+def bench_compile_cached(rows):
+    qs = chain_10(SpannerQuerySet(TestModelB))
+    qs._compile()
+
+    def run():
+        qs._compiled = None
+        qs._compile()
+    return run
+
+
+@benchmark('hydrate rows (model instances)')
+def bench_hydrate(rows):
+    qs = queryset(FakeDatabase(rows=make_rows(rows))).filter(id_a__gte=0)
+    return lambda: list(qs.execute())
+
+
+@benchmark('hydrate rows (raw)')
+def bench_hydrate_raw(rows):
+    qs = queryset(FakeDatabase(rows=make_rows(rows))).filter(id_a__gte=0)
+    return lambda: list(qs.execute(raw=True))
+
+
+@benchmark('read by key (get_many)')
+def bench_get_many(rows):
+    database = FakeDatabase(rows=make_rows(rows))
+    keys = [(i,) for i in range(rows)]
+    return lambda: queryset(database).get_many(keys)
+
+
+@benchmark('mutation packing (insert)')
+def bench_pack_insert(rows):
+    objs = make_instances(rows)
+    return lambda: split_mutations(build_mutations(OP_INSERT, objs))
+
+
+@benchmark('mutation packing (update 2 fields)')
+def bench_pack_update(rows):
+    objs = make_instances(rows)
+    return lambda: split_mutations(build_mutations(OP_UPDATE, objs, ['field_int_null', 'field_string_null']))
+
+
+@benchmark('bulk_create (fake commit)')
+def bench_bulk_create(rows):
+    database = FakeDatabase()
+    objs = make_instances(rows)
+
+    def run():
+        del database.commits[:]
+        queryset(database).bulk_create(objs)
+    return run
+
+
+def run_benchmarks(rows, names=None):
+    """
+    :return: benchmark name -> best seconds per call
+    """
+    results = OrderedDict()
+    for name, (func, repeat, number) in BENCHMARKS.items():
+        if names and not any(n in name for n in names):
+            continue
+        statement_cache.clear()
+        timed = func(rows)
+        results[name] = min(timeit.repeat(timed, number=number, repeat=repeat)) / number
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('names', nargs='*', help='only run benchmarks whose name contains one of these strings')
+    parser.add_argument('--rows', type=int, default=100000, help='rows per hydration / mutation benchmark')
+    parser.add_argument('--save', help='write the results to this json file')
+    parser.add_argument('--compare', help='compare with the results in this json file')
+    parser.add_argument('--threshold', type=float, default=0.2, help='max allowed slowdown, 0.2 = 20%%')
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+
+    results = run_benchmarks(args.rows, args.names)
+    regressions = []
+    for name, seconds in results.items():
+        line = '%-45s %12.2f us' % (name, seconds * 1e6)
+        if name in baseline:
+            change = seconds / baseline[name] - 1
+            line += '  %+6.1f%%' % (change * 100)
+            if change > args.threshold:
+                regressions.append(name)
+                line += '  REGRESSION'
+        print(line)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'rows': args.rows, 'python': sys.version, 'results': results}, f, indent=2)
+
+    if regressions:
+        print('%s benchmark(s) slower than the baseline by more than %.0f%%' % (len(regressions),
+                                                                                args.threshold * 100))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
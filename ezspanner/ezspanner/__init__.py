@@ -6,5 +6,9 @@ from .query import SpannerQuerySet
 from .models import register, SpannerModel, SpannerModelRegistry, SpannerQuerySet
 from .indices import SpannerIndex, PrimaryKey
 from .fields import BoolField, IntField, StringField, TimestampField
+from .context import snapshot
+from .transaction import atomic
+from .writebehind import write_behind
+from .aggregates import Count, Sum, Min, Max, Avg, ApproxCountDistinct
 
 
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+Index advisor: picks the secondary index that serves a queryset's filters best, see SpannerQuerySet.auto_index.
+
+An index is a candidate if it covers every column of the base model that the query uses (selected, filtered,
+ordered or joined on) with its key, STORING and primary key columns - Spanner would have to join back to the base
+table otherwise. Candidates (and the base table) are ranked by the number of leading key columns that are matched by
+equality (`=`, `IN`) predicates, plus one if the next key column has a range predicate. Only conditions that are
+ANDed on the top level of the filter can be used to seek, OR / NOT branches are ignored.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import six
+
+from .query_utils import LOOKUP_SEP, Q, F
+
+EQUALITY_OPS = frozenset(['eq', 'in'])
+RANGE_OPS = frozenset(['gt', 'gte', 'lt', 'lte'])
+
+
+class IndexAdvice(object):
+    """
+    Result of advise_index.
+    """
+
+    def __init__(self, index, key_columns, range_column=None, full_scan=False, uncovered=None):
+        """
+        :param index: name of the chosen index, None for the base table
+        :param key_columns: leading key columns matched by equality predicates
+        :param range_column: next key column, matched by a range predicate
+        :param full_scan: True if the filters can't be used to seek in the base table or any covering index
+        :param uncovered: index name -> columns it doesn't cover, for indices with a better match
+        """
+        self.index = index
+        self.key_columns = tuple(key_columns)
+        self.range_column = range_column
+        self.full_scan = full_scan
+        self.uncovered = uncovered or {}
+
+    def __repr__(self):
+        return '<IndexAdvice: %s (%s)%s>' % (
+            self.index or 'base table',
+            ', '.join(self.key_columns + ((self.range_column + ' range',) if self.range_column else ())),
+            ' full scan' if self.full_scan else '')
+
+    @property
+    def score(self):
+        return len(self.key_columns) + (1 if self.range_column else 0)
+
+
+def get_seek_predicates(qs):
+    """
+    Collect the base model's columns with predicates that can be used to seek.
+
+    :type qs: ezspanner.query.SpannerQuerySet
+    :rtype: tuple[set, set]
+    :return: equality columns, range columns
+    """
+    equality, ranges = set(), set()
+    if qs.where is None or qs.where.negated or (qs.where.connector != Q.AND and len(qs.where) > 1):
+        return equality, ranges
+
+    pending = [qs.where]
+    while pending:
+        q = pending.pop()
+        for child in q.children:
+            if isinstance(child, Q):
+                if not child.negated and (child.connector == Q.AND or len(child) == 1):
+                    pending.append(child)
+                continue
+            column, _ = child
+            if isinstance(column, F) or (q.model is not None and q.model is not qs.model):
+                continue
+            field_name, _, op = column.rpartition(LOOKUP_SEP) if LOOKUP_SEP in column else (column, None, 'eq')
+            if field_name == 'pk' and op in EQUALITY_OPS:
+                equality.update(qs.model._meta.primary.get_field_names())
+            elif op in EQUALITY_OPS:
+                equality.add(field_name)
+            elif op in RANGE_OPS:
+                ranges.add(field_name)
+    return equality, ranges
+
+
+def get_used_columns(qs):
+    """
+    Columns of the base model that the query reads.
+
+    :type qs: ezspanner.query.SpannerQuerySet
+    :rtype: set
+    """
+    columns = set(field_name for model_or_alias, field_name in qs._get_select_targets() if model_or_alias == qs.model)
+    columns.update(field_name for model_or_alias, field_name, _ in qs.ordering if model_or_alias == qs.model)
+
+    def collect(q):
+        for child in q.children:
+            if isinstance(child, Q):
+                collect(child)
+                continue
+            column, value = child
+            if isinstance(column, F):
+                if column.model_or_alias == qs.model:
+                    columns.add(column.column.split(LOOKUP_SEP)[0])
+            elif q.model is None or q.model is qs.model:
+                field_name = column.split(LOOKUP_SEP)[0]
+                if field_name == 'pk':
+                    columns.update(qs.model._meta.primary.get_field_names())
+                else:
+                    columns.add(field_name)
+            if isinstance(value, F) and value.model_or_alias in (None, qs.model):
+                columns.add(value.column)
+
+    if qs.where is not None:
+        collect(qs.where)
+    for join_data in six.itervalues(qs.joins):
+        collect(join_data['on'])
+    for aggregate in six.itervalues(qs.annotations):
+        if aggregate.target is not None and aggregate.target[0] == qs.model:
+            columns.add(aggregate.target[1])
+    return columns
+
+
+def match_key(key_columns, equality, ranges):
+    """
+    :return: (leading key columns matched by equality predicates, next key column if it has a range predicate)
+    """
+    matched = []
+    for column in key_columns:
+        if column in equality:
+            matched.append(column)
+        else:
+            return matched, column if column in ranges else None
+    return matched, None
+
+
+def advise_index(qs):
+    """
+    Choose the best covering index for the queryset's filters.
+
+    :type qs: ezspanner.query.SpannerQuerySet
+    :rtype: IndexAdvice
+    """
+    meta = qs.model._meta
+    primary_columns = list(meta.primary.get_field_names())
+    equality, ranges = get_seek_predicates(qs)
+
+    best = IndexAdvice(None, *match_key(primary_columns, equality, ranges))
+    if not equality and not ranges:
+        # unfiltered queries scan the table on purpose
+        best.full_scan = qs.where is not None
+        return best
+
+    used = get_used_columns(qs)
+    uncovered = {}
+    for index in meta.indices:
+        # secondary indices are keyed by their fields followed by the primary key
+        index_columns = list(index.get_field_names())
+        key_columns = index_columns + [column for column in primary_columns if column not in index_columns]
+        advice = IndexAdvice(index.name, *match_key(key_columns, equality, ranges))
+        if advice.score <= best.score:
+            continue
+        missing = used - set(key_columns) - set(index.storing)
+        if missing:
+            uncovered[index.name] = (advice.score, sorted(missing))
+        else:
+            best = advice
+
+    best.uncovered = dict((name, missing) for name, (score, missing) in six.iteritems(uncovered)
+                          if score > best.score)
+    best.full_scan = best.score == 0
+    return best
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Aggregate expressions, computed by Cloud Spanner, see SpannerQuerySet.aggregate / annotate / group_by.
+
+```
+TestModelB.objects.aggregate(Count('*'), total=Sum('value_field_x'))
+# {'count': 12, 'total': 74}
+
+TestModelB.objects.values('id_a').annotate(total=Sum('value_field_x')).having(total__gt=10).order_by('-total')
+# [{'id_a': 1, 'total': 42}, {'id_a': 3, 'total': 12}]
+```
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+import copy
+
+import six
+from google.cloud.spanner import FLOAT64_PARAM_TYPE, INT64_PARAM_TYPE
+
+from .exceptions import QueryError
+from .query_utils import F
+
+
+class Aggregate(object):
+    """
+    Base class of aggregate functions over a column (or `*`).
+    """
+    function = None
+    # param type of the result, None: the type of the aggregated field
+    result_type = None
+    allow_star = False
+
+    def __init__(self, field, distinct=False):
+        """
+        :param field: field name of the base model, F instance for joined models or '*'
+        :param distinct: aggregate distinct values only
+        """
+        if field == '*' and not self.allow_star:
+            raise QueryError("%s() requires a field" % self.__class__.__name__)
+        self.field = field
+        self.distinct = distinct
+        # (model_or_alias, field_name) set by resolve, None for '*'
+        self.target = None
+
+    def __repr__(self):
+        return '%s(%r%s)' % (self.__class__.__name__, self.field, ', distinct=True' if self.distinct else '')
+
+    def __eq__(self, other):
+        return type(self) is type(other) and (self.field, self.target, self.distinct) == \
+            (other.field, other.target, other.distinct)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash((type(self), self.target or self.field, self.distinct))
+
+    @property
+    def default_alias(self):
+        field_name = self.field.column if isinstance(self.field, F) else self.field
+        if field_name == '*':
+            return self.function.lower()
+        return '%s__%s' % (field_name, self.function.lower())
+
+    def resolve(self, qs):
+        """
+        Return a copy with the aggregated column resolved for `qs`.
+
+        :type qs: ezspanner.query.SpannerQuerySet
+        :rtype: Aggregate
+        """
+        obj = copy.copy(self)
+        if self.field != '*':
+            if isinstance(self.field, F):
+                model_or_alias, field_name = self.field.model_or_alias or qs.model, self.field.column
+            else:
+                model_or_alias, field_name = qs.model, self.field
+            model = qs._check_model_joined(model_or_alias)
+            if not model._meta.field_lookup.get(field_name):
+                raise QueryError("'%s' is an invalid field for model '%s'" % (field_name, model))
+            obj.target = (model_or_alias, field_name)
+        return obj
+
+    def as_sql(self, qs):
+        """
+        :type qs: ezspanner.query.SpannerQuerySet
+        :rtype: unicode
+        """
+        column = '*' if self.target is None else qs._get_column_sql(*self.target)
+        return '%s(%s%s)' % (self.function, 'DISTINCT ' if self.distinct else '', column)
+
+    def get_param_type(self, qs):
+        """
+        Spanner type of the aggregate's result, used for HAVING params.
+        """
+        if self.result_type is not None:
+            return self.result_type
+        model_or_alias, field_name = self.target
+        return qs._check_model_joined(model_or_alias)._meta.field_lookup[field_name].get_spanner_type()
+
+
+class Count(Aggregate):
+    function = 'COUNT'
+    result_type = INT64_PARAM_TYPE
+    allow_star = True
+
+
+class Sum(Aggregate):
+    function = 'SUM'
+
+
+class Min(Aggregate):
+    function = 'MIN'
+
+
+class Max(Aggregate):
+    function = 'MAX'
+
+
+class Avg(Aggregate):
+    function = 'AVG'
+    result_type = FLOAT64_PARAM_TYPE
+
+
+class ApproxCountDistinct(Aggregate):
+    """
+    Approximate number of distinct values (HyperLogLog++), much cheaper than `Count(field, distinct=True)`.
+    """
+    function = 'APPROX_COUNT_DISTINCT'
+    result_type = INT64_PARAM_TYPE
+
+    def __init__(self, field):
+        super(ApproxCountDistinct, self).__init__(field)
+
+
+def get_aggregates(args, kwargs):
+    """
+    Combine positional (named by their default alias) and keyword aggregates.
+
+    :rtype: list[tuple[unicode, Aggregate]]
+    """
+    aggregates = []
+    for aggregate in args:
+        if not isinstance(aggregate, Aggregate):
+            raise QueryError("Positional arguments must be aggregates, got %r" % (aggregate,))
+        aggregates.append((aggregate.default_alias, aggregate))
+    for alias, aggregate in sorted(six.iteritems(kwargs)):
+        if not isinstance(aggregate, Aggregate):
+            raise QueryError("'%s' must be an aggregate, got %r" % (alias, aggregate))
+        aggregates.append((alias, aggregate))
+    return aggregates
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+asyncio support (Python 3.5+ only, imported lazily by the `a*` methods of querysets and models).
+
+The Cloud Spanner client is blocking, all calls are run in a bounded thread pool per connection whose size matches
+the connection's session pool. Any number of coroutines can wait for results without occupying a thread, at most
+`pool_size` Spanner calls of a connection are in flight at the same time.
+
+Note that the thread-local contexts (`ezspanner.snapshot()`, transactions) are not visible to calls that are
+executed through this module.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+import asyncio
+import collections
+import functools
+import itertools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .connection import Connection
+
+DEFAULT_WORKERS = 10
+
+_executors = {}
+_lock = threading.Lock()
+_pid = os.getpid()
+
+
+def get_executor(connection_id=None):
+    """
+    Return the executor for `connection_id`, sized like the connection's session pool.
+
+    :rtype: concurrent.futures.ThreadPoolExecutor
+    """
+    global _executors, _pid
+    connection_id = connection_id or 'default'
+
+    with _lock:
+        if _pid != os.getpid():
+            # worker threads don't survive a fork
+            _executors = {}
+            _pid = os.getpid()
+
+        executor = _executors.get(connection_id)
+        if executor is None:
+            config = Connection.connection_configs.get(connection_id) or {}
+            executor = _executors[connection_id] = ThreadPoolExecutor(
+                max_workers=config.get('pool_size') or DEFAULT_WORKERS)
+        return executor
+
+
+async def run(func, *args, connection_id=None, **kwargs):
+    """
+    Run the blocking callable `func` in the executor of `connection_id`.
+    """
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(get_executor(connection_id), functools.partial(func, *args, **kwargs))
+
+
+class QuerySetAsyncIterator(object):
+    """
+    Streams a queryset's results to the event loop.
+
+    The streamed result set is consumed in chunks of `buffer_size` instances, each chunk is read by a call in the
+    connection's executor when the previous one was consumed. No worker is held while the consumer processes a chunk,
+    so other calls of the connection (e.g. `asave()` within the `async for` loop) can't be starved by open iterators.
+    """
+
+    def __init__(self, qs, connection_id=None, buffer_size=100):
+        self.qs = qs
+        self.connection_id = connection_id
+        self.buffer_size = buffer_size
+        # generator of qs.execute(), created by the first chunk read
+        self._results = None
+        self._buffer = collections.deque()
+        self._exhausted = False
+        self._reading = False
+        self._closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self._buffer and not self._exhausted and not self._closed:
+            await run(self._read_chunk, connection_id=self.connection_id)
+        if not self._buffer:
+            raise StopAsyncIteration
+        return self._buffer.popleft()
+
+    def _read_chunk(self):
+        self._reading = True
+        try:
+            if self._results is None:
+                self._results = self.qs.execute(connection_id=self.connection_id)
+            self._buffer.extend(itertools.islice(self._results, self.buffer_size))
+            if len(self._buffer) < self.buffer_size:
+                self._exhausted = True
+        except Exception:
+            self._exhausted = True
+            raise
+        finally:
+            self._reading = False
+            if self._closed:
+                self._close_results()
+
+    def _close_results(self):
+        if self._results is not None:
+            self._results.close()
+
+    def close(self):
+        """
+        Release the streamed result set if the results are not consumed completely.
+        """
+        self._closed = True
+        self._buffer.clear()
+        if not self._reading:
+            # a running chunk read closes it when it's done
+            self._close_results()
+
+    def __del__(self):
+        self.close()
+
+
+async def afirst(qs, connection_id=None):
+    """
+    Return the first result of `qs` or None.
+    """
+    def first():
+        for instance in qs.execute(connection_id=connection_id, fetch_one=True):
+            return instance
+        return None
+
+    return await run(first, connection_id=connection_id)
@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+"""
+Read-through entity cache for primary key lookups.
+
+Enable it per model with `Meta.cache`:
+
+```
+class Tenant(ezspanner.SpannerModel):
+    class Meta:
+        table = 'tenant'
+        pk = ['tenant_id']
+        cache = LocalMemoryCache(maxsize=10000, ttl=60)  # or `cache = True` for the defaults (10000 rows, 60s)
+```
+
+`get_by_pk`, `get_many` and `get` (for primary key lookups) read through the cache. All writes (save, delete, bulk
+operations) invalidate the written rows after their commit, deleting a row also invalidates the cached rows of all
+tables interleaved in it.
+
+Cache keys are (table, primary key tuple) tuples, values are the row's values in `_meta.local_fields` order.
+
+A read that misses the cache can race with a write: the read returns the old row, the write commits and invalidates
+the key, then the read stores the old row. Reads therefore take a token (`begin_read`) before reading from Spanner,
+`set_many` skips the keys that were invalidated by this process after the token was taken. Writes of other processes
+can't be detected, the ttl bounds how long such an entry stays stale.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import six
+
+# seconds, see LocalMemoryCache
+DEFAULT_TTL = 60
+
+# prune the invalidation log once it holds this many entries while reads are in flight
+MAX_INVALIDATION_LOG = 1000
+
+
+class BaseCache(object):
+    """
+    Interface of entity cache backends.
+
+    Keeps a log of the invalidations that happened while reads were in flight, see `begin_read`.
+    """
+
+    def __init__(self):
+        self._generation = 0
+        # generation at begin_read -> number of reads in flight
+        self._reads = {}
+        # key -> generation of its last invalidation
+        self._invalidated = {}
+        # (table, prefix) -> generation of its last invalidation
+        self._invalidated_prefixes = {}
+        # generation of the last clear()
+        self._cleared = 0
+        self._log_lock = threading.Lock()
+
+    def begin_read(self):
+        """
+        Start a read from the database whose rows will be stored with `set_many(mapping, token)`, call `end_read`
+        when it's done.
+
+        :return: token
+        """
+        with self._log_lock:
+            self._reads[self._generation] = self._reads.get(self._generation, 0) + 1
+            return self._generation
+
+    def end_read(self, token):
+        with self._log_lock:
+            self._reads[token] -= 1
+            if not self._reads[token]:
+                del self._reads[token]
+            if not self._reads:
+                self._invalidated.clear()
+                self._invalidated_prefixes.clear()
+            elif len(self._invalidated) + len(self._invalidated_prefixes) > MAX_INVALIDATION_LOG:
+                # only invalidations after the oldest read in flight can still skip keys
+                oldest = min(self._reads)
+                self._invalidated = dict((k, g) for k, g in six.iteritems(self._invalidated) if g > oldest)
+                self._invalidated_prefixes = dict((k, g) for k, g in six.iteritems(self._invalidated_prefixes)
+                                                  if g > oldest)
+
+    def _log_invalidation(self, keys=(), prefix=None, clear=False):
+        """
+        :param keys: invalidated keys
+        :param prefix: invalidated (table, key prefix)
+        :param clear: everything was invalidated
+        """
+        with self._log_lock:
+            self._generation += 1
+            if not self._reads:
+                return
+            for key in keys:
+                self._invalidated[key] = self._generation
+            if prefix is not None:
+                self._invalidated_prefixes[prefix] = self._generation
+            if clear:
+                self._cleared = self._generation
+
+    def _skip_invalidated(self, mapping, token):
+        """
+        Remove the keys that were invalidated after `token` was taken.
+
+        :rtype: dict
+        """
+        if token is None:
+            return mapping
+        with self._log_lock:
+            if self._cleared > token:
+                return {}
+            if not self._invalidated and not self._invalidated_prefixes:
+                return mapping
+            valid = {}
+            for key, value in six.iteritems(mapping):
+                table, pk = key
+                if self._invalidated.get(key, 0) > token or any(
+                        self._invalidated_prefixes.get((table, pk[:i]), 0) > token for i in range(1, len(pk))):
+                    continue
+                valid[key] = value
+            return valid
+
+    def get_many(self, keys):
+        """
+        :param keys: list of (table, pk tuple) keys
+        :rtype: dict
+        :return: key -> cached values for all keys that were found
+        """
+        raise NotImplementedError
+
+    def set_many(self, mapping, token=None):
+        """
+        :type mapping: dict
+        :param mapping: key -> values
+        :param token: see begin_read, keys invalidated since are not stored
+        """
+        raise NotImplementedError
+
+    def delete_many(self, keys):
+        raise NotImplementedError
+
+    def delete_prefix(self, table, prefix):
+        """
+        Delete all keys of `table` whose primary key starts with `prefix`.
+
+        :type prefix: tuple
+        """
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class LocalMemoryCache(BaseCache):
+    """
+    In-process cache with LRU eviction and an optional time to live.
+    """
+
+    def __init__(self, maxsize=10000, ttl=DEFAULT_TTL, timer=time.time):
+        """
+        :param maxsize: max number of cached rows
+        :param ttl: seconds until an entry expires, None = no expiry
+        :param timer: clock function, mainly for tests
+        """
+        super(LocalMemoryCache, self).__init__()
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get_many(self, keys):
+        found = {}
+        now = self.timer()
+        with self._lock:
+            for key in keys:
+                entry = self._data.pop(key, None)
+                if entry is None or (entry[0] is not None and entry[0] <= now):
+                    self.misses += 1
+                    continue
+                # re-insert as most recently used
+                self._data[key] = entry
+                found[key] = entry[1]
+                self.hits += 1
+        return found
+
+    def set_many(self, mapping, token=None):
+        mapping = self._skip_invalidated(mapping, token)
+        expires = self.timer() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            for key, value in six.iteritems(mapping):
+                self._data.pop(key, None)
+                self._data[key] = (expires, value)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete_many(self, keys):
+        self._log_invalidation(keys=keys)
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def delete_prefix(self, table, prefix):
+        prefix = tuple(prefix)
+        size = len(prefix)
+        self._log_invalidation(prefix=(table, prefix))
+        with self._lock:
+            for key in [key for key in self._data if key[0] == table and key[1][:size] == prefix]:
+                del self._data[key]
+
+    def clear(self):
+        self._log_invalidation(clear=True)
+        with self._lock:
+            self._data.clear()
+
+
+class ExternalCache(BaseCache):
+    """
+    Adapter for external key/value stores (e.g. memcached or redis clients).
+
+    The client must implement `get_many(keys) -> dict`, `set_many(mapping, ttl)` and `delete_many(keys)` for string
+    keys, serializing the values is up to the client.
+
+    External stores can't delete by prefix, instead every key prefix has a generation token that is part of all keys
+    below it. Invalidating a prefix replaces its token, which orphans all keys below it until they expire.
+    Looking up rows with composite primary keys therefore fetches the generation tokens of their key prefixes first.
+    """
+
+    def __init__(self, client, key_prefix='ezspanner', ttl=DEFAULT_TTL):
+        super(ExternalCache, self).__init__()
+        self.client = client
+        self.key_prefix = key_prefix
+        self.ttl = ttl
+
+    def _prefix_key(self, table, prefix):
+        return '%s:gen:%s:%s' % (self.key_prefix, table, ':'.join(repr(v) for v in prefix))
+
+    def _get_generations(self, keys):
+        prefix_keys = set()
+        for table, pk in keys:
+            for i in range(1, len(pk)):
+                prefix_keys.add(self._prefix_key(table, pk[:i]))
+        if not prefix_keys:
+            return {}
+
+        generations = self.client.get_many(list(prefix_keys))
+        missing = dict((key, uuid.uuid4().hex) for key in prefix_keys if key not in generations)
+        if missing:
+            self.client.set_many(missing, None)
+            generations.update(missing)
+        return generations
+
+    def _make_keys(self, keys):
+        generations = self._get_generations(keys)
+        made = {}
+        for key in keys:
+            table, pk = key
+            tokens = [generations[self._prefix_key(table, pk[:i])] for i in range(1, len(pk))]
+            made[key] = '%s:row:%s:%s:%s' % (self.key_prefix, table, ':'.join(tokens),
+                                             ':'.join(repr(v) for v in pk))
+        return made
+
+    def get_many(self, keys):
+        if not keys:
+            return {}
+        made = self._make_keys(keys)
+        found = self.client.get_many(list(made.values()))
+        return dict((key, found[made_key]) for key, made_key in six.iteritems(made) if made_key in found)
+
+    def set_many(self, mapping, token=None):
+        mapping = self._skip_invalidated(mapping, token)
+        if not mapping:
+            return
+        made = self._make_keys(list(mapping.keys()))
+        self.client.set_many(dict((made[key], value) for key, value in six.iteritems(mapping)), self.ttl)
+
+    def delete_many(self, keys):
+        if not keys:
+            return
+        self._log_invalidation(keys=keys)
+        self.client.delete_many(list(self._make_keys(keys).values()))
+
+    def delete_prefix(self, table, prefix):
+        self._log_invalidation(prefix=(table, tuple(prefix)))
+        self.client.set_many({self._prefix_key(table, tuple(prefix)): uuid.uuid4().hex}, None)
+
+    def clear(self):
+        self._log_invalidation(clear=True)
+        # orphan everything by switching to a new key prefix
+        self.key_prefix = '%s:%s' % (self.key_prefix.split(':')[0], uuid.uuid4().hex)
+
+
+class DictCacheClient(object):
+    """
+    Dict based stand-in for an external cache client, e.g. for tests. Ignores ttls.
+    """
+
+    def __init__(self):
+        self.data = {}
+
+    def get_many(self, keys):
+        return dict((key, self.data[key]) for key in keys if key in self.data)
+
+    def set_many(self, mapping, ttl=None):
+        self.data.update(mapping)
+
+    def delete_many(self, keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+
+def get_cache_key(meta, pk_values):
+    return meta.table, tuple(pk_values)
+
+
+def invalidate_mutations(mutations):
+    """
+    Invalidate the cached rows written by committed mutations, deletes also invalidate interleaved children.
+
+    :type mutations: list[ezspanner.mutations.Mutation]
+    """
+    from .models import SpannerModelRegistry
+    from .mutations import OP_DELETE
+
+    for mutation in mutations:
+        model = SpannerModelRegistry.registered_models.get(mutation.table)
+        if model is None:
+            continue
+        meta = model._meta
+        children = []
+        if mutation.op == OP_DELETE:
+            children = [child for child in SpannerModelRegistry.get_interleaved_children(model)
+                        if child._meta.cache is not None]
+        if meta.cache is None and not children:
+            continue
+
+        positions = [mutation.columns.index(column) for column in meta.primary.get_field_names()]
+        pks = [tuple(row[i] for i in positions) for row in mutation.values]
+
+        if meta.cache is not None:
+            meta.cache.delete_many([get_cache_key(meta, pk) for pk in pks])
+        for child in children:
+            for pk in pks:
+                child._meta.cache.delete_prefix(child._meta.table, pk)
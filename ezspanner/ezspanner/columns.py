@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar results for analytic queries, see SpannerQuerySet.as_columns / to_numpy / to_arrow.
+
+The streamed rows are transposed chunk by chunk into one typed buffer per column, no model instances are created.
+Buffers use the stdlib `array` module, numpy / pyarrow are only required for the conversions:
+
+- INT64: array('q')
+- BOOL: array('b')
+- TIMESTAMP: array('q') of microseconds since the epoch (UTC)
+- other types: list
+
+Nullable fields get a null mask (bytearray, 1 = NULL), NULL values are stored as 0 in typed buffers.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+import datetime
+from array import array
+from collections import OrderedDict
+
+import six
+from google.cloud._helpers import UTC
+
+DEFAULT_CHUNK_SIZE = 10000
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=UTC)
+
+# spanner type -> array typecode
+TYPECODES = {
+    'INT64': 'q',
+    'BOOL': 'b',
+    'TIMESTAMP': 'q',
+}
+
+
+def timestamp_to_micros(value):
+    delta = value - EPOCH if value.tzinfo is not None else value - EPOCH.replace(tzinfo=None)
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+class Column(object):
+    """
+    Values of one result column.
+    """
+    __slots__ = ('name', 'field', 'values', 'mask')
+
+    def __init__(self, name, field):
+        """
+        :param name: column name, `alias.field_name` for columns of joined models
+        :type field: ezspanner.fields.SpannerField
+        """
+        self.name = name
+        self.field = field
+        typecode = TYPECODES.get(field.type)
+        # typed buffer (array.array) or list for other types
+        self.values = array(str(typecode)) if typecode else []
+        # bytearray null mask for nullable fields, 1 = NULL
+        self.mask = bytearray() if field.null else None
+
+    def __len__(self):
+        return len(self.values)
+
+    def __repr__(self):
+        return '<Column: %s %s x %s>' % (self.name, self.field.type, len(self))
+
+    def extend(self, values):
+        """
+        Append a chunk of raw values.
+
+        :type values: tuple
+        """
+        if self.field.type == 'TIMESTAMP':
+            values = [None if value is None else timestamp_to_micros(value) for value in values]
+        if self.mask is not None:
+            self.mask.extend(value is None for value in values)
+            if isinstance(self.values, array):
+                values = [0 if value is None else value for value in values]
+        self.values.extend(values)
+
+
+def read_columns(qs, connection_id=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Execute `qs` and collect the results column by column.
+
+    :type qs: ezspanner.query.SpannerQuerySet
+    :rtype: OrderedDict
+    :return: column name -> Column
+    """
+    columns = []
+    for model_or_alias, field_name in qs._compile().select_targets:
+        model = qs._check_model_joined(model_or_alias)
+        if model_or_alias == qs.model:
+            name = field_name
+        else:
+            alias = model_or_alias if isinstance(model_or_alias, six.string_types) else model._meta.model_name
+            name = '%s.%s' % (alias, field_name)
+        columns.append(Column(name, model._meta.field_lookup[field_name]))
+
+    chunk = []
+    for row in qs.execute(connection_id=connection_id, raw=True):
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            _extend_columns(columns, chunk)
+            chunk = []
+    if chunk:
+        _extend_columns(columns, chunk)
+
+    return OrderedDict((column.name, column) for column in columns)
+
+
+def _extend_columns(columns, chunk):
+    for column, values in zip(columns, zip(*chunk)):
+        column.extend(values)
+
+
+def to_numpy(columns):
+    """
+    Convert columns to numpy arrays, nullable columns become masked arrays.
+
+    INT64 -> int64, BOOL -> bool, TIMESTAMP -> datetime64[us], others -> object
+
+    :param columns: result of read_columns
+    :rtype: OrderedDict
+    """
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError("to_numpy() requires numpy.")
+
+    def frombuffer(buffer, dtype):
+        # zero-copy view on the column buffer
+        return numpy.frombuffer(buffer, dtype=dtype) if len(buffer) else numpy.array([], dtype=dtype)
+
+    arrays = OrderedDict()
+    for name, column in six.iteritems(columns):
+        spanner_type = column.field.type
+        if spanner_type == 'INT64':
+            values = frombuffer(column.values, numpy.int64)
+        elif spanner_type == 'BOOL':
+            values = frombuffer(column.values, numpy.int8).view(bool)
+        elif spanner_type == 'TIMESTAMP':
+            values = frombuffer(column.values, numpy.int64).view('datetime64[us]')
+        else:
+            values = numpy.array(column.values, dtype=object)
+
+        if column.mask is not None:
+            values = numpy.ma.MaskedArray(values, mask=frombuffer(column.mask, numpy.int8).view(bool))
+        arrays[name] = values
+    return arrays
+
+
+def to_arrow(columns):
+    """
+    Convert columns to a pyarrow Table.
+
+    :param columns: result of read_columns
+    :rtype: pyarrow.Table
+    """
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError("to_arrow() requires pyarrow.")
+
+    arrow_types = {
+        'INT64': pyarrow.int64(),
+        'BOOL': pyarrow.bool_(),
+        'TIMESTAMP': pyarrow.timestamp('us', tz='UTC'),
+        'STRING': pyarrow.string(),
+    }
+    arrays = []
+    for (name, values), column in zip(six.iteritems(to_numpy(columns)), columns.values()):
+        mask = None
+        if column.mask is not None:
+            mask = values.mask
+            values = values.data
+        arrays.append(pyarrow.array(values, mask=mask, type=arrow_types.get(column.field.type)))
+    return pyarrow.Table.from_arrays(arrays, names=list(columns.keys()))
@@ -1,50 +1,304 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, division, print_function, unicode_literals
+import os
+import threading
+
 from google.cloud import spanner
+from google.cloud.exceptions import NotFound
+from six.moves import queue
+
+POOL_FIXED = 'fixed'
+POOL_BURSTY = 'bursty'
+
+
+class PoolStats(object):
+    """
+    Thread-safe counters for a session pool.
+
+    A *hit* is a checkout that got a live, already existing session. A *miss* is a checkout that had to
+    create a session or wait for one to be returned.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.created = 0
+        self.discarded = 0
+
+    def incr(self, counter, value=1):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + value)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'created': self.created,
+                'discarded': self.discarded,
+            }
+
+
+class FixedSessionPool(spanner.FixedSizePool):
+    """
+    FixedSizePool that keeps hit/miss statistics and supports filling the pool in the background.
+
+    If `warm_up` is set, `bind` returns immediately and `fill` has to be called (usually from a background thread),
+    checkouts block until sessions are available.
+    """
+
+    def __init__(self, size=spanner.FixedSizePool.DEFAULT_SIZE,
+                 default_timeout=spanner.FixedSizePool.DEFAULT_TIMEOUT, warm_up=False):
+        super(FixedSessionPool, self).__init__(size=size, default_timeout=default_timeout)
+        self.warm_up = warm_up
+        self.stats = PoolStats()
+        self._fill_lock = threading.Lock()
+        self._allocated = 0
+
+    def bind(self, database):
+        self._database = database
+        if not self.warm_up:
+            self.fill()
+
+    def fill(self):
+        """
+        Create sessions until the pool reaches its fixed size.
+        """
+        with self._fill_lock:
+            while self._allocated < self.size:
+                self._sessions.put(self._create_session())
+                self._allocated += 1
+
+    def _create_session(self):
+        session = self._database.session()
+        session.create()
+        self.stats.incr('created')
+        return session
+
+    def get(self, timeout=None):  # pylint: disable=arguments-differ
+        if timeout is None:
+            timeout = self.default_timeout
+
+        waited = self._sessions.empty()
+        session = self._sessions.get(block=True, timeout=timeout)
+
+        if not session.exists():
+            self.stats.incr('discarded')
+            session = self._create_session()
+            waited = True
+
+        self.stats.incr('misses' if waited else 'hits')
+        return session
+
+
+class BurstySessionPool(spanner.BurstyPool):
+    """
+    BurstyPool that keeps hit/miss statistics and can be pre-filled to `target_size` sessions.
+    """
+
+    def __init__(self, target_size=10, warm_up=False):
+        super(BurstySessionPool, self).__init__(target_size=target_size)
+        self.warm_up = warm_up
+        self.stats = PoolStats()
+
+    def fill(self):
+        """
+        Create sessions until the pool holds `target_size` idle sessions.
+        """
+        while not self._sessions.full():
+            try:
+                self._sessions.put_nowait(self._create_session())
+            except queue.Full:
+                break
+
+    def _create_session(self):
+        session = self._database.session()
+        session.create()
+        self.stats.incr('created')
+        return session
+
+    def get(self):
+        try:
+            session = self._sessions.get_nowait()
+        except queue.Empty:
+            self.stats.incr('misses')
+            return self._create_session()
+
+        if not session.exists():
+            self.stats.incr('discarded')
+            self.stats.incr('misses')
+            return self._create_session()
+
+        self.stats.incr('hits')
+        return session
+
+    def put(self, session):
+        try:
+            self._sessions.put_nowait(session)
+        except queue.Full:
+            self.stats.incr('discarded')
+            try:
+                session.delete()
+            except NotFound:
+                pass
 
 
 class Connection(object):
+    """
+    Process-wide connection manager.
+
+    One `spanner.Client` and `Database` (with its own session pool) is created per connection_id and reused by
+    all subsequent `get` calls. The cache is dropped automatically in forked child processes, since gRPC channels
+    must not be shared across a fork.
+    """
 
     database = None
 
     connection_configs = {}
 
+    # connection_id -> {'client': ..., 'database': ..., 'pool': ...}
+    _connections = {}
+    _lock = threading.RLock()
+    _pid = os.getpid()
+
     @classmethod
-    def add_config(cls, spanner_instance, spanner_database, connection_id='default'):
+    def add_config(cls, spanner_instance, spanner_database, connection_id='default', project=None,
+                   pool_type=POOL_BURSTY, pool_size=10, pool_timeout=10, warm_up=True):
         """
 
         :param spanner_instance:
         :param spanner_database:
         :param connection_id:
+
+        :param project: (optional) google cloud project, defaults to the environment's project.
+
+        :param pool_type: POOL_BURSTY (create sessions on demand) or POOL_FIXED (block if all sessions are in use)
+        :param pool_size: target size of the bursty pool resp. size of the fixed pool
+        :param pool_timeout: seconds to wait for a free session (fixed pools only)
+        :param warm_up: create the pool's sessions in a background thread
         """
-        cls.connection_configs[connection_id] = {
-            'spanner_instance': spanner_instance,
-            'spanner_database': spanner_database,
-        }
+        if pool_type not in (POOL_FIXED, POOL_BURSTY):
+            raise ValueError("[EZSpanner] invalid pool_type '%s'!" % pool_type)
+
+        with cls._lock:
+            cls.connection_configs[connection_id] = {
+                'spanner_instance': spanner_instance,
+                'spanner_database': spanner_database,
+                'project': project,
+                'pool_type': pool_type,
+                'pool_size': pool_size,
+                'pool_timeout': pool_timeout,
+                'warm_up': warm_up,
+            }
+            # config changed, drop cached connection
+            cls._connections.pop(connection_id, None)
 
     @classmethod
     def get(cls, connection_id=None, create_database=False):
         """
-
+        Return the cached database for `connection_id`, connect on first use.
 
         :param connection_id:
 
         :rtype: google.cloud.spanner.database.Database
         """
-        connection_id = connection_id or 'default'
+        return cls._get_connection(connection_id)['database']
+
+    @classmethod
+    def get_pool(cls, connection_id=None):
+        """
+
+        :param connection_id:
+        :rtype: FixedSessionPool|BurstySessionPool
+        """
+        return cls._get_connection(connection_id)['pool']
 
-        # verify connection id
+    @classmethod
+    def get_config(cls, connection_id=None):
+        connection_id = connection_id or 'default'
         if connection_id not in cls.connection_configs:
             raise ValueError("[EZSpanner] invalid connection_id key!")
+        return cls.connection_configs[connection_id]
+
+    @classmethod
+    def stats(cls, connection_id=None):
+        """
+        Session pool statistics of an established connection.
+
+        :param connection_id:
+        :rtype: dict
+        """
+        return cls.get_pool(connection_id).stats.as_dict()
+
+    @classmethod
+    def reset(cls, connection_id=None, clear_pools=False):
+        """
+        Drop cached connections, the next `get` reconnects.
+
+        :param connection_id: only reset the given connection, defaults to all connections
+        :param clear_pools: delete the pooled sessions on the server
+        """
+        with cls._lock:
+            connection_ids = [connection_id] if connection_id else list(cls._connections.keys())
+            for key in connection_ids:
+                connection = cls._connections.pop(key, None)
+                if connection and clear_pools:
+                    connection['pool'].clear()
+
+    @classmethod
+    def _check_pid(cls):
+        """
+        Forget all connections inherited from a parent process.
+        """
+        pid = os.getpid()
+        if cls._pid != pid:
+            # the lock may have been held by another thread of the parent while forking
+            cls._lock = threading.RLock()
+            cls._connections = {}
+            cls._pid = pid
+
+    @classmethod
+    def _get_connection(cls, connection_id=None):
+        connection_id = connection_id or 'default'
+        cls._check_pid()
+
+        connection = cls._connections.get(connection_id)
+        if connection is not None:
+            return connection
+
+        with cls._lock:
+            connection = cls._connections.get(connection_id)
+            if connection is None:
+                connection = cls._connect(cls.get_config(connection_id))
+                cls._connections[connection_id] = connection
+        return connection
+
+    @classmethod
+    def _connect(cls, config):
+        if config['pool_type'] == POOL_FIXED:
+            pool = FixedSessionPool(size=config['pool_size'], default_timeout=config['pool_timeout'],
+                                    warm_up=config['warm_up'])
+        else:
+            pool = BurstySessionPool(target_size=config['pool_size'], warm_up=config['warm_up'])
 
         # create client
-        client = spanner.Client()
-        instance = client.instance(cls.connection_configs[connection_id]['spanner_instance'])
+        client = spanner.Client(project=config['project']) if config['project'] else spanner.Client()
+        instance = client.instance(config['spanner_instance'])
 
-        # create database connection
-        database = instance.database(cls.connection_configs[connection_id]['spanner_database'])
+        # create database connection, binds the pool
+        database = instance.database(config['spanner_database'], pool=pool)
 
-        return database
+        if config['warm_up']:
+            warm_up = threading.Thread(target=pool.fill, name='ezspanner-pool-warm-up')
+            warm_up.daemon = True
+            warm_up.start()
+
+        return {
+            'client': client,
+            'database': database,
+            'pool': pool,
+        }
 
 
 """
@@ -54,7 +308,7 @@ Connection.add_config('your-instance-id', 'your-database-id')
 
 # register your models
 
-# get database connection, create database and registered models if it doesn't exist 
+# get database connection, create database and registered models if it doesn't exist
 connection = Connection.get()
 
 """
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+import threading
+from contextlib import contextmanager
+
+from .connection import Connection
+
+_local = threading.local()
+
+
+def _get_readers():
+    readers = getattr(_local, 'readers', None)
+    if readers is None:
+        readers = _local.readers = []
+    return readers
+
+
+def get_reader(database):
+    """
+    Return the innermost snapshot (or transaction) that is active for `database` in the current thread.
+
+    :type database: google.cloud.spanner.database.Database
+    :rtype: google.cloud.spanner.snapshot.Snapshot|None
+    """
+    for reader_database, reader in reversed(_get_readers()):
+        if reader_database is database:
+            return reader
+    return None
+
+
+@contextmanager
+def use_reader(database, reader):
+    """
+    Route all reads of querysets using `database` through `reader` within the with block.
+    """
+    readers = _get_readers()
+    readers.append((database, reader))
+    try:
+        yield reader
+    finally:
+        readers.remove((database, reader))
+
+
+def _get_transactions():
+    transactions = getattr(_local, 'transactions', None)
+    if transactions is None:
+        transactions = _local.transactions = []
+    return transactions
+
+
+def get_transaction(database):
+    """
+    Return the state of the innermost `atomic()` block that is active for `database` in the current thread.
+
+    :type database: google.cloud.spanner.database.Database
+    :rtype: ezspanner.transaction.TransactionState|None
+    """
+    for transaction_database, state in reversed(_get_transactions()):
+        if transaction_database is database:
+            return state
+    return None
+
+
+@contextmanager
+def use_transaction(database, state):
+    """
+    Route all reads and writes using `database` through the transaction of `state` within the with block.
+
+    :type state: ezspanner.transaction.TransactionState
+    """
+    transactions = _get_transactions()
+    transactions.append((database, state))
+    try:
+        with use_reader(database, state.transaction):
+            yield state
+    finally:
+        transactions.remove((database, state))
+
+
+def _get_write_buffers():
+    write_buffers = getattr(_local, 'write_buffers', None)
+    if write_buffers is None:
+        write_buffers = _local.write_buffers = []
+    return write_buffers
+
+
+def get_write_buffer(database):
+    """
+    Return the buffer of the innermost `write_behind()` block that is active for `database` in the current thread.
+
+    :type database: google.cloud.spanner.database.Database
+    :rtype: ezspanner.writebehind.WriteBehindBuffer|None
+    """
+    for buffer_database, write_buffer in reversed(_get_write_buffers()):
+        if buffer_database is database:
+            return write_buffer
+    return None
+
+
+@contextmanager
+def use_write_buffer(database, write_buffer):
+    """
+    Add the mutations of all writes using `database` to `write_buffer` within the with block.
+
+    :type write_buffer: ezspanner.writebehind.WriteBehindBuffer
+    """
+    write_buffers = _get_write_buffers()
+    write_buffers.append((database, write_buffer))
+    try:
+        yield write_buffer
+    finally:
+        write_buffers.remove((database, write_buffer))
+
+
+@contextmanager
+def snapshot(connection_id=None, read_timestamp=None, exact_staleness=None):
+    """
+    Share one multi-use read-only snapshot between all querysets executed within the with block.
+
+    All reads see the same consistent state of the database. Without a timestamp bound a strong snapshot is used,
+    `read_timestamp` / `exact_staleness` allow the reads to be served by the nearest replica.
+
+    Example:
+    ```
+    with ezspanner.snapshot(exact_staleness=datetime.timedelta(seconds=15)):
+        a = list(TestModelA.objects.filter(id_a=1))
+        b = TestModelB.objects.get_many([[1, 2], [1, 3]])
+    ```
+
+    :param connection_id:
+    :type read_timestamp: datetime.datetime
+    :type exact_staleness: datetime.timedelta
+    """
+    database = Connection.get(connection_id)
+    with database.snapshot(read_timestamp=read_timestamp, exact_staleness=exact_staleness,
+                           multi_use=True) as shared_snapshot:
+        shared_snapshot.begin()
+        with use_reader(database, shared_snapshot):
+            yield shared_snapshot
@@ -10,6 +10,10 @@ class ObjectDoesNotExist(EzSpannerException):
     pass
 
 
+class MultipleObjectsReturned(EzSpannerException):
+    pass
+
+
 class ModelError(EzSpannerException):
     pass
 
@@ -22,6 +26,26 @@ class QueryJoinError(QueryError):
     pass
 
 
+class QueryPlanError(QueryError):
+    """ explain(strict=True) found a full scan, `plan` is the analysed ezspanner.explain.QueryPlan. """
+
+    def __init__(self, message, plan=None):
+        super(QueryPlanError, self).__init__(message)
+        self.plan = plan
+
+
+class TransactionError(EzSpannerException):
+    pass
+
+
+class WriteBehindError(EzSpannerException):
+    """ Flushing a write-behind buffer failed, `mutations` were not (or only partially) committed. """
+
+    def __init__(self, message, mutations=None):
+        super(WriteBehindError, self).__init__(message)
+        self.mutations = mutations or []
+
+
 class FieldError(ModelError):
     pass
 
@@ -29,3 +53,6 @@ class FieldError(ModelError):
 class SpannerIndexError(ModelError):
     pass
 
+
+class FullScanWarning(UserWarning):
+    """ The filters of a query can't be served by the primary key or a covering index. """
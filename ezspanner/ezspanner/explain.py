@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+Query plans, see SpannerQuerySet.explain.
+
+```
+plan = TestModelB.objects.filter(value_field_x=1).explain(analyze=True)
+print(plan)
+# Distributed Union (rows: 3, latency: 1.21 msecs)
+#   Local Distributed Union (rows: 3, latency: 1.17 msecs)
+#     Serialize Result (rows: 3, latency: 1.15 msecs)
+#       Filter Scan (rows: 3, latency: 1.1 msecs)
+#         Table Scan: model_b [full scan] (rows: 3, latency: 1.08 msecs)
+
+plan.full_scans()
+```
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import six
+from google.protobuf import json_format
+
+SCAN_TABLE = 'TableScan'
+SCAN_INDEX = 'IndexScan'
+
+LINK_INPUT = 'Input'
+LINK_MAP = 'Map'
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _is_cross_apply(node):
+    return node.display_name.endswith('Cross Apply')
+
+
+class PlanNode(object):
+    """
+    A relational (or scalar) operator of a query plan.
+    """
+
+    def __init__(self, index, kind, display_name, description=None, metadata=None, execution_stats=None):
+        self.index = index
+        # 'RELATIONAL' or 'SCALAR'
+        self.kind = kind
+        # operator type, e.g. 'Distributed Union', 'Scan', 'Cross Apply'
+        self.display_name = display_name
+        # short representation of scalar nodes
+        self.description = description
+        # operator specific details, e.g. scan_type and scan_target of scans
+        self.metadata = metadata or {}
+        # actual rows, latency, ... (PROFILE mode only)
+        self.execution_stats = execution_stats or {}
+        # list of (link type, PlanNode) tuples
+        self.children = []
+
+    def __repr__(self):
+        return '<PlanNode %s: %s>' % (self.index, self.name)
+
+    @property
+    def name(self):
+        """
+        Operator name, scans include their type and target: 'Index Scan: over9000'
+        """
+        if self.is_scan:
+            scan_type = {SCAN_TABLE: 'Table Scan', SCAN_INDEX: 'Index Scan'}.get(self.scan_type, self.display_name)
+            return '%s: %s' % (scan_type, self.scan_target)
+        return self.display_name
+
+    @property
+    def is_scan(self):
+        return 'scan_type' in self.metadata
+
+    @property
+    def scan_type(self):
+        return self.metadata.get('scan_type')
+
+    @property
+    def scan_target(self):
+        return self.metadata.get('scan_target')
+
+    @property
+    def is_full_scan(self):
+        return self.is_scan and six.text_type(self.metadata.get('Full scan', '')).lower() == 'true'
+
+    @property
+    def rows(self):
+        """
+        Actual number of returned rows (PROFILE mode)
+        """
+        return _number(self.execution_stats.get('rows', {}).get('total'))
+
+    @property
+    def estimated_rows(self):
+        return _number(self.metadata.get('estimated_rows', self.execution_stats.get('estimated_rows', {}).get('total')))
+
+    @property
+    def latency(self):
+        """
+        :return: (total, unit) of the operator's latency (PROFILE mode), e.g. (1.21, 'msecs')
+        """
+        latency = self.execution_stats.get('latency')
+        if not latency:
+            return None
+        return _number(latency.get('total')), latency.get('unit')
+
+    def get_children(self, link_type=None, kind='RELATIONAL'):
+        return [child for child_link_type, child in self.children
+                if (link_type is None or child_link_type == link_type) and (kind is None or child.kind == kind)]
+
+    def walk(self, kind='RELATIONAL'):
+        """
+        Iterate over this node and its descendants (depth first).
+        """
+        yield self
+        for child in self.get_children(kind=kind):
+            for node in child.walk(kind):
+                yield node
+
+    def render(self, depth=0):
+        details = []
+        if self.rows is not None:
+            details.append('rows: %g' % self.rows)
+        if self.estimated_rows is not None:
+            details.append('estimated rows: %g' % self.estimated_rows)
+        if self.latency is not None:
+            details.append('latency: %g %s' % self.latency)
+        lines = ['%s%s%s%s' % ('  ' * depth, self.name, ' [full scan]' if self.is_full_scan else '',
+                               ' (%s)' % ', '.join(details) if details else '')]
+        for child in self.get_children():
+            lines.append(child.render(depth + 1))
+        return '\n'.join(lines)
+
+
+class QueryPlan(object):
+    """
+    Plan tree of a statement plus the analysis helpers.
+    """
+
+    def __init__(self, sql, nodes, query_stats=None):
+        """
+        :param nodes: list of PlanNode, the root is the first node
+        :param query_stats: query statistics dict (PROFILE mode only)
+        """
+        self.sql = sql
+        self.nodes = nodes
+        self.query_stats = query_stats
+
+    def __str__(self):
+        return self.root.render() if self.root is not None else ''
+
+    @property
+    def root(self):
+        return self.nodes[0] if self.nodes else None
+
+    def walk(self):
+        """
+        Iterate over the relational operators.
+        """
+        return self.root.walk() if self.root is not None else iter(())
+
+    def find(self, display_name):
+        return [node for node in self.walk() if node.display_name == display_name]
+
+    def scans(self):
+        return [node for node in self.walk() if node.is_scan]
+
+    def table_scans(self):
+        """
+        Scans of base tables.
+        """
+        return [node for node in self.scans() if node.scan_type == SCAN_TABLE]
+
+    def full_scans(self):
+        """
+        Scans that read the whole table / index instead of seeking a key range.
+        """
+        return [node for node in self.scans() if node.is_full_scan]
+
+    def back_joins(self):
+        """
+        Joins of index rows back to the base table: a cross apply with an index scan as input and a table scan as map.
+
+        :return: list of (cross apply node, index scan node, table scan node)
+        """
+        def get_scans(nodes, scan_type):
+            # scans below nested cross applies belong to those
+            scans = []
+            for node in nodes:
+                if node.scan_type == scan_type:
+                    scans.append(node)
+                elif not _is_cross_apply(node):
+                    scans.extend(get_scans(node.get_children(), scan_type))
+            return scans
+
+        back_joins = []
+        for node in self.walk():
+            if not _is_cross_apply(node):
+                continue
+            index_scans = get_scans(node.get_children(LINK_INPUT), SCAN_INDEX)
+            table_scans = get_scans(node.get_children(LINK_MAP), SCAN_TABLE)
+            if index_scans and table_scans:
+                back_joins.append((node, index_scans[0], table_scans[0]))
+        return back_joins
+
+    def distributed_cross_applies(self):
+        """
+        Distributed cross applies fan out one remote call per batch of input rows to the servers of the map side.
+        """
+        return self.find('Distributed Cross Apply')
+
+
+def parse_plan(sql, query_plan, query_stats=None):
+    """
+    :type query_plan: google.cloud.proto.spanner.v1.query_plan_pb2.QueryPlan
+    :rtype: QueryPlan
+    """
+    nodes = []
+    for node_pb in query_plan.plan_nodes:
+        nodes.append(PlanNode(
+            node_pb.index,
+            node_pb.Kind.Name(node_pb.kind),
+            node_pb.display_name,
+            description=node_pb.short_representation.description or None,
+            metadata=json_format.MessageToDict(node_pb.metadata),
+            execution_stats=json_format.MessageToDict(node_pb.execution_stats),
+        ))
+
+    for node_pb, node in zip(query_plan.plan_nodes, nodes):
+        for link in node_pb.child_links:
+            node.children.append((link.type, nodes[link.child_index]))
+    return QueryPlan(sql, nodes, query_stats)
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, division, print_function, unicode_literals
 import logging
+import six
 
 from google.cloud.spanner import types
 
@@ -103,6 +104,12 @@ class SpannerField(object):
     def from_db(self, value):
         return value
 
+    def has_from_db_converter(self):
+        """
+        Returns True if `from_db` needs to be called for loaded values, used to skip no-op conversions.
+        """
+        return six.get_unbound_function(type(self).from_db) is not six.get_unbound_function(SpannerField.from_db)
+
     def to_db(self, model_instance, add):
         """
         Returns field's value just before saving.
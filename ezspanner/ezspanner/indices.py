@@ -102,7 +102,7 @@ class SpannerIndex(object):
         return self.index_fields.keys()
 
     def get_fields_with_sort(self):
-        return ['`%s` %s' % (field_name, field_sort) for field_name, field_sort in self.index_fields.items()]
+        return ['`%s`%s' % (field_name, field_sort) for field_name, field_sort in self.index_fields.items()]
 
 
 class PrimaryKey(SpannerIndex):
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Instrumentation hooks for queries, reads and mutations.
+
+```
+def log_slow_queries(event):
+    if event.latency > 0.5:
+        logger.warning("slow query (%.3fs, %s rows): %s", event.latency, event.rows, event.sql)
+
+Instrumentation.register(POST_EXECUTE, log_slow_queries)
+```
+
+Hooks are called synchronously in the thread that runs the query, exceptions raised by hooks are logged and
+swallowed. Without registered hooks the instrumentation adds no overhead to the query path.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+import logging
+
+import six
+
+logger = logging.getLogger('ezspanner')
+
+# called before a query / read is sent, with a QueryEvent
+PRE_EXECUTE = 'pre_execute'
+# called after the results of a query / read were consumed (or the consumer stopped), with a QueryEvent
+POST_EXECUTE = 'post_execute'
+# called after mutations were committed (or buffered in a transaction / write-behind buffer), with a MutationEvent
+MUTATION_BATCH = 'mutation_batch'
+
+
+class QueryEvent(object):
+    """
+    A sql query (`method` = 'execute_sql') or key read (`method` = 'read').
+    """
+    __slots__ = ('method', 'sql', 'params', 'model', 'rows', 'bytes', 'latency', 'retries', 'error', 'query_stats')
+
+    def __init__(self, method, sql, params, model, retries=0):
+        self.method = method
+        # sql text, the table name for reads
+        self.sql = sql
+        self.params = params
+        self.model = model
+        # number of returned rows
+        self.rows = 0
+        # approximate size of the returned values
+        self.bytes = 0
+        # seconds from sending the request until the results were consumed
+        self.latency = None
+        # number of retries of the surrounding atomic() transaction
+        self.retries = retries
+        self.error = None
+        # dict of Spanner query statistics, only for querysets with_stats()
+        self.query_stats = None
+
+
+class MutationEvent(object):
+    """
+    Mutations of save(), delete() or a bulk operation.
+    """
+    __slots__ = ('mutations', 'rows', 'mutation_count', 'commits', 'latency', 'retries', 'in_transaction', 'buffered',
+                 'error')
+
+    def __init__(self, mutations, in_transaction=False, buffered=False, retries=0):
+        self.mutations = mutations
+        self.rows = sum(len(mutation.values) for mutation in mutations)
+        # mutations as counted by Cloud Spanner, see Mutation.count
+        self.mutation_count = sum(mutation.count() for mutation in mutations)
+        self.commits = 0
+        self.latency = None
+        self.retries = retries
+        # True if the mutations were buffered in an atomic() transaction instead of being committed
+        self.in_transaction = in_transaction
+        # True if the mutations were added to a write_behind() buffer instead of being committed
+        self.buffered = buffered
+        self.error = None
+
+
+class Instrumentation(object):
+    """
+    Registry of instrumentation hooks.
+    """
+    hooks = {
+        PRE_EXECUTE: [],
+        POST_EXECUTE: [],
+        MUTATION_BATCH: [],
+    }
+
+    @classmethod
+    def register(cls, event_type, hook):
+        """
+        :param event_type: PRE_EXECUTE, POST_EXECUTE or MUTATION_BATCH
+        :param hook: callable that receives the event
+        """
+        if event_type not in cls.hooks:
+            raise ValueError("Unknown instrumentation event '%s'" % event_type)
+        # replace the list, senders may iterate over the old one
+        cls.hooks[event_type] = cls.hooks[event_type] + [hook]
+
+    @classmethod
+    def unregister(cls, event_type, hook):
+        cls.hooks[event_type] = [h for h in cls.hooks[event_type] if h != hook]
+
+    @classmethod
+    def clear(cls):
+        for event_type in list(cls.hooks):
+            cls.hooks[event_type] = []
+
+    @classmethod
+    def is_enabled(cls, *event_types):
+        """
+        :return: True if hooks are registered for any of `event_types` (or any event type)
+        """
+        return any(cls.hooks[event_type] for event_type in (event_types or cls.hooks))
+
+    @classmethod
+    def send(cls, event_type, event):
+        for hook in cls.hooks[event_type]:
+            try:
+                hook(event)
+            except Exception:
+                logger.exception("[EZSpanner] instrumentation hook %r failed", hook)
+
+
+def estimate_size(row):
+    """
+    Approximate size of a row's values in bytes.
+    """
+    size = 0
+    for value in row:
+        if value is None:
+            continue
+        if isinstance(value, (six.binary_type, six.text_type)):
+            size += len(value)
+        elif isinstance(value, (list, tuple)):
+            size += estimate_size(value)
+        else:
+            size += 8
+    return size
@@ -1,18 +1,25 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, division, print_function, unicode_literals
 import copy
+import functools
 import inspect
 from bisect import bisect
 from collections import defaultdict, OrderedDict
 import six
 from itertools import chain
+import logging
 
-from .exceptions import ObjectDoesNotExist, FieldError, ModelError
+from .cache import LocalMemoryCache
+from .exceptions import ObjectDoesNotExist, MultipleObjectsReturned, FieldError, ModelError
 from .helper import subclass_exception
 from .connection import Connection
-from .query import SpannerQuerySet
+from .mutations import Mutation, OP_DELETE, OP_INSERT, OP_UPDATE, OP_UPSERT, commit_mutations
+from .query import QuerySetDescriptor, SpannerQuerySet
+from .schema import DEFAULT_POLL_INTERVAL, diff_schema, get_schema, update_ddl
 from .sql import v1 as sql_v1
 
+logger = logging.getLogger('ezspanner')
+
 
 class SpannerModelRegistry(object):
     """
@@ -39,6 +46,23 @@ class SpannerModelRegistry(object):
 
         cls.registered_models[spanner_class._meta.table] = spanner_class
 
+    @classmethod
+    def get_interleaved_children(cls, model):
+        """
+        Return all registered models that are interleaved in `model`, directly or through other children.
+
+        :rtype: list[SpannerModelBase]
+        """
+        children = []
+        for class_instance in cls.registered_models.values():
+            parent = class_instance._meta.parent
+            while parent:
+                if parent is model:
+                    children.append(class_instance)
+                    break
+                parent = parent._meta.parent
+        return children
+
     @classmethod
     def get_registered_models_prio_dict(cls):
         prio_dict = defaultdict(list)
@@ -85,12 +109,63 @@ class SpannerModelRegistry(object):
             ddl_statements.extend(builder.stmt_delete())
         return ddl_statements
 
+    @classmethod
+    def drop_table_statements(cls):
+        """
+        Drop the indices, then the tables with interleaved children before their parents.
+        """
+        ddl_statements = []
+        models = list(cls.get_registered_models_in_correct_order())
+        for spanner_class in models:
+            for index in spanner_class._meta.indices:
+                for statement in sql_v1.SQLIndex(index).stmt_drop():
+                    if statement not in ddl_statements:
+                        ddl_statements.append(statement)
+        for spanner_class in reversed(models):
+            ddl_statements.extend(sql_v1.SQLTable(spanner_class).stmt_delete())
+        return ddl_statements
+
     @classmethod
     def drop_tables(cls, connection_id=None):
         ddl_statements = cls.drop_table_statements()
         database = Connection.get(connection_id=connection_id)
         database.update_ddl(ddl_statements=ddl_statements).result()
 
+    @classmethod
+    def get_schema_diff(cls, connection_id=None, drop_columns=False, drop_indices=True):
+        """
+        Compare the database's schema with the registered models, see ezspanner.schema.
+
+        :rtype: ezspanner.schema.SchemaDiff
+        """
+        database = Connection.get(connection_id=connection_id)
+        return diff_schema(get_schema(database), cls.get_registered_models_in_correct_order(),
+                           drop_columns=drop_columns, drop_indices=drop_indices)
+
+    @classmethod
+    def migrate(cls, connection_id=None, dry_run=False, drop_columns=False, drop_indices=True, max_statements=None,
+                progress=None, poll_interval=DEFAULT_POLL_INTERVAL):
+        """
+        Apply the minimal DDL that brings the database's schema in line with the registered models, instead of
+        re-creating all tables.
+
+        :param connection_id:
+        :param dry_run: only compute the diff
+        :param drop_columns: drop columns that don't exist in the models
+        :param drop_indices: drop indices of the models' tables that don't exist in the models
+        :param max_statements: max statements per schema update, None: a single update
+        :param progress: callable(completed statements, total statements), see ezspanner.schema.update_ddl
+        :param poll_interval: seconds between progress polls
+        :rtype: ezspanner.schema.SchemaDiff
+        """
+        diff = cls.get_schema_diff(connection_id, drop_columns=drop_columns, drop_indices=drop_indices)
+        for warning in diff.warnings:
+            logger.warning("[EZSpanner] migrate: %s", warning)
+        if diff and not dry_run:
+            update_ddl(Connection.get(connection_id=connection_id), diff.statements, max_statements=max_statements,
+                       progress=progress, poll_interval=poll_interval)
+        return diff
+
 
 def register():
     """
@@ -104,19 +179,66 @@ def register():
     return _model_admin_wrapper
 
 
-DEFAULT_NAMES = ('table', 'pk', 'parent', 'parent_on_delete', 'indices', 'indices_inherit', 'abstract')
+DEFAULT_NAMES = ('table', 'pk', 'parent', 'parent_on_delete', 'indices', 'indices_inherit', 'abstract', 'cache',
+                 'compact')
 
 
 class ModelState(object):
     """
     A class for storing instance state
     """
+    __slots__ = ('db', 'adding', 'loaded')
+
     def __init__(self, db=None):
         self.db = db
         # If true, uniqueness validation checks will consider this a new, as-yet-unsaved object.
         # Necessary for correct validation of new instances of objects with explicit (non-auto) PKs.
         # This impacts validation only; it has no effect on the actual save.
         self.adding = True
+        # (field names, values) as loaded from or last written to the database, used to find changed fields
+        self.loaded = None
+
+
+class CompactModelState(object):
+    """
+    ModelState view of a compact instance, the state is stored in slots of the instance itself.
+    """
+    __slots__ = ('instance',)
+
+    def __init__(self, instance):
+        self.instance = instance
+
+    def _get_db(self):
+        return self.instance._state_db
+
+    def _set_db(self, value):
+        self.instance._state_db = value
+
+    def _get_adding(self):
+        return self.instance._state_adding
+
+    def _set_adding(self, value):
+        self.instance._state_adding = value
+
+    def _get_loaded(self):
+        return self.instance._state_loaded
+
+    def _set_loaded(self, value):
+        self.instance._state_loaded = value
+
+    db = property(_get_db, _set_db)
+    adding = property(_get_adding, _set_adding)
+    loaded = property(_get_loaded, _set_loaded)
+
+
+def _get_compact_state(instance):
+    return CompactModelState(instance)
+
+
+def _set_compact_state(instance, state):
+    instance._state_db = state.db
+    instance._state_adding = state.adding
+    instance._state_loaded = state.loaded
 
 
 class SpannerModelMeta(object):
@@ -139,6 +261,13 @@ class SpannerModelMeta(object):
         self.parent_on_delete = 'CASCADE'
         self.abstract = False
 
+        # entity cache backend for primary key lookups (see ezspanner.cache), True = LocalMemoryCache with defaults
+        self.cache = None
+
+        # load instances as slotted objects without __dict__, see SpannerModelBase._create_compact_class
+        self.compact = False
+        self.compact_class = None
+
     def contribute_to_class(self, cls, name):
 
         cls._meta = self
@@ -173,6 +302,9 @@ class SpannerModelMeta(object):
                 raise TypeError("'class Meta' got invalid attribute(s): %s" % ','.join(meta_attrs.keys()))
         del self.meta
 
+        if self.cache is True:
+            self.cache = LocalMemoryCache()
+
         if not self.abstract and not self.table:
             raise ValueError("%s must define a Meta.table!" % cls)
 
@@ -254,6 +386,15 @@ class SpannerModelBase(type):
                 ) or (ObjectDoesNotExist,),
                 module,
                 attached_to=new_class))
+        new_class.add_to_class(
+            'MultipleObjectsReturned',
+            subclass_exception(
+                str('MultipleObjectsReturned'),
+                tuple(
+                    x.MultipleObjectsReturned for x in parents if hasattr(x, '_meta') and not x._meta.abstract
+                ) or (MultipleObjectsReturned,),
+                module,
+                attached_to=new_class))
 
         # Add all attributes to the class.
         for obj_name, obj in attrs.items():
@@ -332,10 +473,36 @@ class SpannerModelBase(type):
         # register class in registry (if not abstract)
         if not new_class._meta.abstract:
             SpannerModelRegistry.register(new_class)
-        setattr(new_class, 'objects', SpannerQuerySet(new_class))
+        setattr(new_class, 'objects', QuerySetDescriptor(SpannerQuerySet(new_class)))
         new_class._prepare()
+
+        if new_class._meta.compact and not new_class._meta.abstract:
+            new_class._meta.compact_class = new_class._create_compact_class()
         return new_class
 
+    def _create_compact_class(cls):
+        """
+        Create the slotted subclass that is used for loaded instances of `Meta.compact` models.
+
+        The fields and the instance state are stored in slots, the instance __dict__ is never allocated (only
+        attributes that are not fields allocate it) and no separate ModelState object is needed. The subclass shares
+        `_meta`, the queryset and the exceptions with the model and is created with type.__new__ to bypass the model
+        setup and registration of this metaclass.
+        """
+        attrs = {
+            '__module__': cls.__module__,
+            '__slots__': tuple(f.name for f in cls._meta.local_fields) +
+            ('_state_db', '_state_adding', '_state_loaded'),
+            '__doc__': cls.__doc__,
+            '_state': property(_get_compact_state, _set_compact_state),
+        }
+        if six.PY3:
+            # allows pickle to find the class through the model
+            attrs['__qualname__'] = '%s._compact_class' % cls.__qualname__
+        compact_class = type.__new__(SpannerModelBase, str('%sCompact' % cls.__name__), (cls,), attrs)
+        cls._compact_class = compact_class
+        return compact_class
+
     def add_to_class(cls, name, value):
         # We should call the contribute_to_class method only if it's bound
         if not inspect.isclass(value) and hasattr(value, 'contribute_to_class'):
@@ -419,9 +586,34 @@ class SpannerModel(six.with_metaclass(SpannerModelBase)):
 
     @classmethod
     def from_db(cls, db, field_names, values):
-        new = cls(**dict(zip(field_names, values)))
+        field_lookup = cls._meta.field_lookup
+        values = [field_lookup[name].from_db(value) for name, value in zip(field_names, values)]
+        return cls._from_row(db, field_names, values)
+
+    @classmethod
+    def _from_row(cls, db, field_names, values):
+        """
+        Fast path for loading instances: assigns already converted values without calling __init__.
+
+        Instances of `Meta.compact` models are created as instance of the model's slotted compact class.
+
+        Fields that are not part of `field_names` are not set on the instance.
+        """
+        compact_class = cls._meta.compact_class
+        if compact_class is not None:
+            new = compact_class.__new__(compact_class)
+            for name, value in zip(field_names, values):
+                setattr(new, name, value)
+            new._state_db = db
+            new._state_adding = False
+            new._state_loaded = (field_names, tuple(values))
+            return new
+
+        new = cls.__new__(cls)
+        new.__dict__.update(zip(field_names, values))
+        new._state = ModelState(db)
         new._state.adding = False
-        new._state.db = db
+        new._state.loaded = (field_names, values)
         return new
 
     @classmethod
@@ -434,14 +626,18 @@ class SpannerModel(six.with_metaclass(SpannerModelBase)):
             return name
 
     def save(self, force_insert=False, force_update=False, using=None,
-             update_fields=None):
+             update_fields=None, upsert=False):
         """
         Saves the current instance. Override this in a subclass if you want to
         control the saving process.
 
+        New instances are inserted, instances loaded from the database are updated and only their changed fields
+        are written (see get_dirty_fields), saving an unchanged instance is a no-op.
+
         The 'force_insert' and 'force_update' parameters can be used to insist
         that the "save" must be an SQL insert or update (or equivalent for
         non-SQL backends), respectively. Normally, they should not be set.
+        `upsert` writes new instances with insert_or_update instead of insert.
         """
         if force_insert and (force_update or update_fields):
             raise ValueError("Cannot force both insert and updating in model saving.")
@@ -466,10 +662,10 @@ class SpannerModel(six.with_metaclass(SpannerModelBase)):
                                  % ', '.join(non_model_fields))
 
         self.save_base(using=using, force_insert=force_insert,
-                       force_update=force_update, update_fields=update_fields)
+                       force_update=force_update, update_fields=update_fields, upsert=upsert)
 
     def save_base(self, force_insert=False,
-                  force_update=False, using=None, update_fields=None):
+                  force_update=False, using=None, update_fields=None, upsert=False):
         """
         Handles the parts of saving which should be done only once per save,
         yet need to be done in raw saves, too. This includes some sanity
@@ -482,109 +678,156 @@ class SpannerModel(six.with_metaclass(SpannerModelBase)):
         # Skip proxies, but keep the origin as the proxy model.
         meta = cls._meta
 
-        updated = self._save_table(cls, force_insert, force_update, using, update_fields)
+        updated = self._save_table(cls, force_insert, force_update, using, update_fields, upsert)
         # Store the database on which the object was saved
         self._state.db = using
         # Once saved, this is no longer a to-be-added instance.
         self._state.adding = False
 
     def _save_table(self, cls=None, force_insert=False,
-                    force_update=False, using=None, update_fields=None):
+                    force_update=False, using=None, update_fields=None, upsert=False):
         """
         Does the heavy-lifting involved in saving. Updates or inserts the data
         for a single table.
+
+        :return: True if the row was updated, False if it was inserted or nothing changed
         """
         meta = cls._meta
         pk_val = self._get_pk_val(meta)
+        if pk_val['missing']:
+            # todo: support auto-generated pk values
+            raise ValueError("Can't save %s without primary key values! Missing: %s" %
+                             (meta.object_name, pk_val['missing']))
         non_pks = [f for f in meta.local_fields if f.name not in pk_val['keys']]
 
+        dirty = None
+        if not self._state.adding:
+            dirty = set(self.get_dirty_fields())
+
+        # new instances and instances whose primary key was changed are written as new rows
+        insert = force_insert or (dirty is None and not (force_update or update_fields)) or \
+            (dirty is not None and not update_fields and not pk_val['keys'].isdisjoint(dirty))
+
+        if insert:
+            # partially loaded instances only write the fields they have
+            self._do_insert(using, pk_val, [f for f in non_pks if hasattr(self, f.name)], upsert)
+            return False
+
         if update_fields:
             non_pks = [f for f in non_pks if f.name in update_fields]
-
-        pk_set = not bool(pk_val['missing'])
-        if not pk_set and (force_update or update_fields):
-            raise ValueError("Cannot force an update in save() with no primary key.")
-
-        updated = False
-        # If possible, try an UPDATE. If that doesn't update anything, do an INSERT.
-        # UPDATE
-        if pk_set and not force_insert:
-            forced_update = update_fields or force_update
-            updated = self._do_update(using, pk_val, non_pks, forced_update)
-            if force_update and not updated:
-                raise ModelError("Forced update did not affect any rows.")
-
-        # INSERT
-        if not updated:
-            # todo: support auto-generated pk values
-            if not pk_set:
-                raise ValueError("Can't insert value without primary key values! Missing: %s" % pk_val['missing'])
-            self._do_insert(using, pk_val, non_pks)
-        return updated
+        elif dirty is not None:
+            non_pks = [f for f in non_pks if f.name in dirty]
+            if not non_pks:
+                # nothing changed
+                return False
+        return self._do_update(using, pk_val, non_pks, update_fields or force_update)
 
     def _do_update(self, using, pk_val, update_fields, forced_update):
         """
-        This method will try to update the model. If the model was updated (in
-        the sense that an update query was done and a matching row was found
-        from the DB) the method will return True.
+        Write the changed columns of an existing row.
         """
-        database = Connection.get(connection_id=using)
-        with database.batch() as batch:
+        # add primary keys to the updated columns
+        columns = pk_val['columns'] + [f.name for f in update_fields]
+        mutation = Mutation(OP_UPDATE, self._meta.table, columns, [self._get_column_values(columns)])
+        commit_mutations(Connection.get(connection_id=using), [mutation])
+        self._mark_clean(columns)
+        return True
 
-            # add primary keys to the updated columns
-            columns = [pk_val['keys']] + [f.name for f in update_fields]
+    def _do_insert(self, using, pk_val, update_fields, upsert=False):
+        """
+        Do an INSERT (or insert_or_update if `upsert` is set).
+        """
+        # add primary keys to the inserted columns
+        columns = pk_val['columns'] + [f.name for f in update_fields]
+        mutation = Mutation(OP_UPSERT if upsert else OP_INSERT, self._meta.table, columns,
+                            [self._get_column_values(columns, add=True)])
+        commit_mutations(Connection.get(connection_id=using), [mutation])
+        self._mark_clean(columns, reset=True)
+
+    def get_dirty_fields(self):
+        """
+        Return the names of the fields that changed since the instance was loaded or last saved, all fields for new
+        instances.
 
-            result = batch.update(
-                table=self._meta.table,
-                columns=columns,
-                values=pk_val['values'] + [f.to_db(self, False) for f in update_fields]
-            )
-            print (result)
-            return True
+        Values are compared with `!=`, in-place changes of mutable values (e.g. appending to a list) are not
+        detected, assign a new value instead.
 
-    def _do_insert(self, using, pk_val, update_fields):
+        :rtype: list
         """
-        Do an INSERT. If update_pk is defined then this method should return
-        the new pk for the model.
+        loaded = self._state.loaded
+        if loaded is None:
+            return [f.name for f in self._meta.local_fields]
+
+        field_names, loaded_values = loaded
+        dirty = [name for name, value in zip(field_names, loaded_values) if getattr(self, name, value) != value]
+        # fields that were not loaded but have been set since
+        dirty.extend(f.name for f in self._meta.local_fields if f.name not in field_names and hasattr(self, f.name))
+        return dirty
+
+    def _mark_clean(self, field_names, reset=False):
         """
-        database = Connection.get(connection_id=using)
-        with database.batch() as batch:
-            # add primary keys to the updated columns
-            columns = [pk_val['keys']] + [f.name for f in self.meta.local_fields]
+        Store the current values of `field_names` as written to the database.
 
-            result = batch.insert(
-                table=self._meta.table,
-                columns=columns,
-                values=pk_val['values'] + [f.to_db(self, True) for f in update_fields]
-            )
-            pass
+        :param reset: forget the previously stored values
+        """
+        snapshot = {}
+        if not reset and self._state.loaded is not None:
+            snapshot.update(zip(*self._state.loaded))
+        for name in field_names:
+            snapshot[name] = getattr(self, name, None)
+        self._state.loaded = (tuple(snapshot.keys()), list(snapshot.values()))
+
+    def asave(self, force_insert=False, force_update=False, using=None, update_fields=None, upsert=False):
+        """
+        Awaitable version of save, runs in the bounded executor of the connection (see ezspanner.aio).
+        """
+        from .aio import run
+        return run(functools.partial(self.save, force_insert=force_insert, force_update=force_update, using=using,
+                                     update_fields=update_fields, upsert=upsert), connection_id=using)
+
+    def adelete(self, using=None, keep_parents=False):
+        """
+        Awaitable version of delete.
+        """
+        from .aio import run
+        return run(functools.partial(self.delete, using=using, keep_parents=keep_parents), connection_id=using)
 
     def delete(self, using=None, keep_parents=False):
         pk_val = self._get_pk_val()
-        assert pk_val['missing'] is False, (
+        assert not pk_val['missing'], (
             "%s object can't be deleted because primary keys are missing: %s." %
             (self._meta.object_name, pk_val['missing'])
         )
 
-        database = Connection.get(connection_id=using)
-        with database.batch() as batch:
-            batch.delete(
-                table=self._meta.table,
-                columns=pk_val['keys'],
-                values=pk_val['values']
-            )
+        mutation = Mutation(OP_DELETE, self._meta.table, pk_val['columns'], [pk_val['values']])
+        commit_mutations(Connection.get(connection_id=using), [mutation])
+        # saving the instance again inserts a new row
+        self._state.adding = True
+        self._state.loaded = None
 
         return True
 
     def _get_pk_val(self, meta=None):
         if not meta:
             meta = self._meta
-        keys = meta.primary.fields
-        values = [getattr(self, k) for k in keys]
+        columns = list(meta.primary.get_field_names())
+        values = [getattr(self, k) for k in columns]
         pk_data = {
-            'keys': set(keys),
+            'keys': set(columns),
+            'columns': columns,
             'values': values,
-            'missing': [keys[i] for i, v in enumerate(values) if not v],
+            'missing': [columns[i] for i, v in enumerate(values) if v is None],
         }
 
         return pk_data
+
+    def _get_column_values(self, columns, add=False):
+        """
+        Return the database values for `columns`, e.g. to build a mutation row.
+
+        :param columns: list of field names
+        :param add: True if the values are used for an insert
+        :rtype: list
+        """
+        field_lookup = self._meta.field_lookup
+        return [field_lookup[column].to_db(self, add) for column in columns]
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+import time
+from collections import OrderedDict
+
+import six
+from google.cloud.spanner import KeySet
+
+from .cache import invalidate_mutations
+from .context import get_transaction, get_write_buffer
+from .instrumentation import Instrumentation, MutationEvent, MUTATION_BATCH
+
+# Cloud Spanner rejects commits with more than 20k mutations, every written cell (and every deleted row) counts.
+MAX_MUTATIONS_PER_COMMIT = 20000
+
+OP_INSERT = 'insert'
+OP_UPDATE = 'update'
+OP_UPSERT = 'insert_or_update'
+OP_DELETE = 'delete'
+
+
+class Mutation(object):
+    """
+    A group of rows of one table that are written with the same operation and column set.
+
+    For OP_DELETE `columns` are the primary key columns and `values` the keys of the deleted rows.
+    """
+    __slots__ = ('op', 'table', 'columns', 'values')
+
+    def __init__(self, op, table, columns, values=None):
+        self.op = op
+        self.table = table
+        self.columns = tuple(columns)
+        self.values = values if values is not None else []
+
+    def __repr__(self):
+        return '<Mutation: %s %s (%s) x %s>' % (self.op, self.table, ', '.join(self.columns), len(self.values))
+
+    @property
+    def mutations_per_row(self):
+        return 1 if self.op == OP_DELETE else max(len(self.columns), 1)
+
+    def count(self):
+        """
+        Number of mutations this group adds to a commit.
+        """
+        return self.mutations_per_row * len(self.values)
+
+    def apply(self, batch):
+        """
+        Add the rows to a batch or transaction.
+
+        :type batch: google.cloud.spanner.batch._BatchBase
+        """
+        if self.op == OP_DELETE:
+            batch.delete(self.table, KeySet(keys=self.values))
+        else:
+            getattr(batch, self.op)(table=self.table, columns=self.columns, values=self.values)
+
+
+def get_columns(obj, op, fields=None):
+    """
+    Return the column names written by `op` for a model instance.
+
+    :type obj: ezspanner.models.SpannerModel
+    :param op: one of the OP_* constants
+    :param fields: for OP_UPDATE: restrict written columns to these field names (primary key columns are always added)
+    :rtype: tuple
+    """
+    meta = obj._meta
+    pk_columns = tuple(meta.primary.get_field_names())
+    if op == OP_DELETE:
+        return pk_columns
+    if fields is None:
+        return tuple(f.name for f in meta.local_fields)
+    fields = set(fields)
+    return pk_columns + tuple(f.name for f in meta.local_fields if f.name in fields and f.name not in pk_columns)
+
+
+def build_mutations(op, objs, fields=None):
+    """
+    Group model instances by table and column set.
+
+    :param op: one of the OP_* constants
+    :type objs: list[ezspanner.models.SpannerModel]
+    :param fields: see get_columns
+    :rtype: list[Mutation]
+    """
+    groups = OrderedDict()
+    for obj in objs:
+        meta = obj._meta
+        columns = get_columns(obj, op, fields)
+        key = (meta.table, columns)
+        mutation = groups.get(key)
+        if mutation is None:
+            mutation = groups[key] = Mutation(op, meta.table, columns)
+        mutation.values.append(obj._get_column_values(columns, op == OP_INSERT))
+    return list(groups.values())
+
+
+def split_mutations(mutations, max_mutations=MAX_MUTATIONS_PER_COMMIT):
+    """
+    Pack mutation groups into as few commits as possible, groups are split if they don't fit into one commit.
+
+    :type mutations: list[Mutation]
+    :param max_mutations: max mutations per commit
+    :return: generator of lists of mutations, one list per commit
+    """
+    chunk = []
+    chunk_size = 0
+    for mutation in mutations:
+        per_row = mutation.mutations_per_row
+        if per_row > max_mutations:
+            raise ValueError("A single %s row of `%s` exceeds the limit of %s mutations per commit." %
+                             (mutation.op, mutation.table, max_mutations))
+        rows = mutation.values
+        while rows:
+            free_rows = (max_mutations - chunk_size) // per_row
+            if free_rows == 0:
+                yield chunk
+                chunk, chunk_size = [], 0
+                continue
+            part = Mutation(mutation.op, mutation.table, mutation.columns, rows[:free_rows])
+            rows = rows[free_rows:]
+            chunk.append(part)
+            chunk_size += part.count()
+    if chunk:
+        yield chunk
+
+
+def commit_mutations(database, mutations, max_mutations=MAX_MUTATIONS_PER_COMMIT, write_behind=True):
+    """
+    Commit mutation groups using as few batches as possible.
+
+    Cached rows (see ezspanner.cache) are invalidated after each commit. Within an `atomic()` block the mutations
+    are buffered in the transaction instead and committed with it, within a `write_behind()` block they are added to
+    its buffer.
+
+    :type database: google.cloud.spanner.database.Database
+    :type mutations: list[Mutation]
+    :param max_mutations: max mutations per commit
+    :param write_behind: False to bypass an active write-behind buffer
+    :rtype: int
+    :return: number of commits
+    """
+    state = get_transaction(database)
+    write_buffer = get_write_buffer(database) if state is None and write_behind else None
+    event = None
+    if Instrumentation.is_enabled(MUTATION_BATCH):
+        event = MutationEvent(mutations, in_transaction=state is not None, buffered=write_buffer is not None,
+                              retries=state.attempt - 1 if state is not None else 0)
+        start = time.time()
+
+    commits = 0
+    try:
+        if state is not None:
+            state.buffer(mutations)
+        elif write_buffer is not None:
+            write_buffer.add(mutations)
+        else:
+            for chunk in split_mutations(mutations, max_mutations):
+                with database.batch() as batch:
+                    for mutation in chunk:
+                        mutation.apply(batch)
+                invalidate_mutations(chunk)
+                commits += 1
+    except Exception as e:
+        if event is not None:
+            event.error = e
+        raise
+    finally:
+        if event is not None:
+            event.commits = commits
+            event.latency = time.time() - start
+            Instrumentation.send(MUTATION_BATCH, event)
+    return commits
+
+
+def apply_pending(pending, model, keys, by_key, db=None):
+    """
+    Apply buffered (not yet committed) writes to rows that were read by primary key.
+
+    :param pending: (table, key tuple) -> (complete row, column -> value dict) or None for deleted rows
+    :param keys: list of primary key tuples
+    :param by_key: key -> list of read instances, modified in place
+    """
+    table = model._meta.table
+    for key in keys:
+        if (table, key) not in pending:
+            continue
+        write = pending[(table, key)]
+        if write is None:
+            by_key.pop(key, None)
+            continue
+
+        complete, values = write
+        instances = by_key.get(key)
+        if instances:
+            for instance in instances:
+                for name, value in six.iteritems(values):
+                    setattr(instance, name, value)
+                instance._mark_clean(list(values.keys()))
+        elif complete:
+            by_key[key] = [model._from_row(db, list(values.keys()), list(values.values()))]
@@ -1,13 +1,382 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, division, print_function, unicode_literals
+import base64
 import copy
-from collections import OrderedDict, defaultdict
+import datetime
+import functools
+import json
+import threading
+import time
+import warnings
+from collections import OrderedDict
+from itertools import islice
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 import six
+from six.moves import queue
+from google.protobuf import json_format
+from google.cloud._helpers import UTC
+from google.cloud.proto.spanner.v1 import type_pb2
+from google.cloud.proto.spanner.v1.spanner_pb2 import ExecuteSqlRequest
+from google.cloud.spanner import INT64_PARAM_TYPE, ArrayParamType, KeyRange, KeySet, StructField, StructParamType
 
 from ezspanner.fields import SpannerField
 from ezspanner.query_utils import LOOKUP_SEP, Q, F
-from .exceptions import ModelError, SpannerIndexError, QueryError, QueryJoinError
+from .exceptions import FullScanWarning, ModelError, SpannerIndexError, QueryError, QueryJoinError, QueryPlanError
 from .connection import Connection
+from .advisor import advise_index
+from .aggregates import get_aggregates
+from .cache import get_cache_key
+from .columns import DEFAULT_CHUNK_SIZE, read_columns, to_arrow as columns_to_arrow, to_numpy as columns_to_numpy
+from .context import get_reader, get_transaction, get_write_buffer
+from .explain import parse_plan
+from .helper import LRUCache
+from .instrumentation import Instrumentation, QueryEvent, PRE_EXECUTE, POST_EXECUTE, estimate_size
+from .mutations import MAX_MUTATIONS_PER_COMMIT, OP_DELETE, OP_INSERT, OP_UPDATE, OP_UPSERT, build_mutations, \
+    commit_mutations, get_columns
+
+
+class CompiledStatement(object):
+    """
+    SQL text of a queryset shape plus its ordered parameter slots.
+
+    The statement doesn't contain any concrete filter values, it can be shared by all querysets with the same
+    shape (see `SpannerQuerySet._get_shape`), only the values have to be bound for each execution.
+    """
+
+    def __init__(self, sql, param_slots, select_targets=None):
+        self.sql = sql
+        # list of (param_name, spanner param type) tuples in binding order
+        self.param_slots = param_slots
+        # list of (model_or_alias, field_name) tuples, one per selected column
+        self.select_targets = select_targets or []
+        # ModelHydrator for the selected columns, created on first execution
+        self.hydrator = None
+        # IndexAdvice of querysets with auto_index()
+        self.index_advice = None
+        # param_name -> True for arrays of structs, False for other arrays; their values are converted to lists
+        self.array_params = dict((param_id, param_type.array_element_type.code == type_pb2.STRUCT)
+                                 for param_id, param_type in param_slots if param_type.code == type_pb2.ARRAY)
+        # FLOAT64 (or ARRAY<FLOAT64>) params, the client library encodes ints as strings which Spanner rejects
+        self.float_params = frozenset(
+            param_id for param_id, param_type in param_slots
+            if type_pb2.FLOAT64 in (param_type.code, param_type.array_element_type.code))
+
+    def bind(self, values):
+        """
+        Bind concrete values to the parameter slots.
+
+        :param values: list of values, in the same order as `param_slots`
+        :rtype: tuple[dict, dict]
+        :return: params and param_types dict for `execute_sql`
+        """
+        if len(values) != len(self.param_slots):
+            raise QueryError("Statement expects %s params, got %s" % (len(self.param_slots), len(values)))
+
+        params = {}
+        param_types = {}
+        for (param_id, param_type), value in zip(self.param_slots, values):
+            if param_id in self.array_params:
+                # the client library only encodes lists (e.g. no tuples, sets or generators)
+                if self.array_params[param_id]:
+                    value = [list(item) for item in value]
+                elif not isinstance(value, list):
+                    value = list(value)
+            if param_id in self.float_params and value is not None:
+                value = [_to_float(v) for v in value] if param_id in self.array_params else _to_float(value)
+            params[param_id] = value
+            param_types[param_id] = param_type
+        return params, param_types
+
+
+def _to_float(value):
+    return value if value is None or isinstance(value, float) else float(value)
+
+
+class QueryCompiler(object):
+    """
+    Keeps track of the params that are allocated while a queryset is compiled to sql.
+    """
+
+    def __init__(self, qs):
+        self.qs = qs
+        self.param_slots = []
+        self.param_values = []
+        self._param_ids = set()
+        # set by SpannerQuerySet._build_query for querysets with auto_index()
+        self.index_advice = None
+
+    def add_param(self, field, value, param_type=None):
+        """
+        Allocate a unique placeholder name for a filter value.
+
+        :type field: ezspanner.fields.SpannerField|unicode
+        :param field: field or param name, `param_type` is required for names
+        :param value:
+        :param param_type: spanner param type, defaults to the field's type
+        :return: placeholder name (without @)
+        """
+        name = field if isinstance(field, six.string_types) else field.name
+        param_id = name
+        i = 0
+        while param_id in self._param_ids:
+            i += 1
+            param_id = name+'_'+str(i)
+        self._param_ids.add(param_id)
+        self.param_slots.append((param_id, param_type or field.get_spanner_type()))
+        self.param_values.append(value)
+        return param_id
+
+    def compile(self):
+        """
+        :rtype: CompiledStatement
+        """
+        statement = CompiledStatement(self.qs._build_query(self), self.param_slots, self.qs._get_select_targets())
+        statement.index_advice = self.index_advice
+        return statement
+
+
+class DictHydrator(object):
+    """
+    Turns result rows of grouped querysets into dicts.
+    """
+
+    def __init__(self, names):
+        self.names = names
+
+    def hydrate(self, rows, db=None):
+        names = self.names
+        for row in rows:
+            yield dict(zip(names, row))
+
+
+class ModelHydrator(object):
+    """
+    Turns result rows into model instances.
+
+    The column to attribute mapping is computed once per statement, rows are converted without going through
+    `SpannerModel.__init__`. Columns of joined models are hydrated into their own instances, which are attached to the
+    base instance as attribute named like the join alias (or the joined model's `_meta.model_name`).
+    """
+
+    def __init__(self, qs, select_targets, prefetch=True):
+        """
+
+        :type qs: SpannerQuerySet
+        :param select_targets: list of (model_or_alias, field_name) tuples, see SpannerQuerySet._get_select_targets
+        :param prefetch: False if the rows don't contain the queryset's prefetched children (read API)
+        """
+        positions = OrderedDict()
+        for i, (model_or_alias, field_name) in enumerate(select_targets):
+            positions.setdefault(model_or_alias, []).append((i, field_name))
+
+        # list of (attribute name, model, column indexes, field names, converters)
+        self.groups = []
+        for model_or_alias, columns in six.iteritems(positions):
+            model = qs._check_model_joined(model_or_alias)
+            if model_or_alias == qs.model:
+                attribute = None
+            else:
+                attribute = model_or_alias if isinstance(model_or_alias, six.string_types) else model._meta.model_name
+            field_names = tuple(field_name for _, field_name in columns)
+            converters = tuple(
+                (j, model._meta.field_lookup[field_name].from_db) for j, field_name in enumerate(field_names)
+                if model._meta.field_lookup[field_name].has_from_db_converter()
+            )
+            self.groups.append((attribute, model, tuple(i for i, _ in columns), field_names, converters))
+
+        # the base model's columns come first, see SpannerQuerySet._get_select_targets
+        self.groups.sort(key=lambda group: group[0] is not None)
+
+        # prefetched children follow the selected columns, see SpannerQuerySet.prefetch_children
+        self.prefetches = []
+        for i, node in enumerate(qs._get_prefetch_tree() if qs.prefetches and prefetch else ()):
+            self.prefetches.append(PrefetchHydrator(node, len(select_targets) + i))
+
+    def hydrate_row(self, row, db=None):
+        instance = None
+        for attribute, model, indexes, field_names, converters in self.groups:
+            values = [row[i] for i in indexes]
+            for j, converter in converters:
+                values[j] = converter(values[j])
+
+            if attribute is None:
+                instance = model._from_row(db, field_names, values)
+            elif instance is not None:
+                # outer joins without a match return NULLs only
+                joined = None if all(v is None for v in values) else model._from_row(db, field_names, values)
+                setattr(instance, attribute, joined)
+        for prefetch in self.prefetches:
+            prefetch.attach(instance, row, db)
+        return instance
+
+    def hydrate(self, rows, db=None):
+        """
+        Lazily convert `rows`, consumes one row at a time.
+        """
+        hydrate_row = self.hydrate_row
+        for row in rows:
+            yield hydrate_row(row, db)
+
+
+class PrefetchHydrator(object):
+    """
+    Turns the `ARRAY(SELECT AS STRUCT ...)` column of a prefetched child model into a list of instances.
+    """
+
+    def __init__(self, node, index):
+        """
+        :param node: (attribute, model, children), see SpannerQuerySet._get_prefetch_tree
+        :param index: position of the array in the row (resp. the parent's struct)
+        """
+        attribute, model, children = node
+        self.attribute = attribute
+        self.model = model
+        self.index = index
+        self.field_names = tuple(f.name for f in model._meta.local_fields)
+        self.converters = tuple((j, f.from_db) for j, f in enumerate(model._meta.local_fields)
+                                if f.has_from_db_converter())
+        self.children = [PrefetchHydrator(child, len(self.field_names) + i) for i, child in enumerate(children)]
+
+    def attach(self, instance, row, db=None):
+        count = len(self.field_names)
+        instances = []
+        for item in row[self.index] or ():
+            values = item[:count]
+            for j, converter in self.converters:
+                values[j] = converter(values[j])
+            child = self.model._from_row(db, self.field_names, values)
+            for prefetch in self.children:
+                prefetch.attach(child, item, db)
+            instances.append(child)
+        setattr(instance, self.attribute, instances)
+
+
+class ReadResult(object):
+    """
+    Iterates over (instance, raw row) tuples of a read API call.
+    """
+
+    def __init__(self, columns, rows, hydrator, db=None):
+        self.columns = columns
+        self.rows = rows
+        self.hydrator = hydrator
+        self.db = db
+
+    def __iter__(self):
+        hydrate_row = self.hydrator.hydrate_row
+        for row in self.rows:
+            yield hydrate_row(row, self.db), row
+
+
+class Page(object):
+    """
+    A page of results returned by SpannerQuerySet.paginate.
+    """
+
+    def __init__(self, objects, cursor, has_next):
+        self.objects = objects
+        # opaque cursor to resume after this page, None if the page is empty
+        self.cursor = cursor
+        self.has_next = has_next
+
+    def __iter__(self):
+        return iter(self.objects)
+
+    def __len__(self):
+        return len(self.objects)
+
+
+def _encode_cursor_value(value):
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(UTC).replace(tzinfo=None)
+        delta = value - datetime.datetime(1970, 1, 1)
+        return {'ts': (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds}
+    if isinstance(value, datetime.date):
+        return {'date': value.toordinal()}
+    if isinstance(value, six.binary_type):
+        return {'bytes': base64.b64encode(value).decode('ascii')}
+    return value
+
+
+def _decode_cursor_value(value):
+    if isinstance(value, dict):
+        if 'ts' in value:
+            return datetime.datetime(1970, 1, 1, tzinfo=UTC) + datetime.timedelta(microseconds=value['ts'])
+        if 'date' in value:
+            return datetime.date.fromordinal(value['date'])
+        if 'bytes' in value:
+            return base64.b64decode(value['bytes'])
+    return value
+
+
+def encode_cursor(ordering, values):
+    """
+    Encode the sort values of the last row of a page as opaque url-safe cursor.
+    """
+    data = {
+        'o': ['-' + field_name if descending else field_name for _, field_name, descending in ordering],
+        'v': [_encode_cursor_value(value) for value in values],
+    }
+    return base64.urlsafe_b64encode(json.dumps(data, separators=(',', ':')).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor, ordering):
+    """
+    Decode a cursor created by encode_cursor and verify that it matches `ordering`.
+
+    :rtype: tuple
+    """
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+        columns, values = data['o'], data['v']
+    except (ValueError, TypeError, KeyError, AttributeError):
+        raise QueryError("Invalid pagination cursor!")
+
+    expected = ['-' + field_name if descending else field_name for _, field_name, descending in ordering]
+    if columns != expected or len(values) != len(expected):
+        raise QueryError("Pagination cursor doesn't match the queryset's ordering!")
+    return tuple(_decode_cursor_value(value) for value in values)
+
+
+class PartitionError(object):
+    """
+    Wraps an exception raised while processing a partition.
+    """
+
+    def __init__(self, error):
+        self.error = error
+
+
+# process-wide cache of compiled statements, keyed by queryset shape
+statement_cache = LRUCache(maxsize=1024)
+
+
+# select modes of a queryset, None selects the model columns
+SELECT_COUNT = 'count'
+SELECT_EXISTS = 'exists'
+
+# LIMIT for open ended slices, Cloud Spanner only supports OFFSET together with LIMIT
+MAX_LIMIT = 2 ** 63 - 1
+
+# ops of keyset pagination terms besides '=', '<' and '>', see SpannerQuerySet._get_seek_terms
+SEEK_IS_NULL = 'IS NULL'
+SEEK_IS_NOT_NULL = 'IS NOT NULL'
+SEEK_LT_OR_NULL = '< OR IS NULL'
+SEEK_BOUND_OPS = frozenset(['=', '<', '>', SEEK_LT_OR_NULL])
+
+
+class QuerySetDescriptor(object):
+    """
+    Model.objects: returns a fresh clone of the model's queryset on every access, results cached by one queryset
+    are never shared through the model class.
+    """
+
+    def __init__(self, queryset):
+        self.queryset = queryset
+
+    def __get__(self, instance, owner):
+        return self.queryset._clone()
 
 
 # noinspection PyMethodFirstArgAssignment
@@ -25,15 +394,48 @@ class SpannerQuerySet(object):
         self.joins = OrderedDict()
         # allows to force-select an index for the self.model table.
         self.selected_index = None
+        # let the index advisor choose an index if none is selected, see auto_index()
+        self.auto_index_enabled = False
+        # IndexAdvice of the last compilation with auto_index()
+        self.index_advice = None
         # keeps track which fields from which models should be returned
         self.selected_fields = OrderedDict()
         # WHERE clause filter conditions
         self.where = None
 
-        # param storage for later concrete value injection, keeps track of replacement_key and value.
-        self.params = {}
-
-        self.field_lookup = defaultdict(list)
+        # compiled statement for the current shape, set by _compile
+        self._compiled = None
+
+        # timestamp bound for stale reads, see stale()
+        self.read_options = None
+
+        # tuple of (model_or_alias, field name, descending) tuples
+        self.ordering = ()
+        self.limit_value = None
+        self.offset_value = None
+        # keyset pagination: (ordering, values) - only return rows after values in ordering
+        self.seek = None
+        # None or one of the SELECT_* modes, see count() and exists()
+        self.select_mode = None
+
+        # tuple of (model_or_alias, field name) tuples, see group_by()
+        self.group_by_fields = ()
+        # alias -> Aggregate, replaced instead of mutated (see _clone)
+        self.annotations = OrderedDict()
+        # HAVING filter conditions on annotation aliases
+        self.having_q = None
+        # tuple of (attribute, child model) tuples, see prefetch_children()
+        self.prefetches = ()
+
+        # ExecuteSqlRequest.PROFILE to collect query statistics, see with_stats()
+        self.query_mode = None
+        # statistics of the last execution in PROFILE mode
+        self.query_stats = None
+        # QueryPlan pb of the last execution in PLAN / PROFILE mode, see explain()
+        self.query_plan = None
+
+        # column name -> tuple of models, tuples are replaced instead of mutated (see _clone)
+        self.field_lookup = {}
 
         self._result_cache = None
 
@@ -52,9 +454,30 @@ class SpannerQuerySet(object):
                 obj.__dict__[k] = copy.deepcopy(v, memo)
         return obj
 
+    def _clone(self):
+        """
+        Return a copy of this queryset for chained calls.
+
+        The containers are copied shallowly and share their values with this queryset: join definitions,
+        selected field lists, field lookup tuples and the Q tree are treated as immutable and are always replaced
+        instead of modified in place (copy-on-write).
+
+        :rtype: SpannerQuerySet
+        """
+        obj = self.__class__.__new__(self.__class__)
+        obj.__dict__.update(self.__dict__)
+        obj.joins = self.joins.copy()
+        obj.selected_fields = self.selected_fields.copy()
+        obj.field_lookup = self.field_lookup.copy()
+        obj._compiled = None
+        obj._result_cache = None
+        obj.query_stats = None
+        obj.query_plan = None
+        return obj
+
     def _discover_columns(self, model):
         for field in model._meta.local_fields:
-            self.field_lookup[field.name].append(model)
+            self.field_lookup[field.name] = self.field_lookup.get(field.name, ()) + (model,)
 
     def is_column_ambiguous_or_unknown(self, column):
         """
@@ -63,9 +486,10 @@ class SpannerQuerySet(object):
 
         :raises QueryError: if column is ambiguous or not found.
         """
-        if len(self.field_lookup[column]) == 0:
+        models = self.field_lookup.get(column, ())
+        if len(models) == 0:
             raise QueryError("Field '%s' is unknown!" % column)
-        if len(self.field_lookup[column]) > 1:
+        if len(models) > 1:
             raise QueryError("Field '%s' is ambiguous, you must specify a model/model alias!" % column)
 
     def get_model_for_column(self, column):
@@ -87,7 +511,7 @@ class SpannerQuerySet(object):
         :param index_name:
         :rtype: SpannerQuerySet
         """
-        self = copy.deepcopy(self)
+        self = self._clone()
         # check if index exists
         if not self.model._meta.index_lookup.get(index_name) and index_name != '_BASE_TABLE':
             raise SpannerIndexError("invalid index specified! '%s' is not a valid index name for model '%s'" %
@@ -115,7 +539,7 @@ class SpannerQuerySet(object):
 
         :rtype: SpannerQuerySet
         """
-        self = copy.deepcopy(self)
+        self = self._clone()
         if not model:
             raise QueryJoinError("You must specify a model as first parameter!")
         if self.joins.get(model) and not alias:
@@ -165,15 +589,6 @@ class SpannerQuerySet(object):
         elif self.selected_fields.get(model) is not None:
             del self.selected_fields[model]
 
-    def add_param(self, field, value):
-        param_id = field.name
-        i = 0
-        while self.params.get(param_id) is not None:
-            i += 1
-            param_id = field.name+'_'+str(i)
-        self.params[param_id] = {'value': value, 'type': field.get_spanner_type()}
-        return param_id
-
     def values(self, *fields, **kwargs):
         """
         Set return values for this queryset.
@@ -186,7 +601,7 @@ class SpannerQuerySet(object):
 
         :rtype: SpannerQuerySet
         """
-        self = copy.deepcopy(self)
+        self = self._clone()
         self._set_values(fields, **kwargs)
         return self
 
@@ -254,7 +669,7 @@ class SpannerQuerySet(object):
         return self._filter_or_exclude(True, True, *args, **kwargs)
 
     def _filter_or_exclude(self, negate, op_and, *args, **kwargs):
-        self = copy.deepcopy(self)
+        self = self._clone()
         if negate:
             q_obj = ~Q(*args, **kwargs)
         else:
@@ -281,49 +696,627 @@ class SpannerQuerySet(object):
 
         :rtype: SpannerQuerySet
         """
-        self = copy.deepcopy(self)
+        self = self._clone()
         self.conn = Connection.get(connection_id)
         return self
 
-    def group_by(self):
+    def order_by(self, *fields):
         """
-        Add group by clause
+        Order results by fields, prefix field names with '-' for descending order. Field names refer to the base
+        model, use F instances for joined models. Call without arguments to clear the ordering.
+
+        Example: qs.order_by('-id_b', F('t', 'id_a'))
 
         :rtype: SpannerQuerySet
         """
-        self = copy.deepcopy(self)
-        # todo: implement group by
+        self = self._clone()
+        self.ordering = tuple(self._resolve_order_field(f) for f in fields)
         return self
 
-    def annotate(self, *args, **kwargs):
+    def _resolve_order_field(self, field):
+        descending = False
+        if isinstance(field, F):
+            model_or_alias, field_name = field.model_or_alias or self.model, field.column
+        else:
+            field = field.name if isinstance(field, SpannerField) else field
+            if field.startswith('-'):
+                descending, field = True, field[1:]
+            model_or_alias, field_name = self.model, field
+            if field_name in self.annotations:
+                return None, field_name, descending
+
+        model = self._check_model_joined(model_or_alias)
+        if not model._meta.field_lookup.get(field_name):
+            raise ModelError("'%s' is an invalid field for model '%s'" % (field_name, model))
+        return model_or_alias, field_name, descending
+
+    def limit(self, limit, offset=None):
         """
+        Limit the number of returned rows, optionally skipping `offset` rows.
 
-        :param args:
-        :param kwargs:
+        Prefer `paginate` for deep pages: Spanner still has to read all skipped rows.
 
+        :type limit: int|None
+        :type offset: int|None
         :rtype: SpannerQuerySet
         """
-        self = copy.deepcopy(self)
+        if offset is not None and limit is None:
+            raise QueryError("An offset requires a limit!")
+        self = self._clone()
+        self.limit_value = limit
+        self.offset_value = offset or None
         return self
 
-    def aggregate(self, *args, **kwargs):
+    def paginate(self, page_size, after=None, connection_id=None):
         """
+        Iterate over the results page by page with keyset pagination.
 
-        :param args:
-        :param kwargs:
+        Each page is fetched with a seek predicate on the sort columns of the last row (e.g. `a > @a OR (a = @a AND
+        b > @b)`) instead of an OFFSET, deep pages are as cheap as the first one. The sort order is the queryset's
+        ordering, the forced index's order or the primary key order, completed with the primary key columns to
+        make it unique.
+
+        :param page_size:
+        :param after: (optional) cursor of a previous page to resume after
+        :param connection_id:
+        :return: generator of Page instances
+        """
+        ordering = self._get_seek_ordering()
+        self = self.order_by().limit(page_size + 1)
+        self.ordering = ordering
+        if after is not None:
+            self.seek = (ordering, decode_cursor(after, ordering))
+
+        while True:
+            instances = list(self.execute(connection_id=connection_id))
+            has_next = len(instances) > page_size
+            instances = instances[:page_size]
+            cursor = None
+            if instances:
+                last = instances[-1]
+                try:
+                    values = tuple(getattr(last, field_name) for _, field_name, _ in ordering)
+                except AttributeError:
+                    raise QueryError("All sort columns must be selected for pagination: %s" %
+                                     ', '.join(field_name for _, field_name, _ in ordering))
+                cursor = encode_cursor(ordering, values)
+                self = self._clone()
+                self.seek = (ordering, values)
+
+            yield Page(instances, cursor, has_next)
+            if not has_next:
+                break
+
+    def _get_seek_ordering(self):
+        """
+        Return the queryset ordering completed with the primary key columns of the base model.
+        """
+        meta = self.model._meta
+        if self.ordering:
+            ordering = list(self.ordering)
+        elif self.selected_index and self.selected_index != '_BASE_TABLE':
+            index = meta.index_lookup[self.selected_index]
+            ordering = [(self.model, name, bool(sort)) for name, sort in index.index_fields.items()]
+        else:
+            ordering = []
+
+        if any(model_or_alias != self.model for model_or_alias, _, _ in ordering):
+            raise QueryError("Pagination only supports ordering by fields of the base model.")
+
+        used = set(field_name for _, field_name, _ in ordering)
+        ordering.extend((self.model, name, bool(sort)) for name, sort in meta.primary.index_fields.items()
+                        if name not in used)
+        return tuple(ordering)
+
+    def stale(self, exact_staleness=None, max_staleness=None, read_timestamp=None, min_read_timestamp=None):
+        """
+        Execute reads of this queryset in a single-use read-only snapshot with the given timestamp bound instead of
+        a strong read. Stale reads can be served by the nearest replica without a round-trip to the leader.
+
+        Only one bound may be given, call with no arguments to switch back to strong reads.
+        Reads within an active `ezspanner.snapshot()` use the shared snapshot's timestamp bound.
+
+        :type exact_staleness: datetime.timedelta
+        :type max_staleness: datetime.timedelta
+        :type read_timestamp: datetime.datetime
+        :type min_read_timestamp: datetime.datetime
 
         :rtype: SpannerQuerySet
         """
-        self = copy.deepcopy(self)
+        options = dict(exact_staleness=exact_staleness, max_staleness=max_staleness, read_timestamp=read_timestamp,
+                       min_read_timestamp=min_read_timestamp)
+        options = dict((key, value) for key, value in six.iteritems(options) if value is not None)
+        if len(options) > 1:
+            raise QueryError("stale() accepts only one timestamp bound, got: %s" % ', '.join(sorted(options)))
+
+        self = self._clone()
+        self.read_options = options or None
         return self
 
+    def auto_index(self, enabled=True):
+        """
+        Let the index advisor choose the index for this query (FORCE_INDEX) unless one was selected with index().
+
+        The advisor picks the index whose key prefix matches most of the equality / range filters and which stores
+        all columns the query uses, and warns with a FullScanWarning if the filters can't be served by the primary
+        key or any covering index. The choice is made once per query shape and recorded as `index_advice` once the
+        query was compiled, see ezspanner.advisor.
+
+        :rtype: SpannerQuerySet
+        """
+        self = self._clone()
+        self.auto_index_enabled = enabled
+        return self
+
+    def suggest_index(self):
+        """
+        Return the index advisor's choice for the current filters and projection, without applying it.
+
+        :rtype: ezspanner.advisor.IndexAdvice
+        """
+        return advise_index(self)
+
+    def with_stats(self):
+        """
+        Execute the query in PROFILE mode, Spanner's query statistics (elapsed / cpu time, rows scanned, ...) are
+        available as `query_stats` dict once the results were consumed.
+
+        :rtype: SpannerQuerySet
+        """
+        self = self._clone()
+        self.query_mode = ExecuteSqlRequest.PROFILE
+        return self
+
+    def explain(self, analyze=False, strict=False, connection_id=None):
+        """
+        Return Spanner's execution plan of the query.
+
+        Without `analyze` the statement is only planned (PLAN mode) and returns no rows, with `analyze` it is
+        executed in PROFILE mode, its results are discarded and the plan nodes carry the actual rows and latencies.
+
+        The plan helps to find table scans (`full_scans()`), joins of index rows back to the base table
+        (`back_joins()`, add the columns to the index's STORING clause) and distributed cross applies that fan out
+        to remote splits (`distributed_cross_applies()`), see ezspanner.explain.
+
+        :param analyze: execute the query and collect execution statistics
+        :param strict: raise a QueryPlanError if the plan contains a full scan
+        :param connection_id:
+        :raises QueryPlanError:
+        :rtype: ezspanner.explain.QueryPlan
+        """
+        qs = self._clone()
+        qs.query_mode = ExecuteSqlRequest.PROFILE if analyze else ExecuteSqlRequest.PLAN
+        for _ in qs.execute(connection_id=connection_id, raw=True):
+            pass
+        if qs.query_plan is None:
+            raise QueryError("Spanner didn't return a query plan.")
+
+        plan = parse_plan(qs._compile().sql, qs.query_plan, qs.query_stats)
+        full_scans = plan.full_scans()
+        if strict and full_scans:
+            raise QueryPlanError("Query plan contains full scans of %s" %
+                                 ', '.join(node.scan_target for node in full_scans), plan)
+        return plan
+
+    def prefetch_children(self, *models, **attributes):
+        """
+        Load interleaved child rows together with each result in the same statement: one correlated
+        `ARRAY(SELECT AS STRUCT ...)` subquery per child model, which Spanner answers from the co-located rows.
+
+        The children are attached to each instance as list, ordered by primary key, in the attribute
+        `<model_name>_set` (or the given keyword). A child model is nested into the instances of its nearest
+        prefetched ancestor, e.g. `TestModelA.objects.prefetch_children(TestModelB, TestModelC)` loads the whole
+        tree: `a.testmodelb_set[0].testmodelc_set`.
+
+        Call without arguments to remove all prefetches.
+
+        :param models: child models, attached as `<model_name>_set`
+        :param attributes: attribute name -> child model
+
+        :rtype: SpannerQuerySet
+        """
+        self = self._clone()
+        if not models and not attributes:
+            self.prefetches = ()
+            return self
+
+        prefetches = list(self.prefetches)
+        for attribute, model in [('%s_set' % model._meta.model_name, model) for model in models] + \
+                sorted(six.iteritems(attributes)):
+            parent = model._meta.parent
+            while parent is not None and parent is not self.model:
+                parent = parent._meta.parent
+            if parent is None:
+                raise QueryError("'%s' is not interleaved in '%s'" % (model._meta.object_name,
+                                                                       self.model._meta.object_name))
+            if any(model is other or attribute == other_attribute for other_attribute, other in prefetches):
+                raise QueryError("'%s' is already prefetched" % model._meta.object_name)
+            prefetches.append((attribute, model))
+        self.prefetches = tuple(prefetches)
+        return self
+
+    def group_by(self, *fields):
+        """
+        Group the results by fields, prefer `values(...).annotate(...)` which groups by the selected values. Field
+        names refer to the base model, use F instances for joined models. Call without arguments to group by the
+        selected values again.
+
+        Grouped querysets return dicts with the group values (keyed by field name, `alias.field_name` for joined
+        models) and annotations instead of model instances.
+
+        :rtype: SpannerQuerySet
+        """
+        self = self._clone()
+        group_by_fields = tuple(self._resolve_order_field(f)[:2] for f in fields)
+        if any(model_or_alias is None for model_or_alias, _ in group_by_fields):
+            raise QueryError("Can't group by annotations.")
+        self.group_by_fields = group_by_fields
+        return self
+
+    def annotate(self, *args, **kwargs):
+        """
+        Add aggregates to the results, computed per group of the selected values (see group_by).
+
+        Example: TestModelB.objects.values('id_a').annotate(Count('*'), total=Sum('value_field_x'))
+
+        :param args: aggregates named by their default alias, e.g. `value_field_x__sum`
+        :param kwargs: alias -> aggregate
+
+        :rtype: SpannerQuerySet
+        """
+        self = self._clone()
+        annotations = self.annotations.copy()
+        for alias, aggregate in get_aggregates(args, kwargs):
+            if alias in annotations or alias in self._get_result_names():
+                raise QueryError("Annotation '%s' conflicts with an existing annotation or field" % alias)
+            annotations[alias] = aggregate.resolve(self)
+        self.annotations = annotations
+        return self
+
+    def having(self, *args, **kwargs):
+        """
+        Filter groups by their annotations (HAVING), e.g. `having(total__gt=10)`. Lookups support the same
+        operators as filter().
+
+        :rtype: SpannerQuerySet
+        """
+        self = self._clone()
+        q_obj = Q(*args, **kwargs)
+        if q_obj:
+            self.having_q = q_obj if self.having_q is None else self.having_q & q_obj
+        return self
+
+    def aggregate(self, *args, **kwargs):
+        """
+        Compute aggregates over all matching rows.
+
+        Example: TestModelB.objects.filter(id_a=1).aggregate(Count('*'), total=Sum('value_field_x'))
+
+        :param args: aggregates named by their default alias
+        :param kwargs: alias -> aggregate
+        :param connection_id: (keyword only)
+
+        :rtype: dict
+        :return: alias -> value
+        """
+        connection_id = kwargs.pop('connection_id', None)
+        if self.limit_value is not None or self.offset_value is not None:
+            raise QueryError("aggregate() is not supported on sliced querysets.")
+        aggregates = get_aggregates(args, kwargs)
+        if not aggregates:
+            return {}
+
+        qs = self._clone()
+        qs.selected_fields = OrderedDict()
+        qs.group_by_fields = ()
+        qs.having_q = None
+        qs.ordering = ()
+        qs.annotations = OrderedDict((alias, aggregate.resolve(qs)) for alias, aggregate in aggregates)
+        for row in qs.execute(connection_id=connection_id, raw=True, fetch_one=True):
+            return dict(zip(qs.annotations.keys(), row))
+
+    def bulk_create(self, objs, connection_id=None, max_mutations=MAX_MUTATIONS_PER_COMMIT):
+        """
+        Insert many model instances with as few commits as possible.
+
+        Rows are grouped by table, each commit stays below `max_mutations`.
+
+        :type objs: list[ezspanner.models.SpannerModel]
+        :param connection_id:
+        :param max_mutations: max mutations per commit
+
+        :rtype: list
+        :return: objs
+        """
+        return self._bulk_mutate(OP_INSERT, objs, connection_id=connection_id, max_mutations=max_mutations)
+
+    def bulk_update(self, objs, fields, connection_id=None, max_mutations=MAX_MUTATIONS_PER_COMMIT):
+        """
+        Update `fields` of many model instances with as few commits as possible.
+
+        :type objs: list[ezspanner.models.SpannerModel]
+        :param fields: names of the fields to update, primary key fields are always included
+        :param connection_id:
+        :param max_mutations: max mutations per commit
+
+        :rtype: list
+        :return: objs
+        """
+        if not fields:
+            raise ValueError("bulk_update() requires a list of fields to update.")
+        return self._bulk_mutate(OP_UPDATE, objs, fields=fields, connection_id=connection_id,
+                                 max_mutations=max_mutations)
+
+    def bulk_upsert(self, objs, connection_id=None, max_mutations=MAX_MUTATIONS_PER_COMMIT):
+        """
+        Insert or update many model instances with as few commits as possible.
+
+        :type objs: list[ezspanner.models.SpannerModel]
+        :param connection_id:
+        :param max_mutations: max mutations per commit
+
+        :rtype: list
+        :return: objs
+        """
+        return self._bulk_mutate(OP_UPSERT, objs, connection_id=connection_id, max_mutations=max_mutations)
+
+    def bulk_delete(self, objs, connection_id=None, max_mutations=MAX_MUTATIONS_PER_COMMIT):
+        """
+        Delete many model instances with as few commits as possible.
+
+        :type objs: list[ezspanner.models.SpannerModel]
+        :param connection_id:
+        :param max_mutations: max mutations per commit
+
+        :rtype: list
+        :return: objs
+        """
+        return self._bulk_mutate(OP_DELETE, objs, connection_id=connection_id, max_mutations=max_mutations)
+
+    def _bulk_mutate(self, op, objs, fields=None, connection_id=None, max_mutations=MAX_MUTATIONS_PER_COMMIT):
+        objs = list(objs)
+        if not objs:
+            return objs
+
+        for obj in objs:
+            missing = obj._get_pk_val()['missing']
+            if missing:
+                raise ValueError("%s object is missing primary key values: %s" % (obj._meta.object_name, missing))
+
+        database = self.conn if self.conn is not None and connection_id is None else Connection.get(connection_id)
+        commit_mutations(database, build_mutations(op, objs, fields), max_mutations=max_mutations)
+
+        for obj in objs:
+            obj._state.db = connection_id
+            obj._state.adding = op == OP_DELETE
+            if op == OP_DELETE:
+                obj._state.loaded = None
+            else:
+                obj._mark_clean(get_columns(obj, op, fields), reset=op != OP_UPDATE)
+        return objs
+
+    def get_by_pk(self, *key, **kwargs):
+        """
+        Read a single row by primary key using the read API (no sql parsing / planning).
+
+        :param key: primary key values in primary key order, including the parent's key values for interleaved models.
+        :param connection_id: (keyword only)
+
+        :raises DoesNotExist: if no row with this key exists.
+        :rtype: ezspanner.models.SpannerModel
+        """
+        instances = self.get_many([key], connection_id=kwargs.pop('connection_id', None))
+        if kwargs:
+            raise TypeError("'%s' is an invalid keyword argument for this function" % list(kwargs)[0])
+        if not instances:
+            raise self.model.DoesNotExist("%s matching key %s does not exist." % (self.model._meta.object_name, key))
+        return instances[0]
+
+    def get_many(self, keys, index=None, connection_id=None):
+        """
+        Read multiple rows by key in a single read call.
+
+        :param keys: list of keys, a key is a tuple/list of values in primary key order (resp. index order if `index`
+        is given). Single values are accepted for single-column keys.
+        :param index: (optional) name of a secondary index to read through, only columns stored in the index
+        can be loaded.
+        :param connection_id:
+
+        :rtype: list[ezspanner.models.SpannerModel]
+        :return: found instances in the order of `keys`, missing keys are skipped.
+        """
+        keys = [tuple(key) if isinstance(key, (list, tuple)) else (key,) for key in keys]
+        if not keys:
+            return []
+
+        cache = self._get_entity_cache(keys, index, connection_id)
+        if cache is None:
+            by_key = self._read_by_key(keys, index, connection_id)
+        else:
+            by_key = self._read_by_key_cached(cache, keys, connection_id)
+
+        if not index:
+            # read-your-writes within atomic() and write_behind()
+            database = self._get_database(connection_id)
+            state = get_transaction(database) or get_write_buffer(database)
+            if state is not None:
+                state.apply_pending(self.model, keys, by_key, connection_id)
+
+        instances = []
+        for key in keys:
+            instances.extend(by_key.pop(key, ()))
+        return instances
+
+    def _read_by_key(self, keys, index=None, connection_id=None):
+        """
+        :rtype: dict
+        :return: key -> list of instances, secondary indices may return several rows per key
+        """
+        key_fields = self._get_read_key_fields(index)
+        # key columns are required to restore the requested key order
+        rows = self._read(KeySet(keys=[list(key) for key in keys]), index, connection_id, key_fields=key_fields)
+
+        key_positions = [rows.columns.index(field_name) for field_name in key_fields]
+        by_key = {}
+        for instance, row in rows:
+            row_key = tuple(row[i] for i in key_positions[:len(keys[0])])
+            by_key.setdefault(row_key, []).append(instance)
+        return by_key
+
+    def _get_entity_cache(self, keys, index=None, connection_id=None):
+        """
+        Return the model's entity cache if the read can be served by it: full rows by complete primary keys outside
+        of snapshots, transactions and stale reads.
+
+        :rtype: ezspanner.cache.BaseCache|None
+        """
+        meta = self.model._meta
+        if meta.cache is None or index or self.read_options or self.selected_fields.get(self.model) is not None:
+            return None
+        if any(len(key) != len(meta.primary.get_field_names()) for key in keys):
+            return None
+        if get_reader(self._get_database(connection_id)) is not None:
+            return None
+        return meta.cache
+
+    def _read_by_key_cached(self, cache, keys, connection_id=None):
+        meta = self.model._meta
+        field_names = [f.name for f in meta.local_fields]
+
+        cache_keys = dict((key, get_cache_key(meta, key)) for key in keys)
+        cached = cache.get_many(list(cache_keys.values()))
+
+        by_key = {}
+        missing = []
+        for key, cache_key in six.iteritems(cache_keys):
+            values = cached.get(cache_key)
+            if values is None:
+                missing.append(key)
+            else:
+                # copy mutable values, instances must not share them with the cache
+                values = [list(v) if isinstance(v, list) else v for v in values]
+                by_key[key] = [self.model._from_row(connection_id, field_names, values)]
+
+        if missing:
+            # keys that are invalidated by a write while the read is running are not stored, see ezspanner.cache
+            token = cache.begin_read()
+            try:
+                found = self._read_by_key(missing, connection_id=connection_id)
+                cache.set_many(dict(
+                    (cache_keys[key], [getattr(instances[0], name) for name in field_names])
+                    for key, instances in six.iteritems(found)
+                ), token)
+            finally:
+                cache.end_read(token)
+            by_key.update(found)
+        return by_key
+
+    def get_range(self, start=None, end=None, index=None, start_closed=True, end_closed=True, limit=0,
+                  connection_id=None):
+        """
+        Read all rows within a key range, in key (resp. index) order.
+
+        Keys may be prefixes of the full key, e.g. get_range(start=[1], end=[1]) returns all rows whose first key
+        column is 1.
+
+        :param start: start key (list/tuple or single value), open ended if None
+        :param end: end key (list/tuple or single value), open ended if None
+        :param index: (optional) name of a secondary index to read through
+        :param start_closed: include the start key
+        :param end_closed: include the end key
+        :param limit: max number of rows, 0 = unlimited
+        :param connection_id:
+
+        :rtype: list[ezspanner.models.SpannerModel]
+        """
+        range_kwargs = {}
+        if start is not None:
+            range_kwargs['start_closed' if start_closed else 'start_open'] = \
+                list(start) if isinstance(start, (list, tuple)) else [start]
+        if end is not None:
+            range_kwargs['end_closed' if end_closed else 'end_open'] = \
+                list(end) if isinstance(end, (list, tuple)) else [end]
+
+        keyset = KeySet(ranges=[KeyRange(**range_kwargs)]) if range_kwargs else KeySet(all_=True)
+        return [instance for instance, row in self._read(keyset, index, connection_id, limit=limit)]
+
+    def _get_read_key_fields(self, index):
+        """
+        :return: key field names of the primary key or `index`
+        """
+        if not index:
+            return list(self.model._meta.primary.get_field_names())
+
+        spanner_index = self.model._meta.index_lookup.get(index)
+        if spanner_index is None:
+            raise SpannerIndexError("invalid index specified! '%s' is not a valid index name for model '%s'" %
+                                    (index, self.model))
+        return list(spanner_index.get_field_names())
+
+    def _get_read_columns(self, index, key_fields=None):
+        """
+        :param key_fields: key columns that must be read
+        :return: column names to read, restricted to the columns covered by `index`
+        """
+        meta = self.model._meta
+        selected = self.selected_fields.get(self.model)
+        if selected is None:
+            columns = [f.name for f in meta.local_fields]
+        else:
+            columns = [f.column for f in selected]
+
+        if index:
+            spanner_index = meta.index_lookup[index]
+            covered = set(spanner_index.get_field_names()) | set(spanner_index.storing) | \
+                set(meta.primary.get_field_names())
+            if selected is None:
+                columns = [column for column in columns if column in covered]
+            else:
+                not_covered = [column for column in columns if column not in covered]
+                if not_covered:
+                    raise QueryError("Index '%s' doesn't store the selected columns %s" % (index, not_covered))
+
+        if key_fields:
+            columns.extend([column for column in key_fields if column not in columns])
+        return columns
+
+    def _read(self, keyset, index=None, connection_id=None, limit=0, key_fields=None):
+        """
+        Read rows with the read API.
+
+        :rtype: ReadResult
+        """
+        if index:
+            self._get_read_key_fields(index)
+        columns = self._get_read_columns(index, key_fields)
+        rows = self._stream(self._get_database(connection_id), 'read',
+                            self.model._meta.table, columns, keyset, index=index or '', limit=limit)
+        hydrator = ModelHydrator(self, [(self.model, column) for column in columns], prefetch=False)
+        return ReadResult(columns, rows, hydrator, connection_id)
+
     def get(self, **filter_kwargs):
-        if filter_kwargs:
-            qs = self.filter(**filter_kwargs)
+        """
+        Return the single instance matching the filters.
 
-        raise NotImplementedError
-        # todo: return single instance or raise multiple objects
-        qs.execute(fetch_one=True)
+        Lookups by the complete primary key (and nothing else) use the read API and the entity cache, see get_by_pk.
+
+        :raises DoesNotExist: if no row matches
+        :raises MultipleObjectsReturned: if more than one row matches
+        :rtype: ezspanner.models.SpannerModel
+        """
+        pk_fields = list(self.model._meta.primary.get_field_names())
+        if set(filter_kwargs) == set(pk_fields) and self.where is None and not self.joins and self.seek is None \
+                and self.selected_index is None and not self.prefetches:
+            return self.get_by_pk(*[filter_kwargs[field_name] for field_name in pk_fields])
+
+        qs = self.filter(**filter_kwargs) if filter_kwargs else self
+        instances = list(qs.limit(2, qs.offset_value).execute())
+        if not instances:
+            raise self.model.DoesNotExist("%s matching query does not exist." % self.model._meta.object_name)
+        if len(instances) > 1:
+            raise self.model.MultipleObjectsReturned("get() returned more than one %s." %
+                                                     self.model._meta.object_name)
+        return instances[0]
 
     def _check_model_joined(self, model):
         """
@@ -345,55 +1338,380 @@ class SpannerQuerySet(object):
 
         return model['model']
 
-    def _get_select_columns(self):
+    def _get_select_targets(self):
+        """
+        :rtype: list[tuple]
+        :return: (model_or_alias, field_name) for each selected column
+        """
+        if self.is_grouped():
+            return self._get_group_targets()
+
         # if base model fields are not defined: select all fields
-        columns = []
-        if self.selected_fields.get(self.model) is None:
-            columns = [str(F(self.model._meta.table, f.name)) for f in self.model._meta.local_fields]
+        targets = []
+        base_fields = self.selected_fields.get(self.model)
+        if base_fields is None:
+            targets = [(self.model, f.name) for f in self.model._meta.local_fields]
+        else:
+            targets = [(self.model, f.column) for f in base_fields]
 
         # additional fields from joins
         for model_or_alias, extra_columns in six.iteritems(self.selected_fields):
-            columns.extend([str(f) for f in extra_columns])
+            if model_or_alias != self.model:
+                targets.extend([(model_or_alias, f.column) for f in extra_columns])
+
+        return targets
 
+    def _get_select_columns(self):
+        columns = []
+        for model_or_alias, field_name in self._get_select_targets():
+            if model_or_alias == self.model:
+                model_or_alias = self.model._meta.table
+            columns.append(str(F(model_or_alias, field_name)))
+        for alias, aggregate in six.iteritems(self.annotations):
+            columns.append('%s AS `%s`' % (aggregate.as_sql(self), alias))
+        if self.prefetches and not self.is_grouped():
+            for node in self._get_prefetch_tree():
+                columns.append(self._build_prefetch(node, self.model))
         return columns
 
+    def _get_prefetch_tree(self):
+        """
+        Nest every prefetched model into its nearest prefetched ancestor.
+
+        :return: list of (attribute, model, children) nodes of the base model
+        """
+        nodes = OrderedDict((model, (attribute, model, [])) for attribute, model in self.prefetches)
+        roots = []
+        for node in six.itervalues(nodes):
+            parent = node[1]._meta.parent
+            while parent not in nodes and parent is not self.model:
+                parent = parent._meta.parent
+            (nodes[parent][2] if parent in nodes else roots).append(node)
+        return roots
+
+    def _build_prefetch(self, node, parent_model):
+        """
+        Build the correlated subquery of a prefetch node, the struct contains the child's fields followed by the
+        subqueries of nested nodes.
+        """
+        attribute, model, children = node
+        table = model._meta.table
+        columns = ['`%s`.`%s`' % (table, f.name) for f in model._meta.local_fields]
+        columns.extend(self._build_prefetch(child, model) for child in children)
+        condition = ' AND '.join('`%s`.`%s` = `%s`.`%s`' % (table, name, parent_model._meta.table, name)
+                                 for name in parent_model._meta.primary.get_field_names())
+        ordering = ', '.join('`%s`.`%s`' % (table, name) for name in model._meta.primary.get_field_names())
+        return 'ARRAY(SELECT AS STRUCT %s FROM `%s` WHERE %s ORDER BY %s) AS `%s`' % (
+            ', '.join(columns), table, condition, ordering, attribute)
+
+    def is_grouped(self):
+        """
+        :return: True if the queryset returns groups (dicts) instead of model instances
+        """
+        return bool(self.annotations or self.group_by_fields)
+
+    def _get_group_targets(self):
+        """
+        :return: (model_or_alias, field_name) for each grouping column: the group_by() fields or the selected values
+        """
+        if self.group_by_fields:
+            return list(self.group_by_fields)
+        return [(model_or_alias, f.column) for model_or_alias, fields in six.iteritems(self.selected_fields)
+                for f in fields]
+
+    def _get_result_names(self):
+        """
+        :return: dict keys of grouped results
+        """
+        names = []
+        for model_or_alias, field_name in self._get_group_targets():
+            if model_or_alias == self.model:
+                names.append(field_name)
+            else:
+                alias = model_or_alias if isinstance(model_or_alias, six.string_types) \
+                    else model_or_alias._meta.model_name
+                names.append('%s.%s' % (alias, field_name))
+        return names + list(self.annotations.keys())
+
+    def _build_group_by(self):
+        return 'GROUP BY ' + ', '.join(self._get_column_sql(model_or_alias, field_name)
+                                       for model_or_alias, field_name in self._get_group_targets())
+
+    def _build_having(self, compiler):
+        """
+        Build the HAVING condition, lookups refer to annotation aliases.
+
+        :return: None if the condition is empty
+        """
+        condition = self._resolve_having_q(self.having_q, compiler)
+        return 'HAVING ' + condition if condition else None
+
+    def _resolve_having_q(self, q, compiler):
+        sql_fragments = []
+        for child in q.children:
+            if isinstance(child, Q):
+                child_sql = self._resolve_having_q(child, compiler)
+                if child_sql:
+                    sql_fragments.append('(' + child_sql + ')')
+                continue
+
+            lookup, value = child
+            if lookup in self.annotations:
+                alias, op = lookup, 'eq'
+            else:
+                alias, _, op = lookup.rpartition(LOOKUP_SEP)
+            aggregate = self.annotations.get(alias)
+            if aggregate is None:
+                raise QueryError("having() lookup '%s' doesn't refer to an annotation" % lookup)
+            op_type = FilterRegistry.registered_types.get(op)
+            if op_type is None or not hasattr(op_type, 'sql_op'):
+                raise QueryError("unregistered filter op type '%s'" % op)
+            if isinstance(value, F):
+                raise QueryError("having() only supports concrete values")
+
+            param_type = aggregate.get_param_type(self)
+            if issubclass(op_type, FilterIn):
+                param_type = ArrayParamType(param_type)
+                placeholder = 'UNNEST(@%s)' % compiler.add_param(alias, value, param_type)
+            else:
+                placeholder = '@%s' % compiler.add_param(alias, value, param_type)
+            sql_fragments.append('%s %s %s' % (aggregate.as_sql(self), op_type.sql_op, placeholder))
+
+        sql = (' %s ' % q.connector).join(sql_fragments)
+        if q.negated and sql:
+            sql = ' NOT (%s) ' % sql
+        return sql
+
     def _build_select_columns(self):
         return ', '.join(self._get_select_columns())
 
-    def _build_query(self):
+    def _get_shape(self):
+        """
+        Hashable description of everything that influences the generated sql, but not the concrete filter values.
+        """
+        return (
+            self.model,
+            self.selected_index,
+            tuple((model_or_alias, join_data['type'], join_data['model'], join_data['alias'],
+                   self._get_q_shape(join_data['on']))
+                  for model_or_alias, join_data in six.iteritems(self.joins)),
+            tuple((model_or_alias, tuple(fields)) for model_or_alias, fields in six.iteritems(self.selected_fields)),
+            self._get_q_shape(self.where),
+            (self.seek[0], tuple(value is None for value in self.seek[1])) if self.seek else None,
+            self.ordering,
+            self.limit_value is not None,
+            self.offset_value is not None,
+            self.select_mode,
+            self.group_by_fields,
+            tuple(six.iteritems(self.annotations)),
+            self._get_q_shape(self.having_q),
+            self.prefetches,
+            self.auto_index_enabled,
+        )
+
+    def _get_q_shape(self, q):
+        if q is None:
+            return None
+
+        children = []
+        for child in q.children:
+            if isinstance(child, Q):
+                children.append(self._get_q_shape(child))
+            else:
+                column, value = child
+                # concrete values are bound as params and don't change the sql
+                children.append((column, value if isinstance(value, F) else None))
+        return q.connector, q.negated, q.model, tuple(children)
+
+    def _get_param_values(self):
+        """
+        Collect concrete filter values in the order the compiler allocates their params.
+
+        :rtype: list
+        """
+        values = []
+        for join_data in six.itervalues(self.joins):
+            self._collect_q_values(join_data['on'], values)
+        if self.where:
+            self._collect_q_values(self.where, values)
+        if self.seek:
+            # see _build_seek
+            for terms in self._get_seek_terms():
+                values.extend(value for _, _, op, value in terms if op in SEEK_BOUND_OPS)
+        if self.having_q is not None and self.is_grouped():
+            self._collect_q_values(self.having_q, values)
+        if self.limit_value is not None:
+            values.append(self.limit_value)
+        if self.offset_value is not None:
+            values.append(self.offset_value)
+        return values
+
+    def _collect_q_values(self, q, values):
+        for child in q.children:
+            if isinstance(child, Q):
+                self._collect_q_values(child, values)
+            elif not isinstance(child[1], F):
+                values.append(child[1])
+
+    def _compile(self):
+        """
+        Return the compiled statement for this queryset's shape, compiles on cache miss.
+
+        :rtype: CompiledStatement
+        """
+        if self._compiled is None:
+            shape = self._get_shape()
+            compiled = statement_cache.get(shape)
+            if compiled is None:
+                compiled = QueryCompiler(self).compile()
+                statement_cache.set(shape, compiled)
+            self._compiled = compiled
+            self.index_advice = compiled.index_advice
+        return self._compiled
+
+    def _build_query(self, compiler=None):
+        compiler = compiler or QueryCompiler(self)
         query_fragments = []
 
         # SELECT
-        columns = self._get_select_columns()
-        query_fragments.append("SELECT %s" % ','.join(columns))
+        sliced = self.limit_value is not None or self.offset_value is not None
+        if self.select_mode is None or self.is_grouped():
+            # grouped queries can be ordered by annotations, which have to be selected
+            query_fragments.append("SELECT %s" % ','.join(self._get_select_columns()))
+        elif self.select_mode == SELECT_COUNT and not sliced:
+            query_fragments.append("SELECT COUNT(*)")
+        else:
+            query_fragments.append("SELECT 1")
 
         # FROM
-        query_fragments.append("FROM %s" % self._build_table_name(self.model, self.selected_index))
+        index = self.selected_index
+        if index is None and self.auto_index_enabled:
+            advice = compiler.index_advice = advise_index(self)
+            index = advice.index
+            if advice.full_scan:
+                warnings.warn("The filters of the query on `%s` can't be served by the primary key or a covering "
+                              "index, it requires a full scan.%s" % (
+                                  self.model._meta.table,
+                                  ''.join(" Index '%s' doesn't store %s." % (name, ', '.join(missing))
+                                          for name, missing in sorted(six.iteritems(advice.uncovered)))),
+                              FullScanWarning, stacklevel=2)
+        query_fragments.append("FROM %s" % self._build_table_name(self.model, index))
 
         # JOIN
-        query_fragments.append(self._build_joins())
+        query_fragments.append(self._build_joins(compiler))
 
         # WHERE
-        where = self._build_where()
+        where = self._build_where(compiler)
         if where:
             query_fragments.append(where)
 
-        return '\n'.join(query_fragments)
+        # GROUP BY / HAVING
+        grouped = self.is_grouped()
+        if grouped and self._get_group_targets():
+            query_fragments.append(self._build_group_by())
+        having = self._build_having(compiler) if grouped and self.having_q is not None else None
+        if having:
+            query_fragments.append(having)
+
+        # ORDER BY
+        if self.ordering:
+            query_fragments.append(self._build_order_by())
+
+        # LIMIT / OFFSET
+        if self.limit_value is not None:
+            query_fragments.append('LIMIT @%s' % compiler.add_param('limit', self.limit_value, INT64_PARAM_TYPE))
+        if self.offset_value is not None:
+            query_fragments.append('OFFSET @%s' % compiler.add_param('offset', self.offset_value, INT64_PARAM_TYPE))
+
+        sql = '\n'.join(query_fragments)
+        if self.select_mode == SELECT_COUNT and (sliced or self.is_grouped()):
+            # count the rows of the slice / the groups
+            sql = 'SELECT COUNT(*) FROM (\n%s\n)' % sql
+        return sql
+
+    def _get_column_sql(self, model_or_alias, field_name):
+        if model_or_alias == self.model:
+            model_or_alias = self.model._meta.table
+        return str(F(model_or_alias, field_name))
+
+    def _build_order_by(self):
+        return 'ORDER BY ' + ', '.join(
+            (self._get_column_sql(model_or_alias, field_name) if model_or_alias is not None else '`%s`' % field_name) +
+            (' DESC' if descending else '')
+            for model_or_alias, field_name, descending in self.ordering
+        )
+
+    def _get_seek_terms(self):
+        """
+        Terms of the keyset pagination predicate: a list of ORed conditions, each a list of ANDed
+        (model_or_alias, field_name, op, value) tuples, `value` is bound for the SEEK_BOUND_OPS.
 
-    def _build_joins(self):
+        Spanner sorts NULLs first in ascending and last in descending order, NULLs of nullable sort columns are
+        compared with IS [NOT] NULL and included in the `<` comparison of descending columns.
+        """
+        ordering, values = self.seek
+        conditions = []
+        for i in range(len(ordering)):
+            terms = []
+            for j, (model_or_alias, field_name, descending) in enumerate(ordering[:i + 1]):
+                value = values[j]
+                if j < i:
+                    op = SEEK_IS_NULL if value is None else '='
+                elif value is None:
+                    if descending:
+                        # nothing follows a NULL in descending order
+                        terms = None
+                        break
+                    op = SEEK_IS_NOT_NULL
+                elif descending:
+                    field = self._check_model_joined(model_or_alias)._meta.field_lookup[field_name]
+                    op = SEEK_LT_OR_NULL if field.null else '<'
+                else:
+                    op = '>'
+                terms.append((model_or_alias, field_name, op, value))
+            if terms is not None:
+                conditions.append(terms)
+        return conditions
+
+    def _build_seek(self, compiler):
+        """
+        Build the keyset pagination predicate, e.g. for ordering (a, -b):
+        `a > @a OR (a = @a AND b < @b)`
+        """
+        conditions = []
+        for terms in self._get_seek_terms():
+            parts = []
+            for model_or_alias, field_name, op, value in terms:
+                column = self._get_column_sql(model_or_alias, field_name)
+                if op in (SEEK_IS_NULL, SEEK_IS_NOT_NULL):
+                    parts.append('%s %s' % (column, op))
+                    continue
+                field = self._check_model_joined(model_or_alias)._meta.field_lookup[field_name]
+                placeholder = compiler.add_param(field, value)
+                if op == SEEK_LT_OR_NULL:
+                    parts.append('(%s < @%s OR %s IS NULL)' % (column, placeholder, column))
+                else:
+                    parts.append('%s %s @%s' % (column, op, placeholder))
+            conditions.append('(' + ' AND '.join(parts) + ')' if len(parts) > 1 else parts[0])
+        return ' OR '.join(conditions) if conditions else 'FALSE'
+
+
+    def _build_joins(self, compiler=None):
         """
         Create join sql query
         """
+        compiler = compiler or QueryCompiler(self)
         query_fragments = []
         for alias, join_data in six.iteritems(self.joins):
-            query_fragments.append(self._build_join(join_data))
+            query_fragments.append(self._build_join(join_data, compiler))
         return ' '.join(query_fragments)
 
-    def _build_join(self, join_data):
+    def _build_join(self, join_data, compiler):
         """
         Build single join sql from join_data.
 
         :type join_data: dict
+        :type compiler: QueryCompiler
         :rtype: unicode
         """
         join_sql = ['%s' % join_data['type']]
@@ -403,7 +1721,7 @@ class SpannerQuerySet(object):
             join_sql.append('AS `%s`' % join_data['alias'])
 
         join_sql.append('ON')
-        join_sql.append(self._resolve_q(join_data['on']))
+        join_sql.append(self._resolve_q(join_data['on'], compiler))
         return ' '.join(join_sql)
 
     def _build_table_name(self, model, index):
@@ -412,18 +1730,24 @@ class SpannerQuerySet(object):
             table += '@{FORCE_INDEX=%s}' % index
         return table
     
-    def _build_where(self):
+    def _build_where(self, compiler=None):
+        compiler = compiler or QueryCompiler(self)
         where = ''
-        if self.where:
-            where = 'WHERE ' + self._resolve_q(self.where)
+        if self.where and self.seek:
+            where = 'WHERE (%s) AND (%s)' % (self._resolve_q(self.where, compiler), self._build_seek(compiler))
+        elif self.where:
+            where = 'WHERE ' + self._resolve_q(self.where, compiler)
+        elif self.seek:
+            where = 'WHERE ' + self._build_seek(compiler)
 
         return where
 
-    def _resolve_q(self, q):
+    def _resolve_q(self, q, compiler):
         """
         Helper method to recursively resolve a Q tree.
 
         :type q: Q
+        :type compiler: QueryCompiler
 
         :rtype: unicode
         :return: filter condition string
@@ -435,7 +1759,7 @@ class SpannerQuerySet(object):
         sql_fragments = []
         for child in q.children:
             if isinstance(child, Q):
-                sql_fragments.append('(' + self._resolve_q(child) + ')')
+                sql_fragments.append('(' + self._resolve_q(child, compiler) + ')')
             else:
                 column, value = child
                 column_name = column.column if isinstance(column, F) else column
@@ -453,13 +1777,21 @@ class SpannerQuerySet(object):
                 if not op_type:
                     raise QueryError("unregistered filter op type '%s'" % op)
 
-                # get field
-                field = model_column._meta.field_lookup[column]
+                # get field, `pk` resolves to the (composite) primary key
+                if column == 'pk':
+                    field = [model_column._meta.field_lookup[field_name]
+                             for field_name in model_column._meta.primary.get_field_names()]
+                    if len(field) == 1:
+                        field = field[0]
+                    elif not op_type.composite:
+                        raise QueryError("filter op type '%s' doesn't support composite primary keys" % op)
+                else:
+                    field = model_column._meta.field_lookup[column]
 
                 # build filter clause and append
                 sql_fragments.append(
                     op_type.as_sql(
-                        self, field, value,
+                        compiler, field, value,
                         alias=model_column_or_alias if isinstance(model_column_or_alias, six.string_types) else None
                     )
                 )
@@ -476,33 +1808,469 @@ class SpannerQuerySet(object):
         :rtype: unicode
         :return: return sql query for execution.
         """
-        return self._build_query()
+        return self._compile().sql
+
+    @property
+    def params(self):
+        """
+
+        :rtype: dict
+        :return: param values for `query`
+        """
+        return self._compile().bind(self._get_param_values())[0]
+
+    @property
+    def param_types(self):
+        """
+
+        :rtype: dict
+        :return: spanner param types for `query`
+        """
+        return self._compile().bind(self._get_param_values())[1]
+
+    def _get_database(self, connection_id=None):
+        """
+        :rtype: google.cloud.spanner.database.Database
+        """
+        if self.conn is not None and connection_id is None:
+            return self.conn
+        return Connection.get(connection_id)
+
+    def _stream(self, database, method, *args, **kwargs):
+        """
+        Call the read method `method` ('execute_sql' or 'read') and stream its rows.
+
+        Reads go through `reader` (keyword only), the active shared snapshot / transaction of `database`, a
+        single-use snapshot if `read_options` are set or a strong single-use read otherwise.
+
+        Sends the instrumentation events and collects the query statistics of PROFILE queries.
+        """
+        result_sets = []
+        rows = self._stream_rows(database, method, result_sets, *args, **kwargs)
+        if self.query_mode is None and not Instrumentation.is_enabled(PRE_EXECUTE, POST_EXECUTE):
+            for row in rows:
+                yield row
+            return
+
+        state = get_transaction(database)
+        event = QueryEvent(method, args[0], kwargs.get('params'), self.model,
+                           retries=state.attempt - 1 if state is not None else 0)
+        Instrumentation.send(PRE_EXECUTE, event)
+        start = time.time()
+        try:
+            for row in rows:
+                event.rows += 1
+                event.bytes += estimate_size(row)
+                yield row
+        except Exception as e:
+            event.error = e
+            raise
+        finally:
+            event.latency = time.time() - start
+            stats = getattr(result_sets[0], 'stats', None) if result_sets else None
+            if stats is not None and stats.HasField('query_stats'):
+                self.query_stats = event.query_stats = json_format.MessageToDict(stats.query_stats)
+            if stats is not None and stats.HasField('query_plan'):
+                self.query_plan = stats.query_plan
+            Instrumentation.send(POST_EXECUTE, event)
+
+    def _stream_rows(self, database, method, result_sets, *args, **kwargs):
+        """
+        :param result_sets: the streamed result set is appended to this list
+        """
+        reader = kwargs.pop('reader', None) or get_reader(database)
+        if reader is not None:
+            result_sets.append(getattr(reader, method)(*args, **kwargs))
+            for row in result_sets[0]:
+                yield row
+        elif self.read_options:
+            with database.snapshot(**self.read_options) as snapshot:
+                result_sets.append(getattr(snapshot, method)(*args, **kwargs))
+                for row in result_sets[0]:
+                    yield row
+        else:
+            result_sets.append(getattr(database, method)(*args, **kwargs))
+            for row in result_sets[0]:
+                yield row
+
+    #
+    # lazy evaluation, the results are fetched once into _result_cache
+    #
+
+    def _fetch_all(self):
+        if self._result_cache is None:
+            self._result_cache = list(self.execute())
+
+    def __iter__(self):
+        self._fetch_all()
+        return iter(self._result_cache)
+
+    def __len__(self):
+        self._fetch_all()
+        return len(self._result_cache)
+
+    def __bool__(self):
+        self._fetch_all()
+        return bool(self._result_cache)
+
+    __nonzero__ = __bool__
+
+    def __getitem__(self, k):
+        """
+        Return a single result or a sliced queryset, slices are executed with LIMIT / OFFSET.
+
+        :type k: int|slice
+        """
+        if not isinstance(k, (slice,) + six.integer_types):
+            raise TypeError("QuerySet indices must be integers or slices, not %s." % type(k).__name__)
+        if isinstance(k, slice):
+            negative = (k.start is not None and k.start < 0) or (k.stop is not None and k.stop < 0)
+        else:
+            negative = k < 0
+        if negative:
+            raise ValueError("Negative indexing is not supported.")
+
+        if self._result_cache is not None:
+            return self._result_cache[k]
+
+        if isinstance(k, slice):
+            qs = self._slice(k.start or 0, k.stop)
+            return list(qs)[::k.step] if k.step else qs
+        return list(self._slice(k, k + 1))[0]
+
+    def _slice(self, start, stop):
+        """
+        Apply a slice on top of the current limit / offset.
+        """
+        if self.limit_value is not None:
+            stop = self.limit_value if stop is None else min(stop, self.limit_value)
+        limit = MAX_LIMIT if stop is None else max(stop - start, 0)
+        return self.limit(limit, (self.offset_value or 0) + start)
 
-    def execute(self, connection_id=None, transaction=True, fetch_one=False):
+    def count(self, connection_id=None):
+        """
+        Return the number of matching rows with `SELECT COUNT(*)`, or the length of the result cache if the queryset
+        was evaluated already.
+
+        :rtype: int
+        """
+        if self._result_cache is not None:
+            return len(self._result_cache)
+
+        qs = self._clone()
+        qs.select_mode = SELECT_COUNT
+        if qs.limit_value is None and qs.offset_value is None:
+            qs.ordering = ()
+        for row in qs.execute(connection_id=connection_id, raw=True):
+            return row[0]
+        return 0
+
+    def exists(self, connection_id=None):
+        """
+        Return True if at least one row matches, only `SELECT 1 ... LIMIT 1` is executed.
+
+        :rtype: bool
+        """
+        if self._result_cache is not None:
+            return bool(self._result_cache)
+
+        qs = self._clone()
+        qs.select_mode = SELECT_EXISTS
+        if qs.offset_value is None:
+            qs.ordering = ()
+        qs.limit_value = 1 if qs.limit_value is None else min(qs.limit_value, 1)
+        for _ in qs.execute(connection_id=connection_id, raw=True, fetch_one=True):
+            return True
+        return False
+
+    def iterator(self, connection_id=None):
         """
+        Stream the results as model instances, without filling the result cache.
 
         :param connection_id:
-        :param transaction:
-        :param fetch_one:
         """
-        self = self.set_connection(connection_id)
+        return self.execute(connection_id=connection_id)
 
-        results = self.conn.execute_sql(
-            self.query,
-            params=self.params
-        )
+    def execute(self, connection_id=None, transaction=None, fetch_one=False, raw=False):
+        """
+        Execute the query and stream the results, rows are consumed one at a time from the streamed result set.
+
+        Within an `atomic()` block the query runs in its transaction automatically.
+
+        :param connection_id:
+        :param transaction: a transaction to run the query in, or True to require the transaction of the active
+        `atomic()` block
+        :param fetch_one: stop after the first result
+        :param raw: yield raw row lists instead of model instances
+        """
+        database = self._get_database(connection_id)
+        if transaction is True:
+            state = get_transaction(database)
+            if state is None:
+                raise QueryError("execute(transaction=True) requires an active atomic() block.")
+            transaction = state.transaction
+
+        statement = self._compile()
+        params, param_types = statement.bind(self._get_param_values())
+        kwargs = {}
+        if transaction:
+            kwargs['reader'] = transaction
+        if self.query_mode is not None:
+            kwargs['query_mode'] = self.query_mode
+        results = self._stream(database, 'execute_sql', statement.sql, params=params, param_types=param_types,
+                               **kwargs)
+
+        if not raw:
+            if statement.hydrator is None:
+                statement.hydrator = DictHydrator(self._get_result_names()) if self.is_grouped() else \
+                    ModelHydrator(self, statement.select_targets)
+            results = statement.hydrator.hydrate(results, db=connection_id)
 
-        # todo: build result caching
-        # todo: place fetched values into model instances, also create joined data instances
         for row in results:
             yield row
+            if fetch_one:
+                break
 
-        if transaction:
-            raise NotImplementedError
-            self.conn.run_in_transaction(self.run_in_transaction)
+    #
+    # columnar results, see ezspanner.columns
+    #
+
+    def as_columns(self, connection_id=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Stream the results into one typed buffer per column instead of model instances.
 
-    def run_in_transaction(self, transaction):
-        pass
+        :param connection_id:
+        :param chunk_size: number of rows that are transposed at once
+        :rtype: OrderedDict
+        :return: column name -> ezspanner.columns.Column
+        """
+        if self.is_grouped():
+            raise QueryError("as_columns() doesn't support grouped querysets.")
+        return read_columns(self, connection_id=connection_id, chunk_size=chunk_size)
+
+    def to_numpy(self, connection_id=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Return the results as numpy arrays, nullable columns as masked arrays (requires numpy).
+
+        :rtype: OrderedDict
+        :return: column name -> numpy array
+        """
+        return columns_to_numpy(self.as_columns(connection_id=connection_id, chunk_size=chunk_size))
+
+    def to_arrow(self, connection_id=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Return the results as pyarrow Table (requires numpy and pyarrow).
+
+        :rtype: pyarrow.Table
+        """
+        return columns_to_arrow(self.as_columns(connection_id=connection_id, chunk_size=chunk_size))
+
+    #
+    # asyncio support, see ezspanner.aio
+    #
+
+    def aiter(self, connection_id=None, buffer_size=100):
+        """
+        Stream the results to an asyncio event loop: `async for obj in qs.aiter(): ...`
+
+        The results are read in chunks of `buffer_size` instances, reading from Spanner pauses until the previous
+        chunk was consumed.
+
+        :rtype: ezspanner.aio.QuerySetAsyncIterator
+        """
+        from .aio import QuerySetAsyncIterator
+        return QuerySetAsyncIterator(self, connection_id=connection_id, buffer_size=buffer_size)
+
+    def afirst(self, connection_id=None):
+        """
+        Awaitable returning the first result or None.
+        """
+        from .aio import afirst
+        return afirst(self, connection_id=connection_id)
+
+    def aget_by_pk(self, *key, **kwargs):
+        """
+        Awaitable version of get_by_pk.
+        """
+        return self._arun(self.get_by_pk, *key, **kwargs)
+
+    def aget_many(self, keys, index=None, connection_id=None):
+        """
+        Awaitable version of get_many.
+        """
+        return self._arun(self.get_many, keys, index=index, connection_id=connection_id)
+
+    def abulk_create(self, objs, connection_id=None, max_mutations=MAX_MUTATIONS_PER_COMMIT):
+        """
+        Awaitable version of bulk_create.
+        """
+        return self._arun(self.bulk_create, objs, connection_id=connection_id, max_mutations=max_mutations)
+
+    def abulk_update(self, objs, fields, connection_id=None, max_mutations=MAX_MUTATIONS_PER_COMMIT):
+        """
+        Awaitable version of bulk_update.
+        """
+        return self._arun(self.bulk_update, objs, fields, connection_id=connection_id, max_mutations=max_mutations)
+
+    def abulk_upsert(self, objs, connection_id=None, max_mutations=MAX_MUTATIONS_PER_COMMIT):
+        """
+        Awaitable version of bulk_upsert.
+        """
+        return self._arun(self.bulk_upsert, objs, connection_id=connection_id, max_mutations=max_mutations)
+
+    def abulk_delete(self, objs, connection_id=None, max_mutations=MAX_MUTATIONS_PER_COMMIT):
+        """
+        Awaitable version of bulk_delete.
+        """
+        return self._arun(self.bulk_delete, objs, connection_id=connection_id, max_mutations=max_mutations)
+
+    @staticmethod
+    def _arun(func, *args, **kwargs):
+        """
+        Run `func` in the executor of its connection_id keyword argument.
+        """
+        from .aio import run
+        return run(functools.partial(func, *args, **kwargs), connection_id=kwargs.get('connection_id'))
+
+    def partitioned(self, max_partitions=None, workers=4, per_partition=False, connection_id=None,
+                    buffer_size=1000):
+        """
+        Execute the query as partitioned query: the statement is split into partitions with a batch snapshot,
+        the partitions are processed in parallel by a thread pool.
+
+        Intended for full-table scans (analytics, backfills), the order of the results is not defined. Requires a
+        google-cloud-spanner version that supports `Database.batch_snapshot()`. Only root-partitionable queries
+        can be split: no ordering, pagination, limit / offset, grouping, aggregates or prefetched children. Stale
+        reads must use an exact bound (`exact_staleness` or `read_timestamp`).
+
+        :param max_partitions: (optional) hint for the max number of partitions
+        :param workers: number of worker threads
+        :param per_partition: yield one (partition, instances) tuple per finished partition instead of instances,
+            at most `workers` partitions are processed (and held in memory) at a time
+        :param connection_id:
+        :param buffer_size: max number of hydrated rows buffered in merged mode before the workers block
+        """
+        database = self._get_database(connection_id)
+        if not hasattr(database, 'batch_snapshot'):
+            raise QueryError("Partitioned queries require a google-cloud-spanner version with batch snapshots!")
+        self._check_partitionable()
+        return self._execute_partitioned(database, max_partitions, workers, per_partition, connection_id,
+                                         buffer_size)
+
+    def _check_partitionable(self):
+        """
+        Raise QueryError for querysets Cloud Spanner can't split into partitions (or batch snapshots can't read).
+        """
+        if self.ordering or self.seek is not None:
+            raise QueryError("Partitioned queries can't be ordered or paginated!")
+        if self.limit_value is not None or self.offset_value is not None:
+            raise QueryError("Partitioned queries don't support limit / offset!")
+        if self.is_grouped() or self.select_mode is not None:
+            raise QueryError("Partitioned queries don't support grouping, aggregates, count() or exists()!")
+        if self.prefetches:
+            raise QueryError("Partitioned queries don't support prefetch_children()!")
+        bounded = [option for option in ('max_staleness', 'min_read_timestamp') if option in (self.read_options or {})]
+        if bounded:
+            raise QueryError("Partitioned queries only support exact staleness bounds, not '%s'!" % bounded[0])
+
+    def _execute_partitioned(self, database, max_partitions, workers, per_partition, connection_id, buffer_size):
+        statement = self._compile()
+        params, param_types = statement.bind(self._get_param_values())
+        if statement.hydrator is None:
+            statement.hydrator = ModelHydrator(self, statement.select_targets)
+        hydrator = statement.hydrator
+
+        batch_snapshot = database.batch_snapshot(**(self.read_options or {}))
+        executor = ThreadPoolExecutor(max_workers=workers)
+        try:
+            partitions = list(batch_snapshot.generate_query_batches(
+                statement.sql, params=params, param_types=param_types, max_partitions=max_partitions))
+
+            if per_partition:
+                def process(partition):
+                    return partition, list(hydrator.hydrate(batch_snapshot.process_query_batch(partition),
+                                                            db=connection_id))
+
+                # only keep `workers` partitions in flight, yield them in the order they finish
+                pending = iter(partitions)
+                running = set(executor.submit(process, partition) for partition in islice(pending, workers))
+                try:
+                    while running:
+                        finished, running = wait(running, return_when=FIRST_COMPLETED)
+                        for future in finished:
+                            partition = next(pending, None)
+                            if partition is not None:
+                                running.add(executor.submit(process, partition))
+                            yield future.result()
+                finally:
+                    for future in running:
+                        future.cancel()
+            else:
+                merged = self._merge_partitions(batch_snapshot, partitions, executor, hydrator, connection_id,
+                                                buffer_size)
+                try:
+                    for instance in merged:
+                        yield instance
+                finally:
+                    # stops the workers if the consumer doesn't read all results
+                    merged.close()
+        finally:
+            executor.shutdown(wait=True)
+            batch_snapshot.close()
+
+    @staticmethod
+    def _merge_partitions(batch_snapshot, partitions, executor, hydrator, db, buffer_size):
+        """
+        Process partitions in the executor and yield their hydrated rows as they arrive.
+        """
+        results = queue.Queue(maxsize=buffer_size)
+        stopped = threading.Event()
+        done = object()
+
+        def put(item):
+            # don't block forever if the consumer went away
+            while not stopped.is_set():
+                try:
+                    results.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def process(partition):
+            try:
+                for instance in hydrator.hydrate(batch_snapshot.process_query_batch(partition), db=db):
+                    if not put(instance):
+                        return
+            except Exception as e:
+                put(PartitionError(e))
+            put(done)
+
+        for partition in partitions:
+            executor.submit(process, partition)
+
+        try:
+            remaining = len(partitions)
+            while remaining:
+                item = results.get()
+                if item is done:
+                    remaining -= 1
+                elif isinstance(item, PartitionError):
+                    raise item.error
+                else:
+                    yield item
+        finally:
+            stopped.set()
+
+    def run_in_transaction(self, func, *args, **kwargs):
+        """
+        Run `func(*args, **kwargs)` in a read-write transaction with retries, see ezspanner.transaction.atomic.
+
+        :param connection_id: (keyword only)
+        :return: return value of `func`
+        """
+        from .transaction import atomic
+        return atomic(connection_id=kwargs.pop('connection_id', None)).run(func, *args, **kwargs)
 
 #
 # QUERY FILTERS
@@ -551,9 +2319,15 @@ class FilterMeta(type):
 
 class FilterBase(six.with_metaclass(FilterMeta)):
     operator = None
+    # True if `as_sql` accepts a list of fields (`pk` lookups of composite primary keys)
+    composite = False
 
     @classmethod
-    def as_sql(cls, qs, field, value):
+    def as_sql(cls, compiler, field, value, alias=None):
+        """
+        Return the filter condition. Every concrete (non-F) value must be registered with exactly one
+        `compiler.add_param` call, see `SpannerQuerySet._get_param_values`.
+        """
         raise NotImplementedError
 
 
@@ -562,11 +2336,11 @@ class FilterEquals(FilterBase):
     sql_op = '='
 
     @classmethod
-    def as_sql(cls, qs, field, value, alias=None):
+    def as_sql(cls, compiler, field, value, alias=None):
         """
 
-        :type qs: ezspanner.query.SpannerQuerySet
-        :param qs:
+        :type compiler: ezspanner.query.QueryCompiler
+        :param compiler:
 
         :type field: ezspanner.fields.SpannerField
         :param field:
@@ -581,7 +2355,7 @@ class FilterEquals(FilterBase):
                                                    value,
                                                    op=cls.sql_op)
         else:
-            param_placeholder = qs.add_param(field, value)
+            param_placeholder = compiler.add_param(field, value)
             return '`{0}`.`{1}` {op} @{2}'.format(alias or field.model._meta.table,
                                                   field.name,
                                                   param_placeholder,
@@ -595,7 +2369,7 @@ class FilterGte(FilterEquals):
 
 class FilterGt(FilterEquals):
     operator = 'gt'
-    sql_op = '>='
+    sql_op = '>'
 
 
 class FilterLte(FilterEquals):
@@ -606,3 +2380,48 @@ class FilterLte(FilterEquals):
 class FilterLt(FilterEquals):
     operator = 'lt'
     sql_op = '<'
+
+
+class FilterIn(FilterBase):
+    """
+    `field__in=[...]`: binds the values as a single ARRAY param, the sql doesn't depend on the number of values.
+
+    `pk__in=[(key values), ...]` matches the complete (composite) primary key against an ARRAY of STRUCTs.
+    NULL values never match.
+    """
+    operator = 'in'
+    sql_op = 'IN'
+    composite = True
+
+    @classmethod
+    def as_sql(cls, compiler, field, value, alias=None):
+        """
+
+        :type compiler: ezspanner.query.QueryCompiler
+        :type field: ezspanner.fields.SpannerField|list[ezspanner.fields.SpannerField]
+        :param value: iterable of values, resp. of key tuples for composite keys
+        :param alias: table alias (optional)
+        """
+        if isinstance(value, F):
+            raise QueryError("'%s' lookups require a list of values" % cls.operator)
+
+        if isinstance(field, list):
+            table = alias or field[0].model._meta.table
+            param_placeholder = compiler.add_param('pk', value, param_type=ArrayParamType(StructParamType(
+                [StructField(f.name, f.get_spanner_type()) for f in field])))
+            return 'STRUCT<{0}>({1}) {op} UNNEST(@{2})'.format(
+                ', '.join('`%s` %s' % (f.name, f.type) for f in field),
+                ', '.join('`%s`.`%s`' % (table, f.name) for f in field),
+                param_placeholder,
+                op=cls.sql_op)
+
+        param_placeholder = compiler.add_param(field, value, param_type=ArrayParamType(field.get_spanner_type()))
+        return '`{0}`.`{1}` {op} UNNEST(@{2})'.format(alias or field.model._meta.table,
+                                                      field.name,
+                                                      param_placeholder,
+                                                      op=cls.sql_op)
+
+
+class FilterNotIn(FilterIn):
+    operator = 'not_in'
+    sql_op = 'NOT IN'
@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental schema migrations, see SpannerModelRegistry.migrate.
+
+```
+diff = SpannerModelRegistry.migrate(dry_run=True)
+print(diff.statements)
+# ['ALTER TABLE `model_a` ADD COLUMN `field_new` INT64', 'CREATE INDEX `over9000` ON `model_b` (`value_field_x`)']
+
+SpannerModelRegistry.migrate(progress=lambda completed, total: print('%s/%s' % (completed, total)))
+```
+
+The current schema is read from INFORMATION_SCHEMA and compared with the registered models. The diff only contains
+the changes that are needed: missing tables, added columns, changed nullability or STRING / BYTES length, and
+created, changed (drop + create) or removed indices. Changes that Cloud Spanner can't apply in place (primary key,
+interleaving, other type changes) are reported as `warnings`, columns that don't exist in the models are only dropped
+with `drop_columns=True`.
+
+Columns are added as nullable: Spanner rejects NOT NULL columns for tables with rows. Backfill the values and migrate
+again, the second run makes the column NOT NULL.
+
+All statements are sent as a single schema update (or `max_statements` per update), Spanner validates and backfills
+them in one long-running operation instead of one per statement.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+import logging
+import time
+from collections import OrderedDict
+
+import six
+
+from .sql import v1 as sql_v1
+
+logger = logging.getLogger('ezspanner')
+
+# change types, in the order their statements are applied
+OP_DROP_INDEX = 'drop_index'
+OP_CREATE_TABLE = 'create_table'
+OP_ADD_COLUMN = 'add_column'
+OP_ALTER_COLUMN = 'alter_column'
+OP_CREATE_INDEX = 'create_index'
+OP_DROP_COLUMN = 'drop_column'
+OPERATIONS = (OP_DROP_INDEX, OP_CREATE_TABLE, OP_ADD_COLUMN, OP_ALTER_COLUMN, OP_CREATE_INDEX, OP_DROP_COLUMN)
+
+# seconds between polls of a running schema update
+DEFAULT_POLL_INTERVAL = 5.0
+
+SQL_TABLES = "SELECT TABLE_NAME, PARENT_TABLE_NAME, ON_DELETE_ACTION FROM INFORMATION_SCHEMA.TABLES " \
+             "WHERE TABLE_SCHEMA = ''"
+SQL_COLUMNS = "SELECT TABLE_NAME, COLUMN_NAME, SPANNER_TYPE, IS_NULLABLE FROM INFORMATION_SCHEMA.COLUMNS " \
+              "WHERE TABLE_SCHEMA = '' ORDER BY TABLE_NAME, ORDINAL_POSITION"
+SQL_INDEXES = "SELECT TABLE_NAME, INDEX_NAME, INDEX_TYPE, PARENT_TABLE_NAME, IS_UNIQUE FROM " \
+              "INFORMATION_SCHEMA.INDEXES WHERE TABLE_SCHEMA = ''"
+# storing columns have no ORDINAL_POSITION, they are sorted first
+SQL_INDEX_COLUMNS = "SELECT TABLE_NAME, INDEX_NAME, COLUMN_NAME, ORDINAL_POSITION, COLUMN_ORDERING FROM " \
+                    "INFORMATION_SCHEMA.INDEX_COLUMNS WHERE TABLE_SCHEMA = '' " \
+                    "ORDER BY TABLE_NAME, INDEX_NAME, ORDINAL_POSITION"
+
+PRIMARY_KEY = 'PRIMARY_KEY'
+
+
+class ColumnSchema(object):
+
+    def __init__(self, name, type, nullable=True):
+        self.name = name
+        # spanner type, e.g. 'INT64', 'STRING(200)'
+        self.type = type.upper()
+        self.nullable = nullable
+
+    def __repr__(self):
+        return '<ColumnSchema: %s %s%s>' % (self.name, self.type, '' if self.nullable else ' NOT NULL')
+
+
+class IndexSchema(object):
+
+    def __init__(self, name, columns, unique=False, storing=(), interleave=None):
+        """
+        :param columns: tuple of (column name, descending) tuples
+        :param storing: stored column names
+        :param interleave: table the index is interleaved in
+        """
+        self.name = name
+        self.columns = tuple(columns)
+        self.unique = unique
+        self.storing = frozenset(storing)
+        self.interleave = interleave or None
+
+    def __repr__(self):
+        return '<IndexSchema: %s (%s)>' % (self.name, ', '.join('%s%s' % (column, ' DESC' if descending else '')
+                                                                for column, descending in self.columns))
+
+    def __eq__(self, other):
+        return isinstance(other, IndexSchema) and self._key() == other._key()
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def _key(self):
+        return self.name, self.columns, self.unique, self.storing, self.interleave
+
+    @classmethod
+    def from_index(cls, index):
+        """
+        :type index: ezspanner.indices.SpannerIndex
+        """
+        return cls(index.name, [(column, bool(sort.strip())) for column, sort in index.index_fields.items()],
+                   unique=index.unique, storing=index.storing,
+                   interleave=index.interleave._meta.table if index.interleave else None)
+
+
+class TableSchema(object):
+
+    def __init__(self, name, parent=None, on_delete=None):
+        self.name = name
+        self.parent = parent or None
+        self.on_delete = on_delete
+        # column name -> ColumnSchema
+        self.columns = OrderedDict()
+        # tuple of (column name, descending) tuples
+        self.primary_key = ()
+        # index name -> IndexSchema
+        self.indices = OrderedDict()
+
+    def __repr__(self):
+        return '<TableSchema: %s>' % self.name
+
+    @classmethod
+    def from_model(cls, model):
+        """
+        :type model: ezspanner.models.SpannerModelBase
+        """
+        meta = model._meta
+        table = cls(meta.table, meta.parent._meta.table if meta.parent else None,
+                    ('CASCADE' if meta.parent_on_delete == 'CASCADE' else 'NO ACTION') if meta.parent else None)
+        for field in meta.get_fields():
+            table.columns[field.name] = ColumnSchema(field.name, field.get_type(), field.null)
+        table.primary_key = IndexSchema.from_index(meta.primary).columns
+        for index in meta.indices:
+            table.indices[index.name] = IndexSchema.from_index(index)
+        return table
+
+
+def get_schema(database):
+    """
+    Read the tables, columns and indices of the database from INFORMATION_SCHEMA.
+
+    :type database: google.cloud.spanner.database.Database
+    :rtype: OrderedDict
+    :return: table name -> TableSchema
+    """
+    with database.snapshot(multi_use=True) as snapshot:
+        snapshot.begin()
+        tables_rows = list(snapshot.execute_sql(SQL_TABLES))
+        column_rows = list(snapshot.execute_sql(SQL_COLUMNS))
+        index_rows = list(snapshot.execute_sql(SQL_INDEXES))
+        index_column_rows = list(snapshot.execute_sql(SQL_INDEX_COLUMNS))
+
+    schema = OrderedDict()
+    for table_name, parent, on_delete in tables_rows:
+        schema[table_name] = TableSchema(table_name, parent, on_delete)
+
+    for table_name, column_name, spanner_type, is_nullable in column_rows:
+        schema[table_name].columns[column_name] = ColumnSchema(column_name, spanner_type, is_nullable == 'YES')
+
+    indices = {}
+    for table_name, index_name, index_type, parent, is_unique in index_rows:
+        indices[(table_name, index_name)] = {'type': index_type, 'interleave': parent, 'unique': is_unique,
+                                             'columns': [], 'storing': []}
+
+    for table_name, index_name, column_name, position, ordering in index_column_rows:
+        index = indices.get((table_name, index_name))
+        if index is None:
+            continue
+        if position is None:
+            index['storing'].append(column_name)
+        else:
+            index['columns'].append((column_name, ordering == 'DESC'))
+
+    for (table_name, index_name), index in sorted(six.iteritems(indices)):
+        if index['type'] == PRIMARY_KEY:
+            schema[table_name].primary_key = tuple(index['columns'])
+        else:
+            schema[table_name].indices[index_name] = IndexSchema(index_name, index['columns'], index['unique'],
+                                                                 index['storing'], index['interleave'])
+    return schema
+
+
+class SchemaChange(object):
+
+    def __init__(self, op, table, name, statements):
+        """
+        :param op: one of OPERATIONS
+        :param table: table name
+        :param name: name of the changed column / index, None for tables
+        :param statements: list of DDL statements
+        """
+        self.op = op
+        self.table = table
+        self.name = name
+        self.statements = statements
+
+    def __repr__(self):
+        return '<SchemaChange: %s %s%s>' % (self.op, self.table, '.%s' % self.name if self.name else '')
+
+
+class SchemaDiff(object):
+
+    def __init__(self):
+        # list of SchemaChange
+        self.changes = []
+        # changes that can't be applied in place
+        self.warnings = []
+
+    def __len__(self):
+        return len(self.changes)
+
+    def __bool__(self):
+        return bool(self.changes)
+
+    __nonzero__ = __bool__
+
+    def add(self, op, table, name, statements):
+        self.changes.append(SchemaChange(op, table, name, statements))
+
+    @property
+    def statements(self):
+        """
+        DDL statements of all changes, ordered by OPERATIONS.
+
+        :rtype: list
+        """
+        order = dict((op, i) for i, op in enumerate(OPERATIONS))
+        changes = sorted(enumerate(self.changes), key=lambda change: (order[change[1].op], change[0]))
+        return [statement for _, change in changes for statement in change.statements]
+
+
+def _is_sized(spanner_type):
+    return spanner_type.startswith('STRING(') or spanner_type.startswith('BYTES(')
+
+
+def diff_schema(schema, models, drop_columns=False, drop_indices=True):
+    """
+    Compare the database schema with the models.
+
+    :param schema: table name -> TableSchema, see get_schema
+    :param models: iterable of SpannerModelBase, parents before their interleaved children
+    :param drop_columns: drop columns that don't exist in the models
+    :param drop_indices: drop indices of the models' tables that don't exist in the models
+    :rtype: SchemaDiff
+    """
+    diff = SchemaDiff()
+    for model in models:
+        expected = TableSchema.from_model(model)
+        # index name -> SpannerIndex
+        model_indices = OrderedDict((index.name, index) for index in model._meta.indices)
+        current = schema.get(expected.name)
+        if current is None:
+            diff.add(OP_CREATE_TABLE, expected.name, None, sql_v1.SQLTable(model).stmt_create(include_indices=False))
+            for index in model_indices.values():
+                diff.add(OP_CREATE_INDEX, expected.name, index.name, sql_v1.SQLIndex(index).stmt_create())
+            continue
+
+        if current.primary_key != expected.primary_key:
+            diff.warnings.append("%s: the primary key can't be changed" % expected.name)
+        if (current.parent, current.on_delete) != (expected.parent, expected.on_delete):
+            diff.warnings.append("%s: the interleaving can't be changed" % expected.name)
+
+        for field in model._meta.get_fields():
+            column, wanted = current.columns.get(field.name), expected.columns[field.name]
+            builder = sql_v1.SQLField(field)
+            if column is None:
+                diff.add(OP_ADD_COLUMN, expected.name, field.name, builder.stmt_add(null=True))
+                if not wanted.nullable:
+                    diff.warnings.append("%s.%s: added as nullable, backfill it and migrate again to make it NOT NULL"
+                                         % (expected.name, field.name))
+            elif column.type != wanted.type and not (_is_sized(column.type) and _is_sized(wanted.type)):
+                diff.warnings.append("%s.%s: the type can't be changed from %s to %s" %
+                                     (expected.name, field.name, column.type, wanted.type))
+            elif (column.type, column.nullable) != (wanted.type, wanted.nullable):
+                diff.add(OP_ALTER_COLUMN, expected.name, field.name, builder.stmt_alter())
+
+        primary_columns = set(column for column, _ in current.primary_key)
+        for column_name in current.columns:
+            if column_name in expected.columns:
+                continue
+            if drop_columns and column_name not in primary_columns:
+                diff.add(OP_DROP_COLUMN, expected.name, column_name,
+                         ['ALTER TABLE `%s` DROP COLUMN `%s`' % (expected.name, column_name)])
+            else:
+                diff.warnings.append("%s.%s: the column doesn't exist in the model" % (expected.name, column_name))
+
+        for index in model_indices.values():
+            current_index = current.indices.get(index.name)
+            if current_index == expected.indices[index.name]:
+                continue
+            if current_index is not None:
+                diff.add(OP_DROP_INDEX, expected.name, index.name, sql_v1.SQLIndex(index).stmt_drop())
+            diff.add(OP_CREATE_INDEX, expected.name, index.name, sql_v1.SQLIndex(index).stmt_create())
+
+        if drop_indices:
+            for index_name in current.indices:
+                if index_name not in expected.indices:
+                    diff.add(OP_DROP_INDEX, expected.name, index_name, ['DROP INDEX `%s`' % index_name])
+    return diff
+
+
+def get_completed_statements(operation):
+    """
+    Number of statements a schema update operation has applied, from its UpdateDatabaseDdlMetadata.
+    """
+    metadata = getattr(operation, 'metadata', None)
+    if callable(metadata):
+        metadata = metadata()
+    return len(getattr(metadata, 'commit_timestamps', None) or ())
+
+
+def update_ddl(database, statements, max_statements=None, progress=None, poll_interval=DEFAULT_POLL_INTERVAL,
+               sleep=time.sleep):
+    """
+    Apply DDL statements in as few schema updates as possible and wait for them.
+
+    :type database: google.cloud.spanner.database.Database
+    :param statements: list of DDL statements
+    :param max_statements: max statements per schema update, None: a single update
+    :param progress: callable(completed statements, total statements), called after every poll
+    :param poll_interval: seconds between polls of a running update
+    :rtype: int
+    :return: number of schema updates
+    """
+    total = len(statements)
+    step = max_statements or total
+    completed = 0
+    updates = 0
+    for start in range(0, total, step):
+        batch = statements[start:start + step]
+        operation = database.update_ddl(ddl_statements=batch)
+        updates += 1
+        while not operation.done():
+            if progress is not None:
+                progress(completed + get_completed_statements(operation), total)
+            sleep(poll_interval)
+        # raises the error of a failed statement
+        operation.result()
+        completed += len(batch)
+        logger.info("[EZSpanner] schema update %s: %s/%s statements applied", updates, completed, total)
+        if progress is not None:
+            progress(completed, total)
+    return updates
@@ -24,7 +24,9 @@ class SQLTable(object):
 
         if model_meta.parent:
             # build interleave sql
-            parent_table_sql = ' INTERLEAVE IN `%(parent_table)s `' % {'parent_table': model_meta.parent._meta.table}
+            parent_table_sql = ', INTERLEAVE IN PARENT `%(parent_table)s`' % {
+                'parent_table': model_meta.parent._meta.table,
+            }
 
             # add on delete, default to CASCADE
             if model_meta.parent_on_delete == 'CASCADE':
@@ -35,7 +37,8 @@ class SQLTable(object):
         primary_key_fields = model_meta.primary.get_fields_with_sort()
 
         ddl_statements = [
-            """CREATE TABLE `%(table)s` (\n%(field_definitions)s\n) PRIMARY KEY (%(primary_key_fields)s)%(parent_table_sql)s;""" % {
+            """CREATE TABLE `%(table)s` (\n%(field_definitions)s\n) """
+            """PRIMARY KEY (%(primary_key_fields)s)%(parent_table_sql)s""" % {
                 'table': model_meta.table,
                 'field_definitions': ',\n'.join([SQLField(field).stmt_create()[0]
                                                 for field in fields]),
@@ -68,11 +71,32 @@ class SQLField(object):
         """
         :rtype: list
         """
-        return ["""`%(field_model_name)s` %(type)s %(null)s""" % {
-            'type': self.field.get_type(),
-            'null': 'NULL' if self.field.null else 'NOT NULL',
-            'field_model_name': self.field.name
-        }]
+        return [self.stmt_column()]
+
+    def stmt_column(self, null=None):
+        """
+        Column definition of ALTER TABLE statements.
+
+        :param null: override the field's nullability
+        :rtype: unicode
+        """
+        null = self.field.null if null is None else null
+        return '`%s` %s%s' % (self.field.name, self.field.get_type(), '' if null else ' NOT NULL')
+
+    def stmt_add(self, null=None):
+        """
+        :param null: override the field's nullability, e.g. to add a NOT NULL column to a table with rows
+        :rtype: list
+        """
+        return ['ALTER TABLE `%s` ADD COLUMN %s' % (self.model._meta.table, self.stmt_column(null))]
+
+    def stmt_alter(self):
+        """
+        Change the column's type (STRING / BYTES length) or nullability.
+
+        :rtype: list
+        """
+        return ['ALTER TABLE `%s` ALTER COLUMN %s' % (self.model._meta.table, self.stmt_column())]
 
 
 class SQLIndex(object):
@@ -89,10 +113,7 @@ class SQLIndex(object):
         :rtype: list
         :returns: drop index string
         """
-        return ['DROP INDEX `%(name)s` ON %(table)s;' % {
-            'name': self.index.name,
-            'table': self.index.model._meta.table
-        }]
+        return ['DROP INDEX `%s`' % self.index.name]
 
     def stmt_create(self):
         """
@@ -102,12 +123,12 @@ class SQLIndex(object):
         :returns: create index string
         """
         index = self.index
-        fields = ['`%s` %s' % (field_name, field_sort) for field_name, field_sort in index.index_fields.items()]
-        return ['CREATE%(unique)s INDEX `%(name)s` ON `%(table)s` (%(index_fields)s)%(storing)s%(interleave)s;' % {
+        fields = ['`%s`%s' % (field_name, field_sort) for field_name, field_sort in index.index_fields.items()]
+        return ['CREATE%(unique)s INDEX `%(name)s` ON `%(table)s` (%(index_fields)s)%(storing)s%(interleave)s' % {
             'name': index.name,
             'table': index.model._meta.table,
             'index_fields': ', '.join(fields),
             'unique': ' UNIQUE' if index.unique else '',
-            'storing': '' if not index.storing else ' STORING(%s)' % ', '.join(['`%s`' % f for f in index.storing]),
+            'storing': '' if not index.storing else ' STORING (%s)' % ', '.join(['`%s`' % f for f in index.storing]),
             'interleave': '' if not index.interleave else ', INTERLEAVE IN `%s`' % index.interleave._meta.table,
         }]
@@ -2,6 +2,7 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 from future.builtins import *
 
+from google.cloud.proto.spanner.v1.result_set_pb2 import ResultSetStats
 
 import ezspanner
 
@@ -55,3 +56,239 @@ class TestModelD(TestModelB):
 class TestModelNotRegistered(TestModelC):
     class Meta:
         abstract = True
+
+
+class FakeBatch(object):
+    """ Records mutations instead of sending them to Cloud Spanner. """
+
+    def __init__(self):
+        self.mutations = []
+
+    def insert(self, table, columns, values):
+        self.mutations.append(('insert', table, tuple(columns), list(values)))
+
+    def update(self, table, columns, values):
+        self.mutations.append(('update', table, tuple(columns), list(values)))
+
+    def insert_or_update(self, table, columns, values):
+        self.mutations.append(('insert_or_update', table, tuple(columns), list(values)))
+
+    def delete(self, table, keyset):
+        self.mutations.append(('delete', table, None, list(keyset.keys)))
+
+
+class FakeBatchCheckout(object):
+
+    def __init__(self, database):
+        self.database = database
+        self.batch = FakeBatch()
+
+    def __enter__(self):
+        return self.batch
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.database.commits.append(self.batch)
+
+
+class FakeSnapshot(object):
+    """ Read-only snapshot that reads from its FakeDatabase. """
+
+    def __init__(self, database, **options):
+        self.database = database
+        self.options = options
+        self.begun = False
+
+    def begin(self):
+        self.begun = True
+
+    def read(self, *args, **kwargs):
+        return self.database.read(*args, **kwargs)
+
+    def execute_sql(self, *args, **kwargs):
+        return self.database.execute_sql(*args, **kwargs)
+
+
+class FakeSnapshotCheckout(object):
+
+    def __init__(self, database, **options):
+        self.snapshot = FakeSnapshot(database, **options)
+        database.snapshots.append(self.snapshot)
+
+    def __enter__(self):
+        return self.snapshot
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+class FakeTransaction(FakeBatch):
+    """ Read-write transaction that records its mutations and reads from its FakeDatabase. """
+
+    def __init__(self, database):
+        super(FakeTransaction, self).__init__()
+        self.database = database
+        self.begun = False
+        self.committed = False
+        self.rolled_back = False
+
+    def begin(self):
+        self.begun = True
+
+    def read(self, *args, **kwargs):
+        return self.database.read(*args, **kwargs)
+
+    def execute_sql(self, *args, **kwargs):
+        return self.database.execute_sql(*args, **kwargs)
+
+    def commit(self):
+        self.committed = True
+        self.database.commits.append(self)
+
+    def rollback(self):
+        self.rolled_back = True
+
+
+class FakeSession(object):
+
+    def __init__(self, database):
+        self.database = database
+
+    def transaction(self):
+        return FakeTransaction(self.database)
+
+
+class FakePool(object):
+
+    def __init__(self, database):
+        self.database = database
+        self.checked_out = 0
+
+    def get(self):
+        self.checked_out += 1
+        return FakeSession(self.database)
+
+    def put(self, session):
+        self.checked_out -= 1
+
+
+class FakeBatchSnapshot(object):
+    """ Batch snapshot that splits FakeDatabase.rows into partitions. """
+
+    def __init__(self, database, partitions=2, **options):
+        self.database = database
+        self.partitions = partitions
+        self.options = options
+        self.closed = False
+
+    def generate_query_batches(self, sql, params=None, param_types=None, partition_size_bytes=None,
+                               max_partitions=None):
+        self.database.queries.append((sql, params))
+        partitions = min(self.partitions, max_partitions or self.partitions)
+        return [{'partition': i, 'partitions': partitions} for i in range(partitions)]
+
+    def process_query_batch(self, batch):
+        return iter(self.database.rows[batch['partition']::batch['partitions']])
+
+    def close(self):
+        self.closed = True
+
+
+class FakeResultSet(object):
+    """ Streamed result set, `stats` are set once all rows were consumed. """
+
+    def __init__(self, rows, query_mode=None, query_plan=None):
+        # PLAN mode doesn't execute the statement
+        self.rows = [] if query_mode == 1 else rows
+        self.query_mode = query_mode
+        self.query_plan = query_plan
+        self.stats = None
+
+    def __iter__(self):
+        for row in self.rows:
+            yield row
+        if self.query_mode:
+            self.stats = ResultSetStats()
+            if self.query_plan is not None:
+                self.stats.query_plan.CopyFrom(self.query_plan)
+            if self.query_mode == 2:
+                self.stats.query_stats.update({'rows_returned': str(len(self.rows)), 'elapsed_time': '1.2 msecs'})
+
+
+class FakeOperation(object):
+    """ Long-running schema update that applies one statement per poll. """
+
+    def __init__(self, statements):
+        self.statements = statements
+        self.polls = 0
+        self.commit_timestamps = []
+
+    def metadata(self):
+        return self
+
+    def done(self):
+        self.polls += 1
+        self.commit_timestamps = self.statements[:self.polls - 1]
+        return len(self.commit_timestamps) == len(self.statements)
+
+    def result(self):
+        return None
+
+
+class FakeDatabase(object):
+    """ In-memory stand-in for google.cloud.spanner.database.Database. """
+
+    def __init__(self, rows=None):
+        self.commits = []
+        self.queries = []
+        self.reads = []
+        self.snapshots = []
+        self.batch_snapshots = []
+        # rows returned by execute_sql, or a callable(sql, params) returning the rows
+        self.rows = rows or []
+        # number of times run_in_transaction aborts the next attempts
+        self.aborts = 0
+        # QueryPlan pb returned with the stats of PLAN / PROFILE queries
+        self.query_plan = None
+        # list of FakeOperation, one per update_ddl call
+        self.ddl_operations = []
+
+    def batch(self):
+        return FakeBatchCheckout(self)
+
+    def batch_snapshot(self, **options):
+        self.batch_snapshots.append(FakeBatchSnapshot(self, **options))
+        return self.batch_snapshots[-1]
+
+    def snapshot(self, **options):
+        return FakeSnapshotCheckout(self, **options)
+
+    def run_in_transaction(self, func, *args, **kwargs):
+        # retries aborted attempts like Session.run_in_transaction
+        while True:
+            transaction = FakeTransaction(self)
+            transaction.begin()
+            try:
+                func(transaction, *args, **kwargs)
+            except Exception:
+                transaction.rollback()
+                raise
+            if self.aborts:
+                self.aborts -= 1
+                continue
+            transaction.commit()
+            return transaction
+
+    def update_ddl(self, ddl_statements):
+        self.ddl_operations.append(FakeOperation(ddl_statements))
+        return self.ddl_operations[-1]
+
+    def read(self, table, columns, keyset, index='', limit=0, resume_token=b''):
+        self.reads.append((table, list(columns), keyset, index, limit))
+        return iter(self.rows)
+
+    def execute_sql(self, sql, params=None, param_types=None, query_mode=None, resume_token=b''):
+        self.queries.append((sql, params))
+        if callable(self.rows):
+            return FakeResultSet(list(self.rows(sql, params)), query_mode, self.query_plan)
+        return FakeResultSet(self.rows, query_mode, self.query_plan)
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+from future.builtins import *
+
+import warnings
+from unittest import TestCase
+
+import ezspanner
+from ezspanner.models import SpannerModelRegistry
+from ezspanner.query_utils import Q
+from ...exceptions import FullScanWarning
+
+
+class AdvisedModel(ezspanner.SpannerModel):
+    class Meta:
+        table = 'advised_model'
+        pk = ['id']
+        indices = [
+            ezspanner.SpannerIndex('by_tenant', fields=['tenant_id', '-created'], storing=['name']),
+            ezspanner.SpannerIndex('by_name', fields=['name']),
+        ]
+
+    id = ezspanner.IntField()
+    tenant_id = ezspanner.IntField()
+    created = ezspanner.IntField()
+    name = ezspanner.StringField(length=100, null=True)
+    counter = ezspanner.IntField(null=True)
+
+
+SpannerModelRegistry.registered_models.pop(AdvisedModel._meta.table)
+
+
+class IndexAdvisorTests(TestCase):
+
+    def compile(self, qs):
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            query = qs.query
+        return query, [w for w in caught if issubclass(w.category, FullScanWarning)]
+
+    def test_covering_index(self):
+        qs = AdvisedModel.objects.auto_index().filter(tenant_id=1, created__gte=5).values('id', 'name')
+        query, caught = self.compile(qs)
+        self.assertIn('FROM `advised_model`@{FORCE_INDEX=by_tenant}', query)
+        self.assertEqual(caught, [])
+        self.assertEqual(qs.index_advice.index, 'by_tenant')
+        self.assertEqual(qs.index_advice.key_columns, ('tenant_id',))
+        self.assertEqual(qs.index_advice.range_column, 'created')
+
+        qs = AdvisedModel.objects.filter(name__in=['a', 'b']).values('id')
+        self.assertEqual(qs.suggest_index().index, 'by_name')
+        # without auto_index() nothing changes
+        self.assertIn('FROM `advised_model`\n', qs.query)
+
+        # the primary key is the better match, explicit index() wins
+        qs = AdvisedModel.objects.auto_index().filter(id=1, tenant_id=2)
+        self.assertIsNone(qs.suggest_index().index)
+        self.assertIn('FORCE_INDEX=by_name', qs.index('by_name').query)
+
+    def test_full_scan_warning(self):
+        # `counter` isn't stored in the index
+        query, caught = self.compile(AdvisedModel.objects.auto_index().filter(tenant_id=1))
+        self.assertIn('FROM `advised_model`\n', query)
+        self.assertEqual(len(caught), 1)
+        self.assertIn("Index 'by_tenant' doesn't store counter", str(caught[0].message))
+
+        # OR'ed conditions can't be used to seek
+        _, caught = self.compile(AdvisedModel.objects.auto_index().filter(Q(id=1) | Q(tenant_id=2)))
+        self.assertEqual(len(caught), 1)
+
+        _, caught = self.compile(AdvisedModel.objects.auto_index())
+        self.assertEqual(caught, [])
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase, mock
+
+from ... import aio
+from ...connection import Connection
+from .helper import TestModelA, FakeDatabase
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class AsyncTests(TestCase):
+
+    def setUp(self):
+        self.database = FakeDatabase(rows=[[i, 0, None, 0, None] for i in range(50)])
+        patcher = mock.patch.object(Connection, 'get', return_value=self.database)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_aiter(self):
+        async def consume():
+            return [obj.id_a async for obj in TestModelA.objects.aiter(buffer_size=3)]
+
+        self.assertEqual(run(consume()), list(range(50)))
+
+    def test_aiter_stop_early(self):
+        async def consume():
+            iterator = TestModelA.objects.aiter(buffer_size=1)
+            async for obj in iterator:
+                break
+            iterator.close()
+            return obj
+
+        self.assertEqual(run(consume()).id_a, 0)
+
+    def test_aiter_single_worker(self):
+        # open iterators don't hold a worker, the writes within the loop don't wait for them
+        async def consume():
+            ids = []
+            iterators = [TestModelA.objects.aiter(buffer_size=2) for _ in range(2)]
+            async for obj in iterators[0]:
+                ids.append(obj.id_a)
+                await iterators[1].__anext__()
+                if obj.id_a < 3:
+                    obj.field_int_not_null = 1
+                    await obj.asave()
+            return ids
+
+        executor = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(executor.shutdown)
+        with mock.patch.dict(aio._executors, {'default': executor}):
+            self.assertEqual(run(asyncio.wait_for(consume(), 10)), list(range(50)))
+        self.assertEqual(len(self.database.commits), 3)
+
+    def test_afirst(self):
+        self.assertEqual(run(TestModelA.objects.afirst()).id_a, 0)
+
+    def test_concurrent_writes(self):
+        async def write():
+            objs = [TestModelA(id_a=i, field_int_not_null=i, field_string_not_null=i) for i in range(3)]
+            await asyncio.gather(TestModelA.objects.abulk_create(objs[:2]), objs[2].asave(force_insert=True))
+            await objs[0].adelete()
+
+        run(write())
+        self.assertEqual(len(self.database.commits), 3)
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+from future.builtins import *
+
+from unittest import TestCase
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+import ezspanner
+from ezspanner.cache import LocalMemoryCache, ExternalCache, DictCacheClient
+from ezspanner.connection import Connection
+from ezspanner.models import SpannerModelRegistry
+from .helper import FakeDatabase
+
+
+class CachedParent(ezspanner.SpannerModel):
+    class Meta:
+        table = 'cached_parent'
+        pk = ['id_p']
+        cache = True
+
+    id_p = ezspanner.IntField()
+    name = ezspanner.StringField(length=20, null=True)
+
+
+class CachedChild(ezspanner.SpannerModel):
+    class Meta:
+        table = 'cached_child'
+        pk = ['id_c']
+        parent = CachedParent
+        cache = ExternalCache(DictCacheClient())
+
+    id_c = ezspanner.IntField()
+    value = ezspanner.IntField(null=True)
+
+
+# keep the registry as defined in helper, the models are only registered while the tests run
+for _model in (CachedParent, CachedChild):
+    SpannerModelRegistry.registered_models.pop(_model._meta.table)
+
+
+def make_row(model, **values):
+    return [values.get(f.name) for f in model._meta.local_fields]
+
+
+class LocalMemoryCacheTests(TestCase):
+
+    def test_lru_and_ttl(self):
+        now = [0]
+        cache = LocalMemoryCache(maxsize=2, ttl=10, timer=lambda: now[0])
+        cache.set_many({('t', (1,)): [1], ('t', (2,)): [2]})
+        # touch 1, 2 becomes the least recently used entry
+        self.assertEqual(cache.get_many([('t', (1,))]), {('t', (1,)): [1]})
+        cache.set_many({('t', (3,)): [3]})
+        self.assertEqual(sorted(cache.get_many([('t', (1,)), ('t', (2,)), ('t', (3,))])), [('t', (1,)), ('t', (3,))])
+
+        now[0] = 10
+        self.assertEqual(cache.get_many([('t', (1,))]), {})
+
+    def test_delete_prefix(self):
+        cache = LocalMemoryCache()
+        cache.set_many({('t', (1, 1)): [1], ('t', (1, 2)): [2], ('t', (2, 1)): [3], ('o', (1, 1)): [4]})
+        cache.delete_prefix('t', (1,))
+        self.assertEqual(sorted(cache.get_many([('t', (1, 1)), ('t', (2, 1)), ('o', (1, 1))])),
+                         [('o', (1, 1)), ('t', (2, 1))])
+
+
+    def test_invalidated_while_reading(self):
+        cache = LocalMemoryCache()
+        token = cache.begin_read()
+        cache.delete_many([('t', (1,))])
+        cache.delete_prefix('t', (2,))
+        cache.set_many({('t', (1,)): [1], ('t', (2, 1)): [2], ('t', (3,)): [3]}, token)
+        cache.end_read(token)
+        self.assertEqual(list(cache.get_many([('t', (1,)), ('t', (2, 1)), ('t', (3,))])), [('t', (3,))])
+
+        # reads that start after the invalidation store their rows
+        token = cache.begin_read()
+        cache.set_many({('t', (1,)): [1]}, token)
+        cache.end_read(token)
+        self.assertEqual(len(cache.get_many([('t', (1,))])), 1)
+        self.assertEqual(cache._invalidated, {})
+
+
+class ExternalCacheTests(TestCase):
+
+    def test_delete_prefix(self):
+        cache = ExternalCache(DictCacheClient())
+        cache.set_many({('t', (1, 1)): [1], ('t', (2, 1)): [2]})
+        self.assertEqual(len(cache.get_many([('t', (1, 1)), ('t', (2, 1))])), 2)
+
+        cache.delete_prefix('t', (1,))
+        self.assertEqual(list(cache.get_many([('t', (1, 1)), ('t', (2, 1))])), [('t', (2, 1))])
+
+        cache.delete_many([('t', (2, 1))])
+        self.assertEqual(cache.get_many([('t', (2, 1))]), {})
+
+
+class EntityCacheTests(TestCase):
+
+    def setUp(self):
+        for model in (CachedParent, CachedChild):
+            SpannerModelRegistry.register(model)
+            self.addCleanup(SpannerModelRegistry.registered_models.pop, model._meta.table)
+        CachedParent._meta.cache.clear()
+        CachedChild._meta.cache.clear()
+        self.database = FakeDatabase(rows=[make_row(CachedParent, id_p=1, name='a')])
+        patcher = mock.patch.object(Connection, 'get', return_value=self.database)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_read_through(self):
+        obj = CachedParent.objects.get_by_pk(1)
+        self.assertEqual(obj.name, 'a')
+        self.assertEqual(len(self.database.reads), 1)
+
+        obj = CachedParent.objects.get(id_p=1)
+        self.assertEqual((obj.id_p, obj.name), (1, 'a'))
+        self.assertFalse(obj._state.adding)
+        self.assertEqual(len(self.database.reads), 1)
+
+        # snapshots bypass the cache
+        with ezspanner.snapshot():
+            CachedParent.objects.get_by_pk(1)
+        self.assertEqual(len(self.database.reads), 2)
+
+    def test_write_during_read(self):
+        self.assertEqual(CachedParent._meta.cache.ttl, 60)
+
+        # a concurrent write commits and invalidates the row while the read is running
+        def read(*args, **kwargs):
+            CachedParent(id_p=1, name='b').save(update_fields=['name'])
+            return iter([make_row(CachedParent, id_p=1, name='a')])
+
+        with mock.patch.object(self.database, 'read', side_effect=read):
+            self.assertEqual(CachedParent.objects.get_by_pk(1).name, 'a')
+        self.assertEqual(len(CachedParent._meta.cache), 0)
+
+    def test_invalidate_on_write(self):
+        obj = CachedParent.objects.get_by_pk(1)
+        obj.name = 'b'
+        obj.save(update_fields=['name'])
+        self.assertEqual(len(CachedParent._meta.cache), 0)
+
+        CachedParent.objects.get_by_pk(1)
+        CachedParent.objects.bulk_upsert([obj])
+        self.assertEqual(len(CachedParent._meta.cache), 0)
+
+    def test_invalidate_children_on_parent_delete(self):
+        self.database.rows = [make_row(CachedChild, id_p=1, id_c=2, value=3)]
+        CachedChild.objects.get_by_pk(1, 2)
+        CachedChild.objects.get_by_pk(1, 2)
+        self.assertEqual(len(self.database.reads), 1)
+
+        CachedParent(id_p=1).delete()
+        CachedChild.objects.get_by_pk(1, 2)
+        self.assertEqual(len(self.database.reads), 2)
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+from future.builtins import *
+
+from unittest import TestCase
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from ... import connection as connection_module
+from ...connection import Connection, POOL_FIXED, FixedSessionPool, BurstySessionPool
+
+
+class FakeSession(object):
+
+    def create(self):
+        pass
+
+    def exists(self):
+        return True
+
+    def delete(self):
+        pass
+
+
+class FakeDatabase(object):
+
+    def __init__(self, database_id, pool):
+        self.database_id = database_id
+        self._pool = pool
+        pool.bind(self)
+
+    def session(self):
+        return FakeSession()
+
+
+class FakeInstance(object):
+
+    def database(self, database_id, pool=None):
+        return FakeDatabase(database_id, pool)
+
+
+class FakeClient(object):
+    created = 0
+
+    def __init__(self, project=None):
+        FakeClient.created += 1
+
+    def instance(self, instance_id):
+        return FakeInstance()
+
+
+class ConnectionTests(TestCase):
+
+    def setUp(self):
+        FakeClient.created = 0
+        patcher = mock.patch.object(connection_module.spanner, 'Client', FakeClient)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(Connection.reset)
+        self.addCleanup(Connection.connection_configs.clear)
+
+    def test_get_is_cached(self):
+        Connection.add_config('instance', 'db', warm_up=False)
+        database = Connection.get()
+        self.assertIs(Connection.get(), database)
+        self.assertIs(Connection.get('default'), database)
+        self.assertEqual(FakeClient.created, 1)
+        self.assertIsInstance(Connection.get_pool(), BurstySessionPool)
+
+        # new config -> new connection
+        Connection.add_config('instance', 'other_db', warm_up=False)
+        self.assertEqual(Connection.get().database_id, 'other_db')
+        self.assertEqual(FakeClient.created, 2)
+
+    def test_invalid_connection_id(self):
+        self.assertRaises(ValueError, Connection.get, 'nope')
+
+    def test_pool_stats(self):
+        Connection.add_config('instance', 'db', pool_size=2, warm_up=False)
+        pool = Connection.get_pool()
+
+        session = pool.get()
+        pool.put(session)
+        pool.put(pool.get())
+        self.assertEqual(Connection.stats(), {'hits': 1, 'misses': 1, 'created': 1, 'discarded': 0})
+
+    def test_fixed_pool_warm_up(self):
+        Connection.add_config('instance', 'db', pool_type=POOL_FIXED, pool_size=3, warm_up=False)
+        pool = Connection.get_pool()
+        self.assertIsInstance(pool, FixedSessionPool)
+        # without warm up the pool is filled while binding
+        self.assertEqual(pool.stats.created, 3)
+
+        pool.put(pool.get())
+        self.assertEqual(pool.stats.hits, 1)
+
+    def test_reset_after_fork(self):
+        Connection.add_config('instance', 'db', warm_up=False)
+        database = Connection.get()
+        with mock.patch.object(connection_module.os, 'getpid', return_value=-1):
+            self.assertIsNot(Connection.get(), database)
+        self.assertEqual(FakeClient.created, 2)
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+from future.builtins import *
+
+from unittest import TestCase
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from google.cloud.proto.spanner.v1.query_plan_pb2 import QueryPlan
+from google.protobuf import json_format
+
+from ezspanner.connection import Connection
+from ezspanner.exceptions import QueryError, QueryPlanError
+from .helper import TestModelA, FakeDatabase
+
+
+def make_plan(nodes):
+    return json_format.ParseDict({'plan_nodes': nodes}, QueryPlan())
+
+
+def scan(index, scan_type, target, full_scan=False, rows=None):
+    metadata = {'scan_type': scan_type, 'scan_target': target}
+    if full_scan:
+        metadata['Full scan'] = 'true'
+    node = {'index': index, 'kind': 'RELATIONAL', 'display_name': 'Scan', 'metadata': metadata}
+    if rows is not None:
+        node['execution_stats'] = {'rows': {'total': rows, 'unit': 'rows'},
+                                   'latency': {'total': '0.5', 'unit': 'msecs'}}
+    return node
+
+
+# Distributed Union -> Filter -> full Table Scan of model_a
+FULL_SCAN_PLAN = [
+    {'index': 0, 'kind': 'RELATIONAL', 'display_name': 'Distributed Union', 'child_links': [{'child_index': 1}]},
+    {'index': 1, 'kind': 'RELATIONAL', 'display_name': 'Filter',
+     'child_links': [{'child_index': 2}, {'child_index': 3, 'type': 'Condition'}]},
+    scan(2, 'TableScan', 'model_a', full_scan=True, rows='2'),
+    {'index': 3, 'kind': 'SCALAR', 'display_name': 'Function', 'short_representation': {'description': '($id_a > 0)'}},
+]
+
+# index scan joined back to the base table, the map side on remote splits
+BACK_JOIN_PLAN = [
+    {'index': 0, 'kind': 'RELATIONAL', 'display_name': 'Distributed Cross Apply',
+     'child_links': [{'child_index': 1, 'type': 'Input'}, {'child_index': 2, 'type': 'Map'}]},
+    scan(1, 'IndexScan', 'model_a_int'),
+    {'index': 2, 'kind': 'RELATIONAL', 'display_name': 'Cross Apply',
+     'child_links': [{'child_index': 3, 'type': 'Input'}, {'child_index': 4, 'type': 'Map'}]},
+    scan(3, 'IndexScan', 'model_a_int'),
+    scan(4, 'TableScan', 'model_a'),
+]
+
+
+class ExplainTests(TestCase):
+
+    def setUp(self):
+        self.database = FakeDatabase(rows=[[1, 0, None, 0, 'abc'], [2, 0, None, 0, None]])
+        patcher = mock.patch.object(Connection, 'get', return_value=self.database)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_explain(self):
+        self.database.query_plan = make_plan(FULL_SCAN_PLAN)
+        qs = TestModelA.objects.filter(id_a__gt=0)
+        plan = qs.explain()
+
+        self.assertEqual(plan.sql, self.database.queries[0][0])
+        self.assertIsNone(qs.query_plan)
+        self.assertIsNone(plan.query_stats)
+        self.assertEqual([node.name for node in plan.walk()],
+                         ['Distributed Union', 'Filter', 'Table Scan: model_a'])
+        self.assertEqual(plan.nodes[3].description, '($id_a > 0)')
+        self.assertEqual(plan.table_scans(), [plan.nodes[2]])
+        self.assertEqual(plan.full_scans(), [plan.nodes[2]])
+        self.assertEqual(plan.back_joins(), [])
+        self.assertRaises(QueryPlanError, qs.explain, strict=True)
+
+        plan = qs.explain(analyze=True)
+        self.assertEqual(plan.query_stats['rows_returned'], '2')
+        self.assertEqual(plan.nodes[2].rows, 2)
+        self.assertEqual(plan.nodes[2].latency, (0.5, 'msecs'))
+        self.assertEqual(str(plan).splitlines()[-1],
+                         '    Table Scan: model_a [full scan] (rows: 2, latency: 0.5 msecs)')
+
+    def test_back_joins(self):
+        self.database.query_plan = make_plan(BACK_JOIN_PLAN)
+        plan = TestModelA.objects.filter(field_int_not_null=1).explain(strict=True)
+
+        (cross_apply, index_scan, table_scan), = plan.back_joins()
+        self.assertEqual((cross_apply.index, index_scan.index, table_scan.index), (2, 3, 4))
+        self.assertEqual(plan.distributed_cross_applies(), [plan.root])
+        self.assertEqual(plan.full_scans(), [])
+
+    def test_no_plan(self):
+        self.assertRaises(QueryError, TestModelA.objects.explain)
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+from future.builtins import *
+
+from unittest import TestCase
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from ezspanner.connection import Connection
+from ezspanner.instrumentation import Instrumentation, PRE_EXECUTE, POST_EXECUTE, MUTATION_BATCH
+from .helper import TestModelA, FakeDatabase
+
+
+class InstrumentationTests(TestCase):
+
+    def setUp(self):
+        self.database = FakeDatabase(rows=[[1, 0, None, 0, 'abc'], [2, 0, None, 0, None]])
+        patcher = mock.patch.object(Connection, 'get', return_value=self.database)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(Instrumentation.clear)
+
+        self.events = []
+        for event_type in (PRE_EXECUTE, POST_EXECUTE, MUTATION_BATCH):
+            Instrumentation.register(event_type, lambda event, event_type=event_type:
+                                     self.events.append((event_type, event)))
+
+    def test_query_events(self):
+        self.assertEqual(len(TestModelA.objects.filter(id_a__gt=0)), 2)
+
+        self.assertEqual([event_type for event_type, _ in self.events], [PRE_EXECUTE, POST_EXECUTE])
+        event = self.events[1][1]
+        self.assertIs(event, self.events[0][1])
+        self.assertEqual(event.method, 'execute_sql')
+        self.assertEqual(event.sql, self.database.queries[0][0])
+        self.assertIs(event.model, TestModelA)
+        self.assertEqual(event.rows, 2)
+        self.assertEqual(event.bytes, 6 * 8 + 3)
+        self.assertIsNotNone(event.latency)
+        self.assertEqual(event.retries, 0)
+        self.assertIsNone(event.query_stats)
+
+    def test_failing_hook_is_ignored(self):
+        Instrumentation.register(PRE_EXECUTE, lambda event: 1 / 0)
+        with mock.patch('ezspanner.instrumentation.logger') as logger:
+            self.assertEqual(len(list(TestModelA.objects.execute())), 2)
+        self.assertEqual(logger.exception.call_count, 1)
+        self.assertRaises(ValueError, Instrumentation.register, 'unknown', lambda event: None)
+
+    def test_mutation_events(self):
+        TestModelA.objects.bulk_delete([TestModelA(id_a=1), TestModelA(id_a=2)])
+
+        (event_type, event), = self.events
+        self.assertEqual(event_type, MUTATION_BATCH)
+        self.assertEqual(event.rows, 2)
+        self.assertEqual(event.commits, 1)
+        self.assertFalse(event.in_transaction)
+        self.assertIsNone(event.error)
+
+    def test_with_stats(self):
+        Instrumentation.clear()
+        qs = TestModelA.objects.with_stats()
+        self.assertIsNone(qs.query_stats)
+        list(qs)
+        self.assertEqual(qs.query_stats['rows_returned'], '2')
+        self.assertIsNone(qs.filter(id_a=1).query_stats)
@@ -2,12 +2,28 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 from future.builtins import *
 
+import pickle
 from unittest import TestCase
 
+import ezspanner
 from ... import SpannerModelRegistry
 from .helper import TestModelA, TestModelB, TestModelC, TestModelD
 
 
+class CompactModel(ezspanner.SpannerModel):
+    class Meta:
+        table = 'compact_model'
+        pk = ['id']
+        compact = True
+
+    id = ezspanner.IntField()
+    value = ezspanner.IntField(null=True)
+
+
+# only used for instance tests, keep the registry as defined in helper
+SpannerModelRegistry.registered_models.pop(CompactModel._meta.table)
+
+
 class SpannerModelTests(TestCase):
 
     def test_get_registered_models_in_correct_order(self):
@@ -26,25 +42,27 @@ class SpannerModelTests(TestCase):
         self.assertEqual(ddl_statements[0], """CREATE TABLE `model_a` (
 `id_a` INT64 NOT NULL,
 `field_int_not_null` INT64 NOT NULL,
-`field_int_null` INT64 NULL,
+`field_int_null` INT64,
 `field_string_not_null` INT64 NOT NULL,
-`field_string_null` STRING(200) NULL
-) PRIMARY KEY (`id_a` );""")
+`field_string_null` STRING(200)
+) PRIMARY KEY (`id_a`)""")
 
         # interleave index test
         # fixme: move to own test
 
-        self.assertEqual(ddl_statements[3], "CREATE INDEX `interleaved` ON `model_b` (`id_a` , `idb_b`  DESC, `value_field_x` , `value_field_y` ), INTERLEAVE IN `model_a`;")
+        self.assertEqual(ddl_statements[3], "CREATE INDEX `interleaved` ON `model_b` "
+                                            "(`id_a`, `idb_b` DESC, `value_field_x`, `value_field_y`), "
+                                            "INTERLEAVE IN `model_a`")
 
         # ModelD
         self.assertEqual(ddl_statements[6], """CREATE TABLE `model_d` (
 `id_a` INT64 NOT NULL,
 `id_b` INT64 NOT NULL,
-`value_field_x` INT64 NULL,
-`value_field_y` INT64 NULL,
-`value_field_z` STRING(5) NULL,
+`value_field_x` INT64,
+`value_field_y` INT64,
+`value_field_z` STRING(5),
 `id_d` INT64 NOT NULL
-) PRIMARY KEY (`id_a` , `id_b` ) INTERLEAVE IN `model_a ` ON DELETE CASCADE;""")
+) PRIMARY KEY (`id_a`, `id_b`), INTERLEAVE IN PARENT `model_a` ON DELETE CASCADE""")
 
     def test_prio_dict(self):
         prio_dict = SpannerModelRegistry.get_registered_models_prio_dict()
@@ -65,3 +83,24 @@ class SpannerModelTests(TestCase):
         self.assertEqual(ddl_statements[1], 'DROP TABLE `model_b`')
         self.assertEqual(ddl_statements[2], 'DROP TABLE `model_d`')
         self.assertEqual(ddl_statements[3], 'DROP TABLE `model_c`')
+
+
+class CompactModelTests(TestCase):
+
+    def test_compact_instances(self):
+        obj = CompactModel._from_row('db', ('id', 'value'), [1, 2])
+        self.assertIsInstance(obj, CompactModel)
+        self.assertIs(type(obj), CompactModel._meta.compact_class)
+        self.assertEqual((obj.id, obj.value, obj._state.db, obj._state.adding), (1, 2, 'db', False))
+
+        obj.value = 3
+        self.assertEqual(obj.get_dirty_fields(), ['value'])
+        obj._mark_clean(['value'])
+        self.assertEqual(obj.get_dirty_fields(), [])
+
+        copy = pickle.loads(pickle.dumps(obj, protocol=2))
+        self.assertEqual((type(copy), copy.value), (type(obj), 3))
+
+        # regular instances are unchanged
+        self.assertIsNone(TestModelA._meta.compact_class)
+        self.assertEqual(type(CompactModel(id=1)), CompactModel)
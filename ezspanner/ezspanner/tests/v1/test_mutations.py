@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+from future.builtins import *
+
+from unittest import TestCase
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from ...connection import Connection
+from ...mutations import Mutation, OP_INSERT, OP_DELETE, split_mutations
+from .helper import TestModelA, TestModelB, FakeDatabase
+
+
+def make_a(i):
+    return TestModelA(id_a=i, field_int_not_null=i, field_string_not_null=i)
+
+
+class MutationTests(TestCase):
+
+    def setUp(self):
+        self.database = FakeDatabase()
+        patcher = mock.patch.object(Connection, 'get', return_value=self.database)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_split_mutations(self):
+        mutations = [
+            Mutation(OP_INSERT, 'a', ['x', 'y'], [[i, i] for i in range(7)]),
+            Mutation(OP_DELETE, 'b', ['x'], [[i] for i in range(3)]),
+        ]
+        chunks = list(split_mutations(mutations, max_mutations=6))
+        self.assertEqual([[m.count() for m in chunk] for chunk in chunks], [[6], [6], [2, 3]])
+        self.assertRaises(ValueError, list, split_mutations(mutations, max_mutations=1))
+
+    def test_bulk_create(self):
+        objs = [make_a(i) for i in range(10)] + [TestModelB(id_a=1, id_b=i) for i in range(3)]
+        TestModelA.objects.bulk_create(objs)
+
+        self.assertEqual(len(self.database.commits), 1)
+        mutations = self.database.commits[0].mutations
+        self.assertEqual(len(mutations), 2)
+        op, table, columns, values = mutations[0]
+        self.assertEqual((op, table), ('insert', 'model_a'))
+        self.assertEqual(columns, ('id_a', 'field_int_not_null', 'field_int_null', 'field_string_not_null',
+                                   'field_string_null'))
+        self.assertEqual(len(values), 10)
+        self.assertEqual(mutations[1][1], 'model_b')
+        self.assertFalse(objs[0]._state.adding)
+
+    def test_bulk_create_splits_commits(self):
+        TestModelA.objects.bulk_create([make_a(i) for i in range(10)], max_mutations=20)
+        self.assertEqual([len(c.mutations[0][3]) for c in self.database.commits], [4, 4, 2])
+
+    def test_bulk_update_and_delete(self):
+        objs = [make_a(i) for i in range(1, 4)]
+        TestModelA.objects.bulk_update(objs, ['field_int_null'])
+        TestModelA.objects.bulk_delete(objs)
+
+        update, delete = [c.mutations[0] for c in self.database.commits]
+        self.assertEqual(update[:3], ('update', 'model_a', ('id_a', 'field_int_null')))
+        self.assertEqual(update[3], [[1, None], [2, None], [3, None]])
+        self.assertEqual(delete[3], [[1], [2], [3]])
+
+        self.assertRaises(ValueError, TestModelA.objects.bulk_update, objs, [])
+        self.assertRaises(ValueError, TestModelA.objects.bulk_upsert, [TestModelA()])
+
+    def test_save_writes_changed_fields(self):
+        obj = make_a(1)
+        obj.save()
+        self.assertEqual(self.database.commits[-1].mutations[0][0], 'insert')
+        self.assertEqual(obj.get_dirty_fields(), [])
+
+        # unchanged -> no round-trip
+        obj.save()
+        self.assertEqual(len(self.database.commits), 1)
+
+        obj.field_int_null = 5
+        obj.save()
+        self.assertEqual(self.database.commits[-1].mutations[0][:4],
+                         ('update', 'model_a', ('id_a', 'field_int_null'), [[1, 5]]))
+
+        loaded = TestModelA._from_row(None, ('id_a', 'field_int_null'), [2, None])
+        loaded.field_string_not_null = 3
+        self.assertEqual(loaded.get_dirty_fields(), ['field_string_not_null'])
+        loaded.save()
+        self.assertEqual(self.database.commits[-1].mutations[0][2], ('id_a', 'field_string_not_null'))
+
+        # changed primary key -> new row
+        loaded.id_a = 3
+        loaded.save(upsert=True)
+        self.assertEqual(self.database.commits[-1].mutations[0][0], 'insert_or_update')
@@ -2,15 +2,42 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 from future.builtins import *
 
+import datetime
+import threading
 from unittest import TestCase
 
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from google.cloud.spanner import INT64_PARAM_TYPE
+
+import ezspanner
+from ezspanner.aggregates import Count, Sum, Max, Avg, ApproxCountDistinct
+from ezspanner.connection import Connection
+
+from ezspanner.query import statement_cache
 from ezspanner.query_utils import Q, F
-from .helper import TestModelB, TestModelA
+from .helper import TestModelB, TestModelA, TestModelC, FakeBatchSnapshot, FakeDatabase
 from ...exceptions import SpannerIndexError, ModelError, QueryError, QueryJoinError
 
 
 class SpannerQuerysetTests(TestCase):
 
+    def use_database(self, rows=None):
+        """ Route all connections of the test to a new FakeDatabase. """
+        database = FakeDatabase(rows=rows)
+        patcher = mock.patch.object(Connection, 'get', return_value=database)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return database
+
     def test_valid_index(self):
         qs = TestModelB().objects
         qs = qs.index('over9000')
@@ -70,6 +97,30 @@ class SpannerQuerysetTests(TestCase):
             'WHERE ((`model_b`.`id_b` = @id_b AND `model_b`.`id_a` = @id_a) OR ( NOT (`model_b`.`id_b` = @id_b_1'
             ' AND `model_b`.`id_a` = @id_a_1) )) AND `model_b`.`value_field_z` = `model_b`.`id_a`')
 
+    def test_in(self):
+        qs = TestModelB.objects.filter(id_b__in=(1, 2, 3), id_a__gt=0).exclude(value_field_x__not_in=[4])
+        self.assertEqual(
+            qs._build_where(),
+            'WHERE `model_b`.`id_b` IN UNNEST(@id_b) AND `model_b`.`id_a` > @id_a AND '
+            '( NOT (`model_b`.`value_field_x` NOT IN UNNEST(@value_field_x)) )')
+        self.assertEqual(qs.params, {'id_b': [1, 2, 3], 'id_a': 0, 'value_field_x': [4]})
+        self.assertEqual(qs.param_types['id_b'].array_element_type, INT64_PARAM_TYPE)
+
+        # the sql doesn't depend on the number of values
+        self.assertIs(qs.filter(id_b__in=[])._compile(), qs.filter(id_b__in=range(5000))._compile())
+
+        # composite primary key
+        qs = TestModelB.objects.filter(pk__in=[(1, 2), (3, 4)])
+        self.assertEqual(qs._build_where(),
+                         'WHERE STRUCT<`id_a` INT64, `id_b` INT64>(`model_b`.`id_a`, `model_b`.`id_b`) IN UNNEST(@pk)')
+        self.assertEqual(qs.params, {'pk': [[1, 2], [3, 4]]})
+        self.assertEqual([f.name for f in qs.param_types['pk'].array_element_type.struct_type.fields], ['id_a', 'id_b'])
+        self.assertEqual(TestModelA.objects.filter(pk__in=[1])._build_where(),
+                         'WHERE `model_a`.`id_a` IN UNNEST(@id_a)')
+
+        self.assertRaises(QueryError, TestModelB.objects.filter(pk=(1, 2))._build_where)
+        self.assertRaises(QueryError, TestModelB.objects.filter(id_b__in=F('id_a'))._build_where)
+
     def test_join(self):
         qs = TestModelB.objects.join(TestModelA, on=dict(id_a=F(TestModelB, 'id_a')))
 
@@ -104,3 +155,368 @@ class SpannerQuerysetTests(TestCase):
 
         self.assertEqual(qs._build_joins(), 'INNER JOIN `model_a` ON `model_a`.`id_a` = `model_b`.`id_a` '
                                             'FULL JOIN `model_a` AS `t` ON `t`.`id_a` = `model_b`.`id_a`')
+
+    def test_clone_does_not_leak(self):
+        base = TestModelB.objects.filter(id_b=1)
+        joined = base.join(TestModelA, on=dict(id_a=F(TestModelB, 'id_a'))).values('value_field_x')
+        filtered = base.filter(id_a=2)
+
+        # the chained querysets must not modify the queryset they were cloned from
+        self.assertEqual(len(base.joins), 0)
+        self.assertEqual(base.field_lookup['id_a'], (TestModelB,))
+        self.assertIsNone(base.selected_fields.get(TestModelB))
+        self.assertEqual(joined.field_lookup['id_a'], (TestModelB, TestModelA))
+        self.assertEqual(len(joined.selected_fields[TestModelB]), 1)
+        self.assertEqual(base._build_where(), 'WHERE `model_b`.`id_b` = @id_b')
+        self.assertEqual(filtered._build_where(), 'WHERE `model_b`.`id_b` = @id_b AND `model_b`.`id_a` = @id_a')
+
+    def test_compiled_statement_cache(self):
+        qs_1 = TestModelB.objects.filter(Q(id_b=2) | Q(id_b=3), id_a=1)
+        qs_2 = TestModelB.objects.filter(Q(id_b=5) | Q(id_b=6), id_a=4)
+
+        # same shape -> same compiled statement, stable sql text
+        self.assertIs(qs_1._compile(), qs_2._compile())
+        self.assertEqual(qs_1.query, qs_1.query)
+        self.assertEqual(qs_1.params, {'id_b': 2, 'id_b_1': 3, 'id_a': 1})
+        self.assertEqual(qs_2.params, {'id_b': 5, 'id_b_1': 6, 'id_a': 4})
+        self.assertEqual(set(qs_2.param_types.keys()), {'id_b', 'id_b_1', 'id_a'})
+
+        # different shape
+        self.assertIsNot(qs_1.filter(id_b=7)._compile(), qs_1._compile())
+        self.assertIsNot(qs_1.values('id_b')._compile(), qs_1._compile())
+
+        self.assertIn(qs_1._get_shape(), statement_cache)
+
+    def test_hydration(self):
+        qs = TestModelB.objects.join(TestModelA, join_type=TestModelB.objects.JOIN_LEFT,
+                                     on=dict(id_a=F(TestModelB, 'id_a')))
+        self.use_database(rows=[
+            [1, 2, 3, 4, 'z', 1, 10, None, 11, 'a'],
+            [1, 5, None, None, None, None, None, None, None, None],
+        ])
+
+        rows = qs.execute(raw=True)
+        self.assertEqual(len(list(rows)), 2)
+
+        obj_1, obj_2 = list(qs)
+        self.assertIsInstance(obj_1, TestModelB)
+        self.assertEqual((obj_1.id_a, obj_1.id_b, obj_1.value_field_z), (1, 2, 'z'))
+        self.assertFalse(obj_1._state.adding)
+        self.assertIsInstance(obj_1.testmodela, TestModelA)
+        self.assertEqual(obj_1.testmodela.field_string_null, 'a')
+        self.assertIsNone(obj_2.testmodela)
+
+        # values() restricts the loaded fields
+        qs = qs.values(None, reset_all=True).values('id_b')
+        self.use_database(rows=[[7]])
+        obj = next(qs.execute(fetch_one=True))
+        self.assertEqual(obj.id_b, 7)
+
+    def test_get_by_pk(self):
+        qs = TestModelB.objects
+        database = self.use_database(rows=[[1, 2, 3, 4, 'z']])
+        obj = qs.get_by_pk(1, 2)
+        self.assertEqual((obj.id_a, obj.id_b, obj.value_field_z), (1, 2, 'z'))
+
+        table, columns, keyset, index, limit = database.reads[0]
+        self.assertEqual(table, 'model_b')
+        self.assertEqual(keyset.keys, [[1, 2]])
+
+        self.use_database(rows=[])
+        self.assertRaises(TestModelB.DoesNotExist, qs.get_by_pk, 1, 3)
+
+    def test_get_many(self):
+        qs = TestModelA.objects
+        # rows are returned in table order, instances in requested order
+        self.use_database(rows=[[1, 0, None, 0, None], [2, 0, None, 0, None], [3, 0, None, 0, None]])
+        self.assertEqual([obj.id_a for obj in qs.get_many([3, 1, 4, 2])], [3, 1, 2])
+
+    def test_index_read(self):
+        qs = TestModelB.objects
+        database = self.use_database(rows=[[1, 2, 3, 4, None]])
+        objs = qs.get_range(start=[1], end=[1], index='interleaved')
+        self.assertEqual(len(objs), 1)
+
+        table, columns, keyset, index, limit = database.reads[0]
+        self.assertEqual(index, 'interleaved')
+        # value_field_z is not stored in the index
+        self.assertEqual(columns, ['id_a', 'id_b', 'value_field_x', 'value_field_y'])
+        self.assertEqual(keyset.ranges[0].start_closed, [1])
+
+        self.assertRaises(QueryError, qs.values('value_field_z').get_many, [[1]], index='interleaved')
+        self.assertRaises(SpannerIndexError, qs.get_many, [[1]], index='nope')
+
+    def test_stale(self):
+        staleness = datetime.timedelta(seconds=10)
+        qs = TestModelA.objects.stale(exact_staleness=staleness)
+        database = self.use_database(rows=[[1, 0, None, 0, None]])
+        self.assertEqual(len(list(qs)), 1)
+        self.assertEqual(database.snapshots[0].options, {'exact_staleness': staleness})
+        self.assertEqual(len(database.queries), 1)
+
+        # strong reads don't use a snapshot
+        self.assertIsNone(qs.stale().read_options)
+        self.assertRaises(QueryError, qs.stale, exact_staleness=staleness, max_staleness=staleness)
+
+    def test_shared_snapshot(self):
+        database = self.use_database(rows=[[1, 0, None, 0, None]])
+        with ezspanner.snapshot(exact_staleness=datetime.timedelta(seconds=5)) as shared:
+            list(TestModelA.objects.filter(id_a=1))
+            TestModelA.objects.get_by_pk(1)
+            # stale() doesn't open a new snapshot inside a shared one
+            list(TestModelA.objects.stale(max_staleness=datetime.timedelta(seconds=1)))
+
+        self.assertEqual(len(database.snapshots), 1)
+        self.assertTrue(shared.begun)
+        self.assertTrue(shared.options['multi_use'])
+        self.assertEqual(len(database.queries), 2)
+        self.assertEqual(len(database.reads), 1)
+
+    def test_partitioned(self):
+        database = self.use_database(rows=[[i, 0, None, 0, None] for i in range(100)])
+
+        ids = sorted(obj.id_a for obj in TestModelA.objects.partitioned(workers=3, buffer_size=5))
+        self.assertEqual(ids, list(range(100)))
+        self.assertTrue(database.batch_snapshots[0].closed)
+
+        partitions = list(TestModelA.objects.partitioned(max_partitions=1, per_partition=True))
+        self.assertEqual(len(partitions), 1)
+        self.assertEqual(len(partitions[0][1]), 100)
+
+        # stop consuming early
+        results = TestModelA.objects.partitioned(buffer_size=1)
+        next(results)
+        results.close()
+        self.assertTrue(database.batch_snapshots[-1].closed)
+
+        # partitions are yielded as they finish
+        released = threading.Event()
+        process_query_batch = FakeBatchSnapshot.process_query_batch
+
+        def slow_first(snapshot, batch):
+            if batch['partition'] == 0:
+                released.wait(5)
+            return process_query_batch(snapshot, batch)
+
+        with mock.patch.object(FakeBatchSnapshot, 'process_query_batch', slow_first):
+            results = TestModelA.objects.partitioned(workers=2, per_partition=True)
+            self.assertEqual(next(results)[0]['partition'], 1)
+            released.set()
+            self.assertEqual(next(results)[0]['partition'], 0)
+            results.close()
+
+    def test_partitioned_unsupported(self):
+        database = self.use_database()
+        for qs in (TestModelA.objects.order_by('id_a'), TestModelA.objects.limit(10),
+                   TestModelA.objects.annotate(total=Count('id_a')), TestModelA.objects.prefetch_children(TestModelB),
+                   TestModelA.objects.stale(max_staleness=datetime.timedelta(seconds=10))):
+            self.assertRaises(QueryError, qs.partitioned)
+        self.assertEqual(database.batch_snapshots, [])
+
+        list(TestModelA.objects.stale(exact_staleness=datetime.timedelta(seconds=10)).partitioned())
+        self.assertEqual(database.batch_snapshots[0].options, {'exact_staleness': datetime.timedelta(seconds=10)})
+
+    def test_order_by_and_limit(self):
+        qs = TestModelB.objects.filter(id_a=1).order_by('-id_b', F(TestModelB, 'value_field_x')).limit(10, 20)
+        self.assertEqual(qs.query, 'SELECT `model_b`.`id_a`,`model_b`.`id_b`,`model_b`.`value_field_x`,'
+                                   '`model_b`.`value_field_y`,`model_b`.`value_field_z`\n'
+                                   'FROM `model_b`\n\n'
+                                   'WHERE `model_b`.`id_a` = @id_a\n'
+                                   'ORDER BY `model_b`.`id_b` DESC, `model_b`.`value_field_x`\n'
+                                   'LIMIT @limit\n'
+                                   'OFFSET @offset')
+        self.assertEqual(qs.params, {'id_a': 1, 'limit': 10, 'offset': 20})
+        self.assertRaises(ModelError, qs.order_by, 'nope')
+        self.assertRaises(QueryError, qs.limit, None, 10)
+
+    def test_paginate(self):
+        def rows(sql, params):
+            # emulate the seek predicate `id_a > @id_a` and the limit
+            ids = [i for i in range(10) if 'id_a' not in params or i > params['id_a']]
+            return [[i, 0, None, 0, None] for i in ids[:params['limit']]]
+
+        self.use_database(rows=rows)
+        pages = list(TestModelA.objects.filter(field_int_null=None).paginate(4))
+        self.assertEqual([[obj.id_a for obj in page] for page in pages], [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]])
+        self.assertEqual([page.has_next for page in pages], [True, True, False])
+
+        # resume after the first page
+        resumed = next(TestModelA.objects.filter(field_int_null=None).paginate(4, after=pages[0].cursor))
+        self.assertEqual([obj.id_a for obj in resumed], [4, 5, 6, 7])
+
+        self.assertRaises(QueryError, next, TestModelA.objects.order_by('-id_a').paginate(4, after=pages[0].cursor))
+
+    def test_seek_predicate(self):
+        qs = TestModelB.objects.filter(id_a=1).order_by('-value_field_x')
+        qs.seek = (qs._get_seek_ordering(), (3, 1, 2))
+        self.assertEqual(
+            qs._build_where(),
+            'WHERE (`model_b`.`id_a` = @id_a) AND ((`model_b`.`value_field_x` < @value_field_x OR '
+            '`model_b`.`value_field_x` IS NULL) OR '
+            '(`model_b`.`value_field_x` = @value_field_x_1 AND `model_b`.`id_a` > @id_a_1) OR '
+            '(`model_b`.`value_field_x` = @value_field_x_2 AND `model_b`.`id_a` = @id_a_2 AND '
+            '`model_b`.`id_b` > @id_b))')
+        self.assertEqual(qs.params, {'id_a': 1, 'value_field_x': 3, 'value_field_x_1': 3, 'id_a_1': 1,
+                                     'value_field_x_2': 3, 'id_a_2': 1, 'id_b': 2})
+
+        # NULLs sort first in ascending order and last in descending order
+        qs = TestModelB.objects.order_by('value_field_x')
+        qs.seek = (qs._get_seek_ordering(), (None, 1, 2))
+        self.assertEqual(
+            qs._build_where(),
+            'WHERE `model_b`.`value_field_x` IS NOT NULL OR '
+            '(`model_b`.`value_field_x` IS NULL AND `model_b`.`id_a` > @id_a) OR '
+            '(`model_b`.`value_field_x` IS NULL AND `model_b`.`id_a` = @id_a_1 AND `model_b`.`id_b` > @id_b)')
+        self.assertEqual(qs.params, {'id_a': 1, 'id_a_1': 1, 'id_b': 2})
+
+        qs = TestModelB.objects.order_by('-value_field_x')
+        qs.seek = (qs._get_seek_ordering(), (None, 1, 2))
+        self.assertEqual(
+            qs._build_where(),
+            'WHERE (`model_b`.`value_field_x` IS NULL AND `model_b`.`id_a` > @id_a) OR '
+            '(`model_b`.`value_field_x` IS NULL AND `model_b`.`id_a` = @id_a_1 AND `model_b`.`id_b` > @id_b)')
+        # the statement of a NULL seek value isn't shared with non-NULL values
+        self.assertNotIn('@value_field_x', qs._compile().sql)
+        qs = qs._clone()
+        qs.seek = (qs.seek[0], (3, 1, 2))
+        self.assertIn('`model_b`.`value_field_x` < @value_field_x', qs._compile().sql)
+
+    def test_result_cache(self):
+        database = self.use_database(rows=[[1, 0, None, 0, None], [2, 0, None, 0, None]])
+        qs = TestModelA.objects.filter(field_int_null=None)
+        self.assertTrue(qs)
+        self.assertEqual(len(qs), 2)
+        self.assertEqual([obj.id_a for obj in qs], [1, 2])
+        self.assertEqual(qs[1].id_a, 2)
+        self.assertEqual(qs.count(), 2)
+        self.assertEqual(len(database.queries), 1)
+
+        # Model.objects never shares a result cache
+        list(TestModelA.objects)
+        self.assertIsNone(TestModelA.objects._result_cache)
+
+    def test_slicing(self):
+        database = self.use_database(rows=[[1, 0, None, 0, None]])
+        qs = TestModelA.objects.order_by('id_a')[5:15]
+        self.assertEqual((qs.limit_value, qs.offset_value), (10, 5))
+        qs = qs[2:]
+        self.assertEqual((qs.limit_value, qs.offset_value), (8, 7))
+
+        self.assertEqual(TestModelA.objects[3].id_a, 1)
+        self.assertEqual(database.queries[-1][1], {'limit': 1, 'offset': 3})
+        self.assertRaises(ValueError, lambda: TestModelA.objects[-1])
+
+    def test_count_and_exists(self):
+        database = self.use_database(rows=[[3]])
+        qs = TestModelA.objects.filter(id_a=1).order_by('id_a')
+        self.assertEqual(qs.count(), 3)
+        self.assertEqual(database.queries[-1][0], 'SELECT COUNT(*)\nFROM `model_a`\n\nWHERE `model_a`.`id_a` = @id_a')
+
+        qs.limit(10, 5).count()
+        self.assertTrue(database.queries[-1][0].startswith('SELECT COUNT(*) FROM (\nSELECT 1\n'))
+
+        self.assertTrue(qs.exists())
+        self.assertEqual(database.queries[-1], ('SELECT 1\nFROM `model_a`\n\nWHERE `model_a`.`id_a` = @id_a\n'
+                                                'LIMIT @limit', {'id_a': 1, 'limit': 1}))
+
+    def test_as_columns(self):
+        self.use_database(rows=[[1, 2, None, 3, 'x'], [4, 5, 6, 7, None]])
+        columns = TestModelA.objects.as_columns(chunk_size=1)
+        self.assertEqual(list(columns), ['id_a', 'field_int_not_null', 'field_int_null', 'field_string_not_null',
+                                         'field_string_null'])
+        self.assertEqual(columns['id_a'].values.typecode, 'q')
+        self.assertEqual(list(columns['id_a'].values), [1, 4])
+        self.assertIsNone(columns['id_a'].mask)
+        self.assertEqual(list(columns['field_int_null'].values), [0, 6])
+        self.assertEqual(list(columns['field_int_null'].mask), [1, 0])
+        self.assertEqual(columns['field_string_null'].values, ['x', None])
+
+        if numpy is None:
+            return
+        arrays = TestModelA.objects.to_numpy()
+        self.assertEqual(arrays['id_a'].dtype, numpy.int64)
+        self.assertEqual(arrays['field_int_null'].tolist(), [None, 6])
+
+    def test_aggregate(self):
+        database = self.use_database(rows=[[3, 42, 2.5]])
+        result = TestModelB.objects.filter(id_a=1).order_by('id_b').aggregate(Count('*'), Sum('value_field_x'),
+                                                                                avg=Avg('value_field_y'))
+        self.assertEqual(result, {'count': 3, 'value_field_x__sum': 42, 'avg': 2.5})
+        self.assertEqual(database.queries[-1][0],
+                         'SELECT COUNT(*) AS `count`,SUM(`model_b`.`value_field_x`) AS `value_field_x__sum`,'
+                         'AVG(`model_b`.`value_field_y`) AS `avg`\nFROM `model_b`\n\nWHERE `model_b`.`id_a` = @id_a')
+
+        self.assertRaises(QueryError, TestModelB.objects.limit(5).aggregate, Count('*'))
+        self.assertRaises(QueryError, Sum, '*')
+        self.assertRaises(QueryError, TestModelB.objects.aggregate, Sum('unknown'))
+
+    def test_annotate(self):
+        database = self.use_database(rows=[[1, 2, 42], [3, 1, 12]])
+        qs = TestModelB.objects.filter(id_b__gt=0).values('id_a') \
+            .annotate(Count('*'), total=Sum('value_field_x')) \
+            .having(total__gt=10) \
+            .order_by('-total')
+        self.assertEqual(qs.query, 'SELECT `model_b`.`id_a`,COUNT(*) AS `count`,SUM(`model_b`.`value_field_x`) AS '
+                                   '`total`\nFROM `model_b`\n\nWHERE `model_b`.`id_b` > @id_b\n'
+                                   'GROUP BY `model_b`.`id_a`\nHAVING SUM(`model_b`.`value_field_x`) > @total\n'
+                                   'ORDER BY `total` DESC')
+        self.assertEqual(qs.params, {'id_b': 0, 'total': 10})
+        self.assertEqual(list(qs), [{'id_a': 1, 'count': 2, 'total': 42}, {'id_a': 3, 'count': 1, 'total': 12}])
+
+        # counting groups wraps the grouped query
+        database.rows = [[2]]
+        self.assertEqual(qs.having().count(), 2)
+        self.assertTrue(database.queries[-1][0].startswith('SELECT COUNT(*) FROM (\nSELECT `model_b`.`id_a`,'))
+
+        # explicit grouping columns, also of joined models
+        qs = TestModelB.objects.join(TestModelA, alias='a', fields=['field_int_null'],
+                                     on=dict(id_a=F(TestModelB, 'id_a'))) \
+            .group_by('id_a', F('a', 'field_int_null')) \
+            .annotate(m=Max(F('a', 'field_int_not_null')), n=ApproxCountDistinct('id_b'))
+        self.assertIn('GROUP BY `model_b`.`id_a`, `a`.`field_int_null`', qs.query)
+        self.assertIn('MAX(`a`.`field_int_not_null`) AS `m`', qs.query)
+        self.assertEqual(qs._get_result_names(), ['id_a', 'a.field_int_null', 'm', 'n'])
+
+        self.assertRaises(QueryError, qs.annotate, m=Count('*'))
+        self.assertRaises(QueryError, TestModelB.objects.annotate(total=Sum('value_field_x')).having(x__gt=1)
+                          ._build_query)
+
+        # empty having() conditions are ignored, FLOAT64 params are bound as floats
+        qs = TestModelB.objects.values('id_a').annotate(a=Avg('value_field_x'))
+        self.assertNotIn('HAVING', qs.having().having(Q()).query)
+        params = qs.having(a__gt=10, a__in=[1, 2]).params
+        self.assertEqual(params, {'a': 10.0, 'a_1': [1.0, 2.0]})
+        self.assertIsInstance(params['a'], float)
+        self.assertIsInstance(params['a_1'][0], float)
+
+    def test_prefetch_children(self):
+        self.use_database(rows=[
+            [1, 0, None, 0, None, [[1, 1, None, None, None, [[1, 1, 1], [1, 1, 2]]], [1, 2, 5, None, None, []]]],
+            [2, 0, None, 0, None, []],
+        ])
+        qs = TestModelA.objects.filter(id_a__in=[1, 2]).prefetch_children(TestModelB, TestModelC)
+        self.assertEqual(
+            qs.query,
+            'SELECT `model_a`.`id_a`,`model_a`.`field_int_not_null`,`model_a`.`field_int_null`,'
+            '`model_a`.`field_string_not_null`,`model_a`.`field_string_null`,'
+            'ARRAY(SELECT AS STRUCT `model_b`.`id_a`, `model_b`.`id_b`, `model_b`.`value_field_x`, '
+            '`model_b`.`value_field_y`, `model_b`.`value_field_z`, '
+            'ARRAY(SELECT AS STRUCT `model_c`.`id_a`, `model_c`.`id_b`, `model_c`.`id_c` FROM `model_c` '
+            'WHERE `model_c`.`id_a` = `model_b`.`id_a` AND `model_c`.`id_b` = `model_b`.`id_b` '
+            'ORDER BY `model_c`.`id_a`, `model_c`.`id_b`, `model_c`.`id_c`) AS `testmodelc_set` '
+            'FROM `model_b` WHERE `model_b`.`id_a` = `model_a`.`id_a` ORDER BY `model_b`.`id_a`, `model_b`.`id_b`) '
+            'AS `testmodelb_set`\nFROM `model_a`\n\nWHERE `model_a`.`id_a` IN UNNEST(@id_a)')
+
+        a_1, a_2 = qs
+        self.assertEqual([(b.id_b, b.value_field_x) for b in a_1.testmodelb_set], [(1, None), (2, 5)])
+        self.assertEqual([c.id_c for c in a_1.testmodelb_set[0].testmodelc_set], [1, 2])
+        self.assertEqual(a_1.testmodelb_set[1].testmodelc_set, [])
+        self.assertEqual(a_2.testmodelb_set, [])
+
+        # children of children without the intermediate model, custom attribute name
+        qs = TestModelA.objects.prefetch_children(leaves=TestModelC)
+        self.assertIn('WHERE `model_c`.`id_a` = `model_a`.`id_a` ORDER BY', qs.query)
+        self.assertNotIn('ARRAY(', TestModelA.objects.prefetch_children(TestModelB).prefetch_children().query)
+
+        self.assertRaises(QueryError, TestModelB.objects.prefetch_children, TestModelA)
+        self.assertRaises(QueryError, qs.prefetch_children, TestModelC)
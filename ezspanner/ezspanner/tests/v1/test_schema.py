@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+from future.builtins import *
+
+from unittest import TestCase
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from ezspanner.connection import Connection
+from ezspanner.models import SpannerModelRegistry
+from ezspanner.schema import ColumnSchema, IndexSchema, TableSchema, SQL_TABLES, SQL_COLUMNS, SQL_INDEXES, \
+    SQL_INDEX_COLUMNS, OP_ADD_COLUMN, OP_ALTER_COLUMN, OP_CREATE_INDEX, OP_CREATE_TABLE, OP_DROP_INDEX, update_ddl
+from .helper import TestModelA, TestModelB, TestModelC, TestModelD, FakeDatabase
+
+
+def information_schema(tables):
+    """
+    Build the INFORMATION_SCHEMA rows of TableSchemas.
+    """
+    rows = {SQL_TABLES: [], SQL_COLUMNS: [], SQL_INDEXES: [], SQL_INDEX_COLUMNS: []}
+    for table in tables:
+        rows[SQL_TABLES].append([table.name, table.parent, table.on_delete])
+        for column in table.columns.values():
+            rows[SQL_COLUMNS].append([table.name, column.name, column.type, 'YES' if column.nullable else 'NO'])
+        indices = [IndexSchema('PRIMARY_KEY', table.primary_key)] + list(table.indices.values())
+        for index in indices:
+            index_type = 'PRIMARY_KEY' if index.name == 'PRIMARY_KEY' else 'INDEX'
+            rows[SQL_INDEXES].append([table.name, index.name, index_type, index.interleave, index.unique])
+            for position, (column, descending) in enumerate(index.columns):
+                rows[SQL_INDEX_COLUMNS].append([table.name, index.name, column, position + 1,
+                                                'DESC' if descending else 'ASC'])
+            for column in sorted(index.storing):
+                rows[SQL_INDEX_COLUMNS].append([table.name, index.name, column, None, None])
+    return lambda sql, params: rows[sql]
+
+
+class SchemaTests(TestCase):
+
+    def setUp(self):
+        self.database = FakeDatabase()
+        patcher = mock.patch.object(Connection, 'get', return_value=self.database)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_no_changes(self):
+        self.database.rows = information_schema([TableSchema.from_model(model) for model in
+                                                 (TestModelA, TestModelB, TestModelD, TestModelC)])
+        diff = SpannerModelRegistry.migrate()
+        self.assertFalse(diff)
+        self.assertEqual(diff.warnings, [])
+        self.assertEqual(self.database.ddl_operations, [])
+
+    def test_migrate(self):
+        model_a = TableSchema.from_model(TestModelA)
+        # missing column, nullable column that should be NOT NULL
+        del model_a.columns['field_string_null']
+        model_a.columns['field_int_not_null'].nullable = True
+        model_b = TableSchema.from_model(TestModelB)
+        # missing index, removed index
+        del model_b.indices['interleaved']
+        model_b.indices['old_index'] = IndexSchema('old_index', [('value_field_z', False)])
+        # changed index, column that isn't part of the model, type that can't be changed
+        model_d = TableSchema.from_model(TestModelD)
+        model_d.indices['over9000'] = IndexSchema('over9000', [('value_field_x', False)])
+        model_d.columns['legacy'] = ColumnSchema('legacy', 'STRING(MAX)')
+        model_d.columns['value_field_y'].type = 'FLOAT64'
+        # model_c is missing
+        self.database.rows = information_schema([model_a, model_b, model_d])
+
+        progress = []
+        diff = SpannerModelRegistry.migrate(progress=lambda completed, total: progress.append((completed, total)),
+                                            poll_interval=0)
+
+        self.assertEqual([(change.op, change.table, change.name) for change in diff.changes], [
+            (OP_ALTER_COLUMN, 'model_a', 'field_int_not_null'),
+            (OP_ADD_COLUMN, 'model_a', 'field_string_null'),
+            (OP_CREATE_INDEX, 'model_b', 'interleaved'),
+            (OP_DROP_INDEX, 'model_b', 'old_index'),
+            (OP_DROP_INDEX, 'model_d', 'over9000'),
+            (OP_CREATE_INDEX, 'model_d', 'over9000'),
+            (OP_CREATE_TABLE, 'model_c', None),
+        ])
+        self.assertEqual(diff.statements, [
+            'DROP INDEX `old_index`',
+            'DROP INDEX `over9000`',
+            'CREATE TABLE `model_c` (\n`id_a` INT64 NOT NULL,\n`id_b` INT64 NOT NULL,\n`id_c` INT64 NOT NULL\n) '
+            'PRIMARY KEY (`id_a`, `id_b`, `id_c`), INTERLEAVE IN PARENT `model_b` ON DELETE CASCADE',
+            'ALTER TABLE `model_a` ADD COLUMN `field_string_null` STRING(200)',
+            'ALTER TABLE `model_a` ALTER COLUMN `field_int_not_null` INT64 NOT NULL',
+            'CREATE INDEX `interleaved` ON `model_b` (`id_a`, `idb_b` DESC, `value_field_x`, `value_field_y`), '
+            'INTERLEAVE IN `model_a`',
+            'CREATE INDEX `over9000` ON `model_d` (`idb_b` DESC, `value_field_x`, `value_field_y`)',
+        ])
+        self.assertEqual(len(diff.warnings), 2)
+
+        # all statements in one schema update
+        operation, = self.database.ddl_operations
+        self.assertEqual(operation.statements, diff.statements)
+        self.assertEqual(progress[0], (0, 7))
+        self.assertEqual(progress[-1], (7, 7))
+
+    def test_dry_run(self):
+        self.database.rows = information_schema([TableSchema.from_model(TestModelA)])
+        diff = SpannerModelRegistry.migrate(dry_run=True)
+        self.assertEqual([change.op for change in diff.changes], ([OP_CREATE_TABLE] + [OP_CREATE_INDEX] * 2) * 2 +
+                         [OP_CREATE_TABLE])
+        self.assertEqual(self.database.ddl_operations, [])
+
+    def test_update_ddl_batches(self):
+        self.assertEqual(update_ddl(self.database, ['a', 'b', 'c'], max_statements=2, sleep=lambda seconds: None), 2)
+        self.assertEqual([operation.statements for operation in self.database.ddl_operations], [['a', 'b'], ['c']])
+
+    def test_drop_table_statements(self):
+        ddl_statements = SpannerModelRegistry.drop_table_statements()
+        self.assertEqual(ddl_statements[0], 'DROP INDEX `over9000`')
+        self.assertEqual(ddl_statements[-4:], ['DROP TABLE `model_c`', 'DROP TABLE `model_d`', 'DROP TABLE `model_b`',
+                                               'DROP TABLE `model_a`'])
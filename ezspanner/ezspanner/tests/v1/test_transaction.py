@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+from future.builtins import *
+
+from unittest import TestCase
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+import ezspanner
+from ezspanner import transaction as transaction_module
+from ezspanner.connection import Connection
+from .helper import TestModelA, FakeDatabase, FakePool, FakeTransaction
+from ...exceptions import QueryError, TransactionError
+
+
+class TransactionTests(TestCase):
+
+    def setUp(self):
+        self.database = FakeDatabase(rows=[[1, 0, None, 0, None]])
+        self.pool = FakePool(self.database)
+        for name, value in (('get', self.database), ('get_pool', self.pool)):
+            patcher = mock.patch.object(Connection, name, return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(transaction_module.time, 'sleep')
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_decorator_buffers_mutations(self):
+        @ezspanner.atomic()
+        def unit_of_work():
+            obj = TestModelA.objects.get_by_pk(1)
+            obj.field_int_null = 2
+            obj.save(update_fields=['field_int_null'])
+            TestModelA.objects.bulk_delete([TestModelA(id_a=2), TestModelA(id_a=3)])
+            # nested blocks join the transaction
+            with ezspanner.atomic():
+                TestModelA(id_a=4, field_int_not_null=0, field_string_not_null=0).save(force_insert=True)
+            return obj
+
+        stats = transaction_module.get_stats()
+        self.assertEqual(unit_of_work().field_int_null, 2)
+
+        self.assertEqual(len(self.database.commits), 1)
+        transaction = self.database.commits[0]
+        self.assertIsInstance(transaction, FakeTransaction)
+        self.assertEqual([mutation[0] for mutation in transaction.mutations], ['update', 'delete', 'insert'])
+        self.assertEqual(transaction_module.get_stats()['commits'], stats['commits'] + 1)
+
+    def test_retry_aborted(self):
+        self.database.aborts = 2
+        calls = []
+        stats = transaction_module.get_stats()
+
+        self.assertEqual(TestModelA.objects.run_in_transaction(lambda: calls.append(1) or len(calls)), 3)
+        self.assertEqual(transaction_module.get_stats()['retries'], stats['retries'] + 2)
+        self.assertEqual(self.sleep.call_count, 2)
+
+        # the fake database retries without a server delay, the whole backoff is slept
+        self.sleep.reset_mock()
+        self.database.aborts = 2
+        with mock.patch.object(transaction_module.random, 'uniform', side_effect=lambda low, high: high):
+            ezspanner.atomic(base_backoff=1, max_backoff=1.5).run(lambda: None)
+        self.assertEqual([round(call[0][0], 1) for call in self.sleep.call_args_list], [1, 1.5])
+
+        self.database.aborts = 5
+        calls = []
+        self.assertRaises(TransactionError, ezspanner.atomic(max_retries=2).run, lambda: calls.append(1))
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(len(self.database.commits), 2)
+        self.assertLessEqual(max(ezspanner.atomic().get_backoff(i) for i in range(1, 20)),
+                             transaction_module.DEFAULT_MAX_BACKOFF)
+
+    def test_context_manager(self):
+        with ezspanner.atomic() as transaction:
+            self.assertEqual(len(list(TestModelA.objects.execute(transaction=True))), 1)
+            TestModelA(id_a=5).delete()
+            self.assertEqual(self.database.commits, [])
+        self.assertEqual(self.database.commits, [transaction])
+        self.assertEqual(self.pool.checked_out, 0)
+
+        try:
+            with ezspanner.atomic() as transaction:
+                TestModelA(id_a=5).delete()
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertTrue(transaction.rolled_back)
+        self.assertEqual(len(self.database.commits), 1)
+        self.assertEqual(self.pool.checked_out, 0)
+
+        self.assertRaises(QueryError, list, TestModelA.objects.execute(transaction=True))
+
+    def test_read_your_writes(self):
+        with ezspanner.atomic():
+            TestModelA(id_a=1).delete()
+            self.assertRaises(TestModelA.DoesNotExist, TestModelA.objects.get_by_pk, 1)
+
+            TestModelA(id_a=1, field_int_not_null=7, field_string_not_null=0).save(force_insert=True)
+            self.assertEqual(TestModelA.objects.get_by_pk(1).field_int_not_null, 7)
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+from future.builtins import *
+
+import threading
+from unittest import TestCase
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+import ezspanner
+from ezspanner.connection import Connection
+from ezspanner.writebehind import WriteBehindBuffer
+from .helper import TestModelA, TestModelB, FakeDatabase, FakePool
+from ...exceptions import WriteBehindError
+
+
+def make_a(id_a, value=0):
+    return TestModelA(id_a=id_a, field_int_not_null=value, field_string_not_null=0)
+
+
+class WriteBehindTests(TestCase):
+
+    def setUp(self):
+        self.database = FakeDatabase(rows=[])
+        for name, value in (('get', self.database), ('get_pool', FakePool(self.database))):
+            patcher = mock.patch.object(Connection, name, return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_coalesce(self):
+        with ezspanner.write_behind() as write_buffer:
+            obj = make_a(1)
+            obj.save(force_insert=True)
+            for i in range(10):
+                obj.field_int_not_null = i
+                obj.save()
+            make_a(2).save(force_insert=True)
+            TestModelB(id_a=2, id_b=1).save(force_insert=True)
+            TestModelB(id_a=1, id_b=1).save(force_insert=True)
+            # cascades to the buffered child row (2, 1)
+            TestModelA(id_a=2).delete()
+
+            # key reads see the buffered writes
+            self.assertEqual(TestModelA.objects.get_by_pk(1).field_int_not_null, 9)
+            self.assertRaises(TestModelA.DoesNotExist, TestModelA.objects.get_by_pk, 2)
+            self.assertRaises(TestModelB.DoesNotExist, TestModelB.objects.get_by_pk, 2, 1)
+            self.assertEqual(self.database.commits, [])
+
+        # no child row is written before the delete of its parent
+        (batch,), = [self.database.commits]
+        self.assertEqual(batch.mutations, [
+            ('insert', 'model_a', ('id_a', 'field_int_not_null', 'field_int_null', 'field_string_not_null',
+                                   'field_string_null'), [[1, 9, None, 0, None]]),
+            ('insert', 'model_b', ('id_a', 'id_b', 'value_field_x', 'value_field_y', 'value_field_z'),
+             [[1, 1, None, None, None]]),
+            ('delete', 'model_a', None, [[2]]),
+        ])
+        self.assertEqual(write_buffer.stats.as_dict(),
+                         {'writes': 14, 'rows': 3, 'flushes': 1, 'commits': 1, 'errors': 0})
+
+    def test_flush_triggers(self):
+        clock = [0]
+        write_buffer = WriteBehindBuffer(self.database, max_rows=3, max_delay=5, timer=lambda: clock[0])
+        with ezspanner.context.use_write_buffer(self.database, write_buffer):
+            make_a(1).save(force_insert=True)
+            make_a(2).save(force_insert=True)
+            self.assertEqual(len(write_buffer), 2)
+            make_a(3).save(force_insert=True)
+            self.assertEqual((len(write_buffer), len(self.database.commits)), (0, 1))
+
+            make_a(4).save(force_insert=True)
+            clock[0] = 5
+            make_a(5).save(force_insert=True)
+            self.assertEqual((len(write_buffer), len(self.database.commits)), (0, 2))
+
+            # writes that can't be coalesced flush the earlier write first
+            TestModelA(id_a=6).delete()
+            TestModelA(id_a=6, field_int_not_null=1).save(update_fields=['field_int_not_null'])
+            self.assertEqual(len(self.database.commits), 3)
+
+            # transactions see all previous writes
+            make_a(7).save(force_insert=True)
+            with ezspanner.atomic():
+                self.assertEqual(len(self.database.commits), 4)
+                self.assertEqual(len(write_buffer), 0)
+                make_a(8).save(force_insert=True)
+            self.assertEqual(len(write_buffer), 0)
+
+    def test_flush_error(self):
+        errors = []
+        with mock.patch.object(self.database, 'batch', side_effect=RuntimeError('unavailable')):
+            with ezspanner.write_behind(on_error=errors.append):
+                make_a(1).save(force_insert=True)
+
+            (error,) = errors
+            self.assertIsInstance(error, WriteBehindError)
+            self.assertEqual(error.mutations[0].values, [[1, 0, None, 0, None]])
+
+            with self.assertRaises(WriteBehindError):
+                with ezspanner.write_behind():
+                    make_a(1).save(force_insert=True)
+
+    def test_decorator_threads(self):
+        entered = threading.Event()
+        exited = threading.Event()
+
+        @ezspanner.write_behind()
+        def handler(id_a, first):
+            make_a(id_a).save(force_insert=True)
+            if first:
+                # leave the block while the other thread is still in its own
+                entered.wait(5)
+            else:
+                entered.set()
+                exited.wait(5)
+
+        first = threading.Thread(target=handler, args=(1, True))
+        second = threading.Thread(target=handler, args=(2, False))
+        first.start()
+        second.start()
+        first.join(5)
+        self.assertEqual([batch.mutations[0][3] for batch in self.database.commits], [[[1, 0, None, 0, None]]])
+        exited.set()
+        second.join(5)
+        self.assertEqual([batch.mutations[0][3] for batch in self.database.commits],
+                         [[[1, 0, None, 0, None]], [[2, 0, None, 0, None]]])
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""
+Read-write transactions.
+
+```
+@ezspanner.atomic()
+def transfer(from_id, to_id, amount):
+    source = Account.objects.get_by_pk(from_id)
+    target = Account.objects.get_by_pk(to_id)
+    source.balance -= amount
+    target.balance += amount
+    Account.objects.bulk_update([source, target], ['balance'])
+```
+
+Within an atomic block all querysets of the connection read through the transaction and `save()`, `delete()` and the
+bulk operations buffer their mutations in it, they are committed together when the block is left. Mutations only
+become visible to sql queries after the commit, key reads (`get_by_pk`, `get_many`) see the buffered writes.
+
+Only the decorator form (or `atomic().run(func)`) can retry aborted transactions since the whole unit of work has to
+be run again, the context manager form raises the abort error instead. `Session.run_in_transaction` runs the
+retries and waits for the retry delay the server attaches to an abort, aborts without one are retried after an
+exponential backoff with jitter. Nested atomic blocks join the outer transaction.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+import functools
+import random
+import threading
+import time
+
+from .cache import invalidate_mutations
+from .connection import Connection
+from .context import get_transaction, get_write_buffer, use_transaction
+from .exceptions import TransactionError
+from .mutations import apply_pending
+
+DEFAULT_MAX_RETRIES = 10
+# seconds, the backoff before the n-th retry is a random value up to min(max_backoff, base_backoff * 2 ** (n - 1))
+DEFAULT_BASE_BACKOFF = 0.02
+DEFAULT_MAX_BACKOFF = 1.0
+
+
+class TransactionStats(object):
+    """
+    Thread-safe transaction counters.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.commits = 0
+        self.retries = 0
+        self.rollbacks = 0
+
+    def incr(self, counter, value=1):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + value)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'commits': self.commits,
+                'retries': self.retries,
+                'rollbacks': self.rollbacks,
+            }
+
+
+stats = TransactionStats()
+
+
+class TransactionState(object):
+    """
+    A transaction and the mutations that were buffered in it.
+    """
+
+    def __init__(self, database, transaction):
+        self.database = database
+        self.transaction = transaction
+        self.mutations = []
+        # (table, key tuple) -> (complete row, column -> value dict) or None for deleted rows
+        self.pending = {}
+        # 1 for the first attempt, incremented for each retry of an aborted transaction
+        self.attempt = 1
+
+    def buffer(self, mutations):
+        """
+        Add mutations to the transaction.
+
+        :type mutations: list[ezspanner.mutations.Mutation]
+        """
+        from .models import SpannerModelRegistry
+        from .mutations import OP_DELETE, OP_UPDATE
+
+        for mutation in mutations:
+            mutation.apply(self.transaction)
+            self.mutations.append(mutation)
+
+            model = SpannerModelRegistry.registered_models.get(mutation.table)
+            if model is None:
+                continue
+            positions = [mutation.columns.index(column) for column in model._meta.primary.get_field_names()]
+            for row in mutation.values:
+                key = (mutation.table, tuple(row[i] for i in positions))
+                if mutation.op == OP_DELETE:
+                    self.pending[key] = None
+                    continue
+
+                values = dict(zip(mutation.columns, row))
+                pending = self.pending.get(key)
+                if mutation.op == OP_UPDATE and pending is not None:
+                    # merge into the already buffered row
+                    values = dict(pending[1], **values)
+                    self.pending[key] = (pending[0], values)
+                else:
+                    self.pending[key] = (mutation.op != OP_UPDATE, values)
+
+    def apply_pending(self, model, keys, by_key, db=None):
+        """
+        Apply the buffered writes to rows that were read by primary key, see ezspanner.mutations.apply_pending.
+        """
+        apply_pending(self.pending, model, keys, by_key, db)
+
+
+class atomic(object):
+    """
+    Run a unit of work in a read-write transaction, usable as decorator and context manager.
+    """
+
+    def __init__(self, connection_id=None, max_retries=DEFAULT_MAX_RETRIES, base_backoff=DEFAULT_BASE_BACKOFF,
+                 max_backoff=DEFAULT_MAX_BACKOFF):
+        """
+        :param connection_id:
+        :param max_retries: max number of retries of aborted transactions (decorator form only)
+        :param base_backoff: see DEFAULT_BASE_BACKOFF
+        :param max_backoff: see DEFAULT_MAX_BACKOFF
+        """
+        self.connection_id = connection_id
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        # one entry per (nested) __enter__: None when joining an outer transaction
+        self._entries = []
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            return self.run(func, *args, **kwargs)
+        return wrapper
+
+    def get_backoff(self, retry):
+        """
+        :param retry: number of the retry, starting at 1
+        :return: seconds to wait before the retry (exponential backoff with full jitter)
+        """
+        return random.uniform(0, min(self.max_backoff, self.base_backoff * 2 ** (retry - 1)))
+
+    def run(self, func, *args, **kwargs):
+        """
+        Run `func(*args, **kwargs)` in a transaction, the whole call is retried if the transaction is aborted.
+
+        :return: return value of `func`
+        """
+        database = Connection.get(self.connection_id)
+        if get_transaction(database) is not None:
+            return func(*args, **kwargs)
+        flush_write_buffer(database)
+
+        attempts = [0]
+        outcome = {}
+        # end of the last attempt's unit of work
+        finished = [None]
+
+        def unit_of_work(transaction):
+            # run_in_transaction calls this again each time the transaction is aborted, it only waits if the server
+            # attached a retry delay to the abort: sleep whatever is left of the backoff
+            attempts[0] += 1
+            if attempts[0] > 1:
+                retry = attempts[0] - 1
+                if retry > self.max_retries:
+                    raise TransactionError("Transaction was aborted %s times, giving up." % self.max_retries)
+                stats.incr('retries')
+                delay = self.get_backoff(retry) - (time.time() - finished[0])
+                if delay > 0:
+                    time.sleep(delay)
+
+            state = TransactionState(database, transaction)
+            state.attempt = attempts[0]
+            try:
+                with use_transaction(database, state):
+                    outcome['result'] = func(*args, **kwargs)
+            finally:
+                finished[0] = time.time()
+            outcome['state'] = state
+
+        try:
+            database.run_in_transaction(unit_of_work)
+        except Exception:
+            stats.incr('rollbacks')
+            raise
+
+        stats.incr('commits')
+        invalidate_mutations(outcome['state'].mutations)
+        return outcome['result']
+
+    def __enter__(self):
+        database = Connection.get(self.connection_id)
+        state = get_transaction(database)
+        if state is not None:
+            self._entries.append(None)
+            return state.transaction
+        flush_write_buffer(database)
+
+        pool = Connection.get_pool(self.connection_id)
+        session = pool.get()
+        try:
+            transaction = session.transaction()
+            transaction.begin()
+        except Exception:
+            pool.put(session)
+            raise
+
+        state = TransactionState(database, transaction)
+        context = use_transaction(database, state)
+        context.__enter__()
+        self._entries.append((pool, session, state, context))
+        return transaction
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        entry = self._entries.pop()
+        if entry is None:
+            return
+
+        pool, session, state, context = entry
+        try:
+            context.__exit__(exc_type, exc_val, exc_tb)
+            if exc_type is None:
+                try:
+                    state.transaction.commit()
+                except Exception:
+                    stats.incr('rollbacks')
+                    raise
+                stats.incr('commits')
+                invalidate_mutations(state.mutations)
+            else:
+                state.transaction.rollback()
+                stats.incr('rollbacks')
+        finally:
+            pool.put(session)
+
+
+def flush_write_buffer(database):
+    """
+    Commit the writes of an active write_behind() block before a transaction starts.
+    """
+    write_buffer = get_write_buffer(database)
+    if write_buffer is not None:
+        write_buffer.flush()
+
+
+def get_stats():
+    """
+    :rtype: dict
+    :return: commits, retries and rollbacks of all atomic blocks since the process started
+    """
+    return stats.as_dict()
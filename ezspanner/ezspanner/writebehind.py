@@ -0,0 +1,348 @@
+# -*- coding: utf-8 -*-
+"""
+Write-behind buffering of mutations.
+
+```
+with ezspanner.write_behind(max_rows=500, max_delay=1.0):
+    for event in events:
+        counter = Counter.objects.get_by_pk(event.counter_id)
+        counter.value += 1
+        counter.save()
+```
+
+Within a write_behind block `save()`, `delete()` and the bulk operations don't commit their mutations, they are
+added to a per-thread buffer instead. Writes to the same row (table and primary key) are coalesced into a single
+mutation, e.g. ten updates of a counter become one update with the last value. Deleting a row drops the buffered
+writes of its interleaved children if the delete cascades to them.
+
+The buffer is flushed - committed in as few batches as possible - when
+
+- it holds `max_rows` rows,
+- a write happens and the oldest buffered write is older than `max_delay` seconds,
+- `flush()` is called,
+- an `atomic()` transaction starts (the transaction sees all previous writes),
+- the block is left (also if it is left with an exception).
+
+Durability: a write is only durable once its flush committed, a crash of the process loses the buffered writes.
+Errors that the database raises for a write (e.g. inserting an existing row) are raised by the flush, not by the
+`save()` call that caused them. A failing flush drops the buffered writes, the batches committed before the failing
+one stay committed. The writes are reported with a WriteBehindError, which is raised by the call that triggered the
+flush or passed to `on_error`.
+
+Key reads (`get_by_pk`, `get_many`) within the block see the buffered writes, sql queries only see flushed writes.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+import functools
+import logging
+import time
+from collections import OrderedDict
+
+import six
+
+from .connection import Connection
+from .context import get_write_buffer, use_write_buffer
+from .exceptions import WriteBehindError
+from .mutations import MAX_MUTATIONS_PER_COMMIT, Mutation, OP_DELETE, OP_INSERT, OP_UPDATE, OP_UPSERT, \
+    apply_pending, commit_mutations
+
+logger = logging.getLogger('ezspanner')
+
+DEFAULT_MAX_ROWS = 500
+# seconds
+DEFAULT_MAX_DELAY = 1.0
+
+
+class BufferedRow(object):
+    """
+    The coalesced writes of one row.
+    """
+    __slots__ = ('deleted', 'op', 'values')
+
+    def __init__(self, op, values):
+        # True if the row is deleted before `op` is applied
+        self.deleted = op == OP_DELETE
+        # OP_INSERT, OP_UPDATE, OP_UPSERT or None
+        self.op = None if op == OP_DELETE else op
+        # column -> value
+        self.values = values
+
+    def merge(self, op, values):
+        """
+        Coalesce a later write into this row.
+
+        :return: False if the writes can't be combined into one mutation without changing their outcome
+        """
+        if op == OP_DELETE:
+            self.deleted, self.op, self.values = True, None, None
+        elif self.op is None:
+            # the row was deleted, only a write that creates it can follow
+            if op == OP_UPDATE:
+                return False
+            self.op, self.values = OP_INSERT, values
+        elif op == OP_INSERT or (op == OP_UPSERT and self.op == OP_UPDATE):
+            return False
+        else:
+            # update / upsert of a row that is inserted, upserted or updated
+            self.values.update(values)
+        return True
+
+    def get_pending(self):
+        """
+        :return: (complete row, column -> value dict) or None, see ezspanner.mutations.apply_pending
+        """
+        if self.op is None:
+            return None
+        return self.op != OP_UPDATE, self.values
+
+
+class WriteBehindStats(object):
+    """
+    Counters of a write-behind buffer.
+    """
+
+    def __init__(self):
+        # rows added to the buffer
+        self.writes = 0
+        # rows written by flushes
+        self.rows = 0
+        self.flushes = 0
+        self.commits = 0
+        self.errors = 0
+
+    def as_dict(self):
+        return {
+            'writes': self.writes,
+            'rows': self.rows,
+            'flushes': self.flushes,
+            'commits': self.commits,
+            'errors': self.errors,
+        }
+
+
+class WriteBehindBuffer(object):
+    """
+    Coalescing mutation buffer of one database, used by a single thread.
+    """
+
+    def __init__(self, database, max_rows=DEFAULT_MAX_ROWS, max_delay=DEFAULT_MAX_DELAY,
+                 max_mutations=MAX_MUTATIONS_PER_COMMIT, on_error=None, timer=time.time):
+        """
+        :type database: google.cloud.spanner.database.Database
+        :param max_rows: flush when the buffer holds this many rows
+        :param max_delay: seconds, flush on the next write if the oldest buffered write is older (None: no limit)
+        :param max_mutations: max mutations per commit
+        :param on_error: callable that receives the WriteBehindError of a failed flush instead of raising it
+        :param timer:
+        """
+        self.database = database
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.max_mutations = max_mutations
+        self.on_error = on_error
+        self.timer = timer
+        self.stats = WriteBehindStats()
+        # (table, key tuple) -> BufferedRow, in the order of the rows' first (or last deleting) write
+        self.rows = OrderedDict()
+        # (table, key tuple) -> see BufferedRow.get_pending
+        self.pending = {}
+        # timer() of the oldest buffered write
+        self._first_write = None
+
+    def __len__(self):
+        return len(self.rows)
+
+    def add(self, mutations):
+        """
+        Add mutations to the buffer, flushes if `max_rows` or `max_delay` are exceeded.
+
+        :type mutations: list[ezspanner.mutations.Mutation]
+        """
+        from .models import SpannerModelRegistry
+
+        for mutation in mutations:
+            model = SpannerModelRegistry.registered_models.get(mutation.table)
+            if model is None:
+                # rows can't be coalesced without knowing their key, keep the write order
+                self.flush()
+                commit_mutations(self.database, [mutation], self.max_mutations, write_behind=False)
+                continue
+
+            positions = [mutation.columns.index(column) for column in model._meta.primary.get_field_names()]
+            for row in mutation.values:
+                key = tuple(row[i] for i in positions)
+                if mutation.op == OP_DELETE:
+                    self._drop_cascaded(model, key)
+                self._add_row(mutation.table, key, mutation.op,
+                              None if mutation.op == OP_DELETE else OrderedDict(zip(mutation.columns, row)))
+
+        if len(self.rows) >= self.max_rows or (self.max_delay is not None and self._first_write is not None and
+                                               self.timer() - self._first_write >= self.max_delay):
+            self.flush()
+
+    def _add_row(self, table, key, op, values):
+        self.stats.writes += 1
+        row_key = (table, key)
+        row = self.rows.get(row_key)
+        if row is None:
+            row = self.rows[row_key] = BufferedRow(op, values)
+        elif not row.merge(op, values):
+            self.flush()
+            row = self.rows[row_key] = BufferedRow(op, values)
+        elif op == OP_DELETE:
+            # deletes cascade to interleaved child rows, apply them after all earlier writes
+            del self.rows[row_key]
+            self.rows[row_key] = row
+
+        self.pending[row_key] = row.get_pending()
+        if self._first_write is None:
+            self._first_write = self.timer()
+
+    def _drop_cascaded(self, model, key):
+        """
+        Drop the buffered writes of interleaved rows below a deleted row: the delete is applied after them and
+        cascades to them, a buffered insert of a child would be committed before the delete of its parent instead.
+        """
+        from .models import SpannerModelRegistry
+
+        tables = set()
+        for child in SpannerModelRegistry.get_interleaved_children(model):
+            parent = child
+            while parent is not model and parent._meta.parent_on_delete == 'CASCADE':
+                parent = parent._meta.parent
+            if parent is model:
+                tables.add(child._meta.table)
+        if not tables:
+            return
+
+        for row_key in [row_key for row_key in self.rows if row_key[0] in tables and row_key[1][:len(key)] == key]:
+            del self.rows[row_key]
+            self.pending[row_key] = None
+
+    def apply_pending(self, model, keys, by_key, db=None):
+        """
+        Apply the buffered writes to rows that were read by primary key, see ezspanner.mutations.apply_pending.
+        """
+        apply_pending(self.pending, model, keys, by_key, db)
+
+    def get_mutations(self):
+        """
+        Build the mutations of the buffered rows, consecutive rows with the same operation and columns are grouped.
+
+        :rtype: list[ezspanner.mutations.Mutation]
+        """
+        from .models import SpannerModelRegistry
+
+        mutations = []
+
+        def append(op, table, columns, values):
+            last = mutations[-1] if mutations else None
+            if last is None or (last.op, last.table, last.columns) != (op, table, columns):
+                last = Mutation(op, table, columns)
+                mutations.append(last)
+            last.values.append(values)
+
+        for (table, key), row in six.iteritems(self.rows):
+            if row.deleted:
+                model = SpannerModelRegistry.registered_models[table]
+                append(OP_DELETE, table, tuple(model._meta.primary.get_field_names()), list(key))
+            if row.op is not None:
+                append(row.op, table, tuple(row.values.keys()), list(row.values.values()))
+        return mutations
+
+    def flush(self):
+        """
+        Commit the buffered writes.
+
+        :raises WriteBehindError: if committing failed and no `on_error` handler is set
+        :rtype: int
+        :return: number of commits
+        """
+        if not self.rows:
+            return 0
+
+        mutations = self.get_mutations()
+        rows = len(self.rows)
+        self.rows = OrderedDict()
+        self.pending = {}
+        self._first_write = None
+
+        self.stats.flushes += 1
+        try:
+            commits = commit_mutations(self.database, mutations, self.max_mutations, write_behind=False)
+        except Exception as e:
+            self.stats.errors += 1
+            error = WriteBehindError("Flushing %s buffered rows failed: %r" % (rows, e), mutations)
+            if self.on_error is None:
+                six.raise_from(error, e)
+            self.on_error(error)
+            return 0
+
+        self.stats.rows += rows
+        self.stats.commits += commits
+        return commits
+
+
+class write_behind(object):
+    """
+    Buffer and coalesce the writes of the current thread, usable as decorator and context manager.
+
+    Nested blocks join the outer buffer.
+    """
+
+    def __init__(self, connection_id=None, max_rows=DEFAULT_MAX_ROWS, max_delay=DEFAULT_MAX_DELAY,
+                 max_mutations=MAX_MUTATIONS_PER_COMMIT, on_error=None):
+        """
+        :param connection_id:
+        :param max_rows: see WriteBehindBuffer
+        :param max_delay: see WriteBehindBuffer
+        :param max_mutations: see WriteBehindBuffer
+        :param on_error: see WriteBehindBuffer
+        """
+        self.connection_id = connection_id
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.max_mutations = max_mutations
+        self.on_error = on_error
+        # one entry per (nested) __enter__: None when joining an outer buffer
+        self._entries = []
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            # a fresh block per call, concurrent calls of the decorated function must not share _entries
+            with write_behind(self.connection_id, max_rows=self.max_rows, max_delay=self.max_delay,
+                              max_mutations=self.max_mutations, on_error=self.on_error):
+                return func(*args, **kwargs)
+        return wrapper
+
+    def __enter__(self):
+        """
+        :rtype: WriteBehindBuffer
+        """
+        database = Connection.get(self.connection_id)
+        write_buffer = get_write_buffer(database)
+        if write_buffer is not None:
+            self._entries.append(None)
+            return write_buffer
+
+        write_buffer = WriteBehindBuffer(database, max_rows=self.max_rows, max_delay=self.max_delay,
+                                         max_mutations=self.max_mutations, on_error=self.on_error)
+        context = use_write_buffer(database, write_buffer)
+        context.__enter__()
+        self._entries.append((write_buffer, context))
+        return write_buffer
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        entry = self._entries.pop()
+        if entry is None:
+            return
+
+        write_buffer, context = entry
+        context.__exit__(exc_type, exc_val, exc_tb)
+        try:
+            write_buffer.flush()
+        except WriteBehindError:
+            if exc_type is None:
+                raise
+            # don't hide the exception that left the block
+            logger.exception("[EZSpanner] flushing the write-behind buffer failed")